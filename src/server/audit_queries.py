@@ -0,0 +1,382 @@
+"""
+MongoManager 查询计划审计
+
+在填充了测试数据的数据库上对 MongoManager 产生的每种查询形状执行 explain()，
+报告全表扫描（COLLSCAN）、内存排序（SORT）以及扫描/返回比过高的查询，
+并按 ESR 规则（等值 -> 排序 -> 范围）给出缺失的索引建议。
+更新和删除通过等价的 find 解释（查询规划器相同），聚合按其开头的 $match/$sort 解释。
+发出查询的 MongoManager 方法如果不在查询形状列表中，报告末尾会列出，避免列表与代码脱节。
+
+用法:
+    python audit_queries.py                      # 在临时库 <MONGO_DB_NAME>_query_audit 中填充数据并审计
+    python audit_queries.py --create             # 同时创建建议的索引并重新审计
+    python audit_queries.py --live               # 只读审计配置的数据库（只执行explain，不填充数据、不建索引）
+    python audit_queries.py --drop               # 审计结束后删除临时库
+"""
+import argparse
+import asyncio
+import datetime
+import inspect
+import os
+import re
+import sys
+import uuid
+from typing import Dict, List, Any, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from pymongo import MongoClient, ASCENDING, DESCENDING
+
+from main.config import MONGO_URI, MONGO_DB_NAME
+from main.db import (MongoManager, MESSAGES_COLLECTION, CONVERSATIONS_COLLECTION,
+                     ARCHIVED_CONVERSATIONS_COLLECTION, MESSAGE_TOMBSTONES_COLLECTION, USAGE_STATS_COLLECTION,
+                     MESSAGE_PROJECTION, TOMBSTONE_PROJECTION)
+from main.usage import usage_day
+
+# 扫描文档数/返回文档数超过该比例视为低效
+DEFAULT_MAX_EXAMINED_RATIO = 10.0
+# 填充数据会清空集合，只允许在以此结尾的临时库中进行
+SCRATCH_DB_SUFFIX = "_query_audit"
+# 方法源码中出现这些调用即视为发出查询（只插入的方法不需要索引）
+_QUERY_CALL_RE = re.compile(r"_collection\.(?:find|aggregate|count_documents|update|delete|replace|bulk_write|distinct)")
+
+
+class QueryShape:
+    """One query issued by a MongoManager method, expressed as a find"""
+
+    def __init__(self, source: str, collection: str, filter: Dict[str, Any],
+                 sort: Optional[List[Tuple[str, int]]] = None, projection: Optional[Dict[str, Any]] = None,
+                 limit: int = 0, full_scan: bool = False):
+        self.source = source
+        self.collection = collection
+        self.filter = filter
+        self.sort = sort or []
+        self.projection = projection
+        self.limit = limit
+        # 一次性迁移等本来就要扫描整个集合的查询，不标记 COLLSCAN
+        self.full_scan = full_scan
+
+
+def build_query_shapes(sample: Dict[str, Any]) -> List[QueryShape]:
+    """MongoManager 中每个方法发出的查询（参数取自样本数据）"""
+    user_id = sample["user_id"]
+    conversation_id = sample["conversation_id"]
+    message_id = sample["message_id"]
+    before = sample["timestamp"]
+    idle_cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=30)
+    by_conversation = {"user_id": user_id, "conversation_id": conversation_id}
+    newest_first = [("timestamp", DESCENDING)]
+    usage_ids = [f"{user_id}:total"] + [
+        f"{user_id}:{usage_day(before - datetime.timedelta(days=i))}" for i in range(7)
+    ]
+
+    return [
+        QueryShape("get_conversations", CONVERSATIONS_COLLECTION, {"user_id": user_id},
+                   sort=[("updated_at", DESCENDING)], limit=50),
+        QueryShape("get_conversations_version (ETag)", CONVERSATIONS_COLLECTION, {"user_id": user_id},
+                   projection={"updated_at": 1, "version": 1}),
+        QueryShape("get_conversation_version (ETag)", CONVERSATIONS_COLLECTION, by_conversation,
+                   projection={"_id": 0, "version": 1}, limit=1),
+        QueryShape("start_chat_turn / update_conversation_title / add_message / set_memory_watermark (conversation)",
+                   CONVERSATIONS_COLLECTION, by_conversation, limit=1),
+        QueryShape("_is_archived", CONVERSATIONS_COLLECTION, {**by_conversation, "archived": True},
+                   projection={"_id": 1}, limit=1),
+        QueryShape("delete_conversation (conversation)", CONVERSATIONS_COLLECTION, by_conversation, limit=1),
+        QueryShape("delete_conversation / delete_all_messages (messages)", MESSAGES_COLLECTION, by_conversation),
+        QueryShape("delete_conversation / restore_conversation (archive)", ARCHIVED_CONVERSATIONS_COLLECTION,
+                   {"conversation_id": conversation_id, "user_id": user_id}, limit=1),
+        QueryShape("get_recent_messages", MESSAGES_COLLECTION, by_conversation, sort=newest_first,
+                   projection=MESSAGE_PROJECTION, limit=10),
+        QueryShape("get_memory_watermark", CONVERSATIONS_COLLECTION, by_conversation,
+                   projection={"_id": 0, "memory_extracted_at": 1}, limit=1),
+        QueryShape("get_message_history", MESSAGES_COLLECTION, {"user_id": user_id}, sort=newest_first,
+                   projection=MESSAGE_PROJECTION, limit=10),
+        QueryShape("get_message_history (before_timestamp)", MESSAGES_COLLECTION,
+                   {"user_id": user_id, "timestamp": {"$lt": before}}, sort=newest_first,
+                   projection=MESSAGE_PROJECTION, limit=10),
+        QueryShape("delete_message", MESSAGES_COLLECTION, {**by_conversation, "message_id": message_id}, limit=1),
+        QueryShape("_refresh_conversation_summary / GroupCommitWriter._repair_summary", MESSAGES_COLLECTION,
+                   by_conversation, sort=newest_first, projection={"content": 1, "role": 1}, limit=1),
+        QueryShape("record_usage / get_usage_stats", USAGE_STATS_COLLECTION, {"_id": {"$in": usage_ids}},
+                   projection={"updated_at": 0}),
+        QueryShape("backfill_conversation_summaries", CONVERSATIONS_COLLECTION, {"version": {"$exists": False}},
+                   projection={"_id": 0, "conversation_id": 1, "user_id": 1}, full_scan=True),
+        QueryShape("_backfill_summary_batch (messages)", MESSAGES_COLLECTION,
+                   {"conversation_id": {"$in": [conversation_id]}}, sort=[("timestamp", ASCENDING)]),
+        QueryShape("_backfill_summary_batch (archive)", ARCHIVED_CONVERSATIONS_COLLECTION,
+                   {"conversation_id": {"$in": [conversation_id]}},
+                   projection={"_id": 0, "conversation_id": 1, "message_count": 1}),
+        QueryShape("get_changes_since (messages)", MESSAGES_COLLECTION,
+                   {**by_conversation, "timestamp": {"$gte": before},
+                    "$nor": [{"timestamp": before, "message_id": {"$lte": message_id}}]},
+                   sort=[("timestamp", ASCENDING), ("message_id", ASCENDING)],
+                   projection=MESSAGE_PROJECTION, limit=201),
+        QueryShape("get_changes_since (tombstones)", MESSAGE_TOMBSTONES_COLLECTION,
+                   {**by_conversation, "deleted_at": {"$gte": before},
+                    "$nor": [{"deleted_at": before, "tombstone_id": {"$lte": message_id}}]},
+                   sort=[("deleted_at", ASCENDING), ("tombstone_id", ASCENDING)],
+                   projection=TOMBSTONE_PROJECTION, limit=201),
+        QueryShape("archive_idle_conversations", CONVERSATIONS_COLLECTION,
+                   {"updated_at": {"$lt": idle_cutoff}, "archived": {"$ne": True}},
+                   projection={"conversation_id": 1, "user_id": 1}, limit=100),
+        QueryShape("_archive_conversation", MESSAGES_COLLECTION, by_conversation, sort=[("timestamp", ASCENDING)]),
+        QueryShape("_archive_conversation (delete archived)", MESSAGES_COLLECTION,
+                   {"message_id": {"$in": [message_id]}}),
+    ]
+
+
+def uncovered_methods(shapes: List[QueryShape]) -> List[str]:
+    """发出查询但没有出现在任何查询形状来源中的 MongoManager 方法"""
+    covered = {name for shape in shapes for name in re.findall(r"\w+", shape.source)}
+    return [
+        name for name, method in inspect.getmembers(MongoManager, inspect.isfunction)
+        if name not in covered and _QUERY_CALL_RE.search(inspect.getsource(method))
+    ]
+
+
+def seed_database(db, users: int, conversations_per_user: int, messages_per_conversation: int) -> Dict[str, Any]:
+    """填充与线上结构一致的测试数据，返回一个用于查询参数的样本"""
+    db[MESSAGES_COLLECTION].delete_many({})
+    db[CONVERSATIONS_COLLECTION].delete_many({})
+    now = datetime.datetime.now(datetime.timezone.utc)
+    sample = None
+    for u in range(users):
+        user_id = f"audit-user-{u}"
+        conversations, messages = [], []
+        for c in range(conversations_per_user):
+            conversation_id = str(uuid.uuid4())
+            started = now - datetime.timedelta(days=(u * conversations_per_user + c) % 60, hours=c)
+            for m in range(messages_per_conversation):
+                messages.append({
+                    "message_id": str(uuid.uuid4()),
+                    "user_id": user_id,
+                    "conversation_id": conversation_id,
+                    "role": "user" if m % 2 == 0 else "assistant",
+                    "content": f"audit message {m}",
+                    "timestamp": started + datetime.timedelta(seconds=m),
+                    "turn_steps": [],
+                })
+            conversations.append({
+                "conversation_id": conversation_id,
+                "user_id": user_id,
+                "title": "Audit",
+                "created_at": started,
+                "updated_at": started + datetime.timedelta(seconds=messages_per_conversation),
+                "message_count": messages_per_conversation,
+                "last_message_preview": "",
+                "last_role": "assistant",
+                "version": messages_per_conversation,
+            })
+        db[MESSAGES_COLLECTION].insert_many(messages)
+        db[CONVERSATIONS_COLLECTION].insert_many(conversations)
+        if sample is None:
+            middle = messages[len(messages) // 2]
+            sample = {key: middle[key] for key in ("user_id", "conversation_id", "message_id", "timestamp")}
+    return sample
+
+
+def pick_sample(db) -> Dict[str, Any]:
+    message = db[MESSAGES_COLLECTION].find_one(sort=[("timestamp", DESCENDING)])
+    if not message:
+        raise SystemExit("The database has no messages to audit; run without --live to use seeded data.")
+    return {key: message[key] for key in ("user_id", "conversation_id", "message_id", "timestamp")}
+
+
+def _plan_stages(plan: Any) -> List[str]:
+    """递归收集执行计划中的所有stage名称（兼容经典引擎和SBE的 queryPlan 嵌套）"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for key in ("queryPlan", "inputStage"):
+            if key in plan:
+                stages.extend(_plan_stages(plan[key]))
+        for child in plan.get("inputStages", []):
+            stages.extend(_plan_stages(child))
+    return stages
+
+
+def explain_shape(db, shape: QueryShape) -> Dict[str, Any]:
+    cursor = db[shape.collection].find(shape.filter, shape.projection)
+    if shape.sort:
+        cursor = cursor.sort(shape.sort)
+    if shape.limit:
+        cursor = cursor.limit(shape.limit)
+    return cursor.explain()
+
+
+def analyze(explain: Dict[str, Any], max_examined_ratio: float, full_scan: bool = False) -> Dict[str, Any]:
+    """从explain结果中提取stage、扫描量并给出问题标记"""
+    winning_plan = explain.get("queryPlanner", {}).get("winningPlan", {})
+    stats = explain.get("executionStats", {})
+    stages = _plan_stages(winning_plan)
+    returned = stats.get("nReturned", 0)
+    docs_examined = stats.get("totalDocsExamined", 0)
+    keys_examined = stats.get("totalKeysExamined", 0)
+    ratio = max(docs_examined, keys_examined) / max(returned, 1)
+
+    issues = []
+    if full_scan:
+        return {"stages": stages, "returned": returned, "docs_examined": docs_examined,
+                "keys_examined": keys_examined, "ratio": ratio, "issues": issues}
+    if "COLLSCAN" in stages:
+        issues.append("COLLSCAN")
+    if "SORT" in stages:
+        issues.append("in-memory SORT")
+    if ratio > max_examined_ratio:
+        issues.append(f"examined/returned {ratio:.1f}")
+    return {
+        "stages": stages,
+        "returned": returned,
+        "docs_examined": docs_examined,
+        "keys_examined": keys_examined,
+        "ratio": ratio,
+        "issues": issues,
+    }
+
+
+def _split_filter(shape: QueryShape) -> Tuple[List[str], List[str]]:
+    """把过滤条件分为等值字段和范围字段（$in 按等值处理）"""
+    equality, ranges = [], []
+    for field, condition in shape.filter.items():
+        if isinstance(condition, dict) and any(key.startswith("$") for key in condition):
+            if "$in" in condition or "$eq" in condition:
+                equality.append(field)
+            else:
+                ranges.append(field)
+        else:
+            equality.append(field)
+    return equality, ranges
+
+
+def recommend_index(shape: QueryShape) -> List[Tuple[str, int]]:
+    """按 ESR 规则生成索引键：等值字段 -> 排序字段 -> 范围字段"""
+    equality, ranges = _split_filter(shape)
+    keys = [(field, ASCENDING) for field in equality]
+    keys += [(field, direction) for field, direction in shape.sort if field not in equality]
+    keys += [(field, ASCENDING) for field in ranges if field not in dict(keys)]
+    return keys
+
+
+def index_covers(index_keys: List[Tuple[str, int]], wanted: List[Tuple[str, int]], equality_count: int) -> bool:
+    """
+    wanted 与已有索引前缀匹配时视为已覆盖：等值字段顺序不限、方向不限，
+    其后的排序/范围字段顺序一致，方向一致或整体相反
+    """
+    if len(index_keys) < len(wanted):
+        return False
+    prefix = index_keys[:len(wanted)]
+    if {field for field, _ in prefix[:equality_count]} != {field for field, _ in wanted[:equality_count]}:
+        return False
+    rest, wanted_rest = prefix[equality_count:], wanted[equality_count:]
+    if [field for field, _ in rest] != [field for field, _ in wanted_rest]:
+        return False
+    same = all(a == b for (_, a), (_, b) in zip(rest, wanted_rest, strict=True))
+    reversed_ = all(a == -b for (_, a), (_, b) in zip(rest, wanted_rest, strict=True))
+    return same or reversed_
+
+
+def existing_indexes(db, collection: str) -> List[List[Tuple[str, int]]]:
+    return [
+        [(field, int(direction)) for field, direction in info["key"]]
+        for info in db[collection].list_indexes()
+    ]
+
+
+def audit(db, shapes: List[QueryShape], max_examined_ratio: float) -> List[Dict[str, Any]]:
+    findings = []
+    for shape in shapes:
+        result = analyze(explain_shape(db, shape), max_examined_ratio, full_scan=shape.full_scan)
+        result["shape"] = shape
+        if result["issues"]:
+            wanted = recommend_index(shape)
+            equality_count = len(_split_filter(shape)[0])
+            covered = any(index_covers(keys, wanted, equality_count) for keys in existing_indexes(db, shape.collection))
+            result["recommendation"] = None if covered else wanted
+        findings.append(result)
+    return findings
+
+
+def print_report(findings: List[Dict[str, Any]]):
+    for finding in findings:
+        shape = finding["shape"]
+        status = "OK  " if not finding["issues"] else "WARN"
+        print(f"[{status}] {shape.source} ({shape.collection})")
+        print(f"       plan: {' <- '.join(finding['stages'])}")
+        print(f"       returned={finding['returned']} docs_examined={finding['docs_examined']} "
+              f"keys_examined={finding['keys_examined']}")
+        if finding["issues"]:
+            print(f"       issues: {', '.join(finding['issues'])}")
+            if finding.get("recommendation"):
+                print(f"       recommend: db.{shape.collection}.createIndex({dict(finding['recommendation'])})")
+            else:
+                print("       a matching index exists; the planner did not choose it for this data set")
+
+
+def create_recommended(db, findings: List[Dict[str, Any]]) -> int:
+    created = set()
+    for finding in findings:
+        keys = finding.get("recommendation")
+        if not keys:
+            continue
+        collection = finding["shape"].collection
+        key = (collection, tuple(keys))
+        if key in created:
+            continue
+        name = db[collection].create_index(keys, name="audit_" + "_".join(field for field, _ in keys) + "_idx")
+        print(f"Created index {name} on {collection}")
+        created.add(key)
+    return len(created)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Explain every MongoManager query shape and flag missing indexes")
+    parser.add_argument("--live", action="store_true", help=f"Audit {MONGO_DB_NAME} as-is instead of a seeded copy")
+    parser.add_argument("--db", default=f"{MONGO_DB_NAME}{SCRATCH_DB_SUFFIX}",
+                        help=f"Scratch database to seed and audit (name must end with {SCRATCH_DB_SUFFIX})")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--conversations", type=int, default=10, help="Conversations per user")
+    parser.add_argument("--messages", type=int, default=50, help="Messages per conversation")
+    parser.add_argument("--max-examined-ratio", type=float, default=DEFAULT_MAX_EXAMINED_RATIO)
+    parser.add_argument("--create", action="store_true", help="Create the recommended indexes and audit again")
+    parser.add_argument("--drop", action="store_true", help="Drop the seeded database afterwards")
+    args = parser.parse_args()
+    if args.live and (args.create or args.drop):
+        parser.error("--live is read-only; --create and --drop only apply to the seeded scratch database")
+    if not args.live and (not args.db.endswith(SCRATCH_DB_SUFFIX) or args.db == MONGO_DB_NAME):
+        # 填充数据会清空 messages 和 conversations 集合
+        parser.error(f"Refusing to seed {args.db}: the scratch database name must end with {SCRATCH_DB_SUFFIX}")
+
+    db_name = MONGO_DB_NAME if args.live else args.db
+    client = MongoClient(MONGO_URI)
+    db = client[db_name]
+
+    if args.live:
+        # 只执行explain，不修改线上库（不建索引、不写数据）
+        sample = pick_sample(db)
+    else:
+        # 索引定义以 MongoManager.initialize_db 为准
+        asyncio.run(MongoManager(db_name).initialize_db())
+        print(f"Seeding {db_name}: {args.users} users x {args.conversations} conversations x {args.messages} messages")
+        sample = seed_database(db, args.users, args.conversations, args.messages)
+
+    shapes = build_query_shapes(sample)
+    findings = audit(db, shapes, args.max_examined_ratio)
+    print_report(findings)
+
+    if args.create and create_recommended(db, findings):
+        print("\nAfter creating recommended indexes:")
+        print_report(audit(db, shapes, args.max_examined_ratio))
+
+    flagged = sum(1 for finding in findings if finding["issues"])
+    print(f"\n{len(findings)} query shapes audited, {flagged} flagged")
+    for name in uncovered_methods(shapes):
+        print(f"[MISS] MongoManager.{name} issues queries that have no audited shape; add it to build_query_shapes")
+
+    if args.drop:
+        client.drop_database(db_name)
+        print(f"Dropped {db_name}")
+
+
+if __name__ == "__main__":
+    main()
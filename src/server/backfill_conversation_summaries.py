@@ -0,0 +1,41 @@
+"""
+会话摘要字段回填迁移
+
+会话列表直接读取会话文档上的 message_count、last_message_preview、last_role 和 version。
+这些字段引入之前创建的会话没有它们，列表显示为0条消息、没有预览，ETag版本也不完整。
+本脚本由消息集合（和归档集合中的消息数）重新计算这些字段，只需在升级后运行一次，可重复执行。
+
+用法:
+    python backfill_conversation_summaries.py               # 只处理缺少 version 字段的会话
+    python backfill_conversation_summaries.py --all         # 重新计算所有会话
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from main.db import MongoManager
+
+
+async def run(only_missing: bool, batch_size: int) -> int:
+    manager = MongoManager()
+    try:
+        return await manager.backfill_conversation_summaries(only_missing=only_missing, batch_size=batch_size)
+    finally:
+        manager.client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill conversation summary fields from the messages collection")
+    parser.add_argument("--all", action="store_true", help="Recompute every conversation, not only those missing a version")
+    parser.add_argument("--batch-size", type=int, default=500, help="Conversations per aggregation batch")
+    args = parser.parse_args()
+
+    updated = asyncio.run(run(only_missing=not args.all, batch_size=args.batch_size))
+    print(f"Backfilled {updated} conversations")
+
+
+if __name__ == "__main__":
+    main()
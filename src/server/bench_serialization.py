@@ -0,0 +1,101 @@
+"""
+历史消息序列化基准测试
+
+对比两条路径把MongoDB查询结果编码为响应字节的开销：
+    legacy: 逐条重建字典 + isoformat() + jsonable_encoder + json.dumps（原实现）
+    fast:   投影形状的文档直接用 main.serialization.dumps 编码
+
+不需要数据库，文档按 messages 集合的结构生成。
+
+用法:
+    python bench_serialization.py --sizes 30 500 5000 --repeat 20
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder, ENCODERS_BY_TYPE
+
+from main.serialization import dumps, ORJSON_AVAILABLE
+
+ENCODERS_BY_TYPE[ObjectId] = str
+
+
+def make_raw_documents(count: int, content_length: int):
+    """完整的 messages 文档（find() 不带投影时的返回）"""
+    start = datetime.datetime(2026, 1, 1)
+    return [
+        {
+            "_id": ObjectId(),
+            "message_id": str(uuid.uuid4()),
+            "user_id": "default-user",
+            "conversation_id": "bench-conversation",
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": ("记忆与检索 memory retrieval " * (content_length // 24 + 1))[:content_length],
+            "timestamp": start + datetime.timedelta(seconds=i),
+            "turn_steps": [] if i % 2 == 0 else [{"type": "thought", "content": "..." * 20}],
+        }
+        for i in range(count)
+    ]
+
+
+def make_projected_documents(raw):
+    """带 MESSAGE_PROJECTION 的查询只返回这些字段"""
+    return [
+        {"role": d["role"], "content": d["content"], "message_id": d["message_id"], "timestamp": d["timestamp"]}
+        for d in raw
+    ]
+
+
+def legacy_encode(raw) -> bytes:
+    result = []
+    for msg in raw:
+        result.append({
+            "role": msg.get("role"),
+            "content": msg.get("content", ""),
+            "message_id": msg.get("message_id"),
+            "timestamp": msg.get("timestamp").isoformat() if isinstance(msg.get("timestamp"), datetime.datetime) else msg.get("timestamp")
+        })
+    return json.dumps(jsonable_encoder({"messages": result})).encode("utf-8")
+
+
+def fast_encode(projected) -> bytes:
+    return dumps({"messages": projected})
+
+
+def bench(fn, arg, repeat: int) -> float:
+    fn(arg)
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(arg)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark history page serialization")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[30, 500, 5000], help="Messages per page")
+    parser.add_argument("--content-length", type=int, default=400, help="Characters per message")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"encoder: {'orjson' if ORJSON_AVAILABLE else 'json (orjson not installed)'}")
+    print(f"{'messages':>10} {'legacy ms':>12} {'fast ms':>10} {'speedup':>9} {'bytes':>10}")
+    for size in args.sizes:
+        raw = make_raw_documents(size, args.content_length)
+        projected = make_projected_documents(raw)
+        legacy = bench(legacy_encode, raw, args.repeat)
+        fast = bench(fast_encode, projected, args.repeat)
+        print(f"{size:>10} {legacy * 1000:>12.2f} {fast * 1000:>10.2f} {legacy / fast:>8.1f}x {len(fast_encode(projected)):>10}")
+
+
+if __name__ == "__main__":
+    main()
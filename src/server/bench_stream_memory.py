@@ -0,0 +1,119 @@
+"""
+流式响应内存基准测试
+
+模拟 generate_chat_llm_stream 中agent工作线程与消费方之间的快照传递，用 tracemalloc
+测量慢客户端下每个流的峰值内存：
+    queue:   无界 asyncio.Queue，每个历史快照都排队等待消费（原实现）
+    channel: main.chat.channel.SnapshotChannel，只保留最新快照
+
+工作线程按qwen-agent的方式产出快照：每步一个新的历史列表，助手消息内容比上一步多一个token。
+不需要LLM或数据库。
+
+用法:
+    python bench_stream_memory.py --tokens 2000 --streams 4 --consumer-delay-ms 2
+"""
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from main.chat.channel import SnapshotChannel
+
+
+def produce_snapshots(tokens: int, token_text: str, produce_delay: float):
+    """与 run_agent 一样产出完整历史快照"""
+    history = [{"role": "user", "content": "请介绍一下长期记忆检索"}]
+    content = ""
+    for _ in range(tokens):
+        content += token_text
+        yield history + [{"role": "assistant", "content": content}]
+        if produce_delay:
+            time.sleep(produce_delay)
+
+
+async def run_queue_stream(tokens: int, token_text: str, produce_delay: float, consumer_delay: float) -> int:
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+
+    def worker():
+        for snapshot in produce_snapshots(tokens, token_text, produce_delay):
+            loop.call_soon_threadsafe(queue.put_nowait, snapshot)
+        loop.call_soon_threadsafe(queue.put_nowait, None)
+
+    threading.Thread(target=worker, daemon=True).start()
+    received = ""
+    while True:
+        snapshot = await queue.get()
+        if snapshot is None:
+            break
+        received = snapshot[-1]["content"]
+        await asyncio.sleep(consumer_delay)
+    return len(received)
+
+
+async def run_channel_stream(tokens: int, token_text: str, produce_delay: float, consumer_delay: float) -> int:
+    channel = SnapshotChannel(asyncio.get_running_loop())
+
+    def worker():
+        for snapshot in produce_snapshots(tokens, token_text, produce_delay):
+            channel.publish(snapshot)
+        channel.close()
+
+    threading.Thread(target=worker, daemon=True).start()
+    received = ""
+    while True:
+        snapshot = await channel.get()
+        if snapshot is None:
+            break
+        received = snapshot[-1]["content"]
+        await asyncio.sleep(consumer_delay)
+    return len(received)
+
+
+def measure(stream_fn, args) -> dict:
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+
+    async def run_all():
+        return await asyncio.gather(*[
+            stream_fn(args.tokens, args.token_text, args.produce_delay_ms / 1000, args.consumer_delay_ms / 1000)
+            for _ in range(args.streams)
+        ])
+
+    lengths = asyncio.run(run_all())
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+    expected = args.tokens * len(args.token_text)
+    return {
+        "peak_per_stream": peak / args.streams,
+        "elapsed": elapsed,
+        "complete": all(length == expected for length in lengths),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure peak memory per chat stream with a slow consumer")
+    parser.add_argument("--tokens", type=int, default=2000, help="Snapshots produced per stream")
+    parser.add_argument("--token-text", default="记忆abc ", help="Text appended per snapshot")
+    parser.add_argument("--streams", type=int, default=4, help="Concurrent streams")
+    parser.add_argument("--produce-delay-ms", type=float, default=0.0, help="Delay between snapshots in the worker")
+    parser.add_argument("--consumer-delay-ms", type=float, default=2.0, help="Delay per snapshot in the consumer (slow client)")
+    args = parser.parse_args()
+
+    print(f"{args.streams} streams x {args.tokens} snapshots, consumer delay {args.consumer_delay_ms} ms")
+    print(f"{'path':>8} {'peak KiB/stream':>16} {'seconds':>9} {'complete':>9}")
+    for name, stream_fn in (("queue", run_queue_stream), ("channel", run_channel_stream)):
+        result = measure(stream_fn, args)
+        print(f"{name:>8} {result['peak_per_stream'] / 1024:>16.1f} {result['elapsed']:>9.2f} {str(result['complete']):>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""
+基于真实对话轨迹的压测工具
+
+export: 从 messages 集合导出匿名化的多轮对话轨迹（保留轮次间隔、消息长度和词语重复结构）
+replay: 按原始到达间隔（可加速/放大）向运行中的服务器重放轨迹，
+        报告每轮延迟分位数、错误率以及服务器端Mongo/LLM调用次数
+
+用法:
+    python loadgen.py export --out traces.jsonl --limit 200
+    python loadgen.py replay --traces traces.jsonl --url http://127.0.0.1:5000 --speed 10 --multiply 4
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import random
+import re
+import secrets
+import sys
+import time
+import uuid
+from typing import Dict, List, Any, Optional
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+# 邮箱和URL整体替换为占位符，其余英文单词、数字和汉字逐个映射
+_TOKEN_RE = re.compile(
+    r"(?P<email>[\w.+-]+@[\w-]+\.[\w.-]+)|(?P<url>https?://\S+)|[A-Za-z]+|\d+|[\u4e00-\u9fff]"
+)
+
+_CONSONANTS = "bcdfghjklmnprstvz"
+_VOWELS = "aeiou"
+
+
+class Anonymizer:
+    """
+    确定性匿名化：同一个词总是映射到同一个等长的伪词，
+    这样轨迹中的关键词重复（影响记忆命中）得以保留，而原文不可恢复。
+    持有盐值的人可以对伪词做字典攻击还原原文，因此未指定盐值时每次导出随机生成且不保存。
+    """
+
+    def __init__(self, salt: Optional[str] = None):
+        self.salt = salt.encode() if salt else secrets.token_bytes(32)
+        self._cache: Dict[str, str] = {}
+
+    def _digest(self, value: str) -> bytes:
+        return hmac.new(self.salt, value.encode(), hashlib.sha256).digest()
+
+    def _pseudo_word(self, word: str) -> str:
+        cached = self._cache.get(word)
+        if cached is not None:
+            return cached
+        digest = self._digest(word.lower())
+        if word.isdigit():
+            pseudo = "".join(str(b % 10) for b in digest[:len(word)]).ljust(len(word), "0")
+        elif "\u4e00" <= word <= "\u9fff":
+            pseudo = chr(0x4e00 + int.from_bytes(digest[:2], "big") % 0x5000)
+        else:
+            letters = [(_CONSONANTS if i % 2 == 0 else _VOWELS)[digest[i % len(digest)] % (17 if i % 2 == 0 else 5)]
+                       for i in range(len(word))]
+            pseudo = "".join(letters)
+            if word[0].isupper():
+                pseudo = pseudo.capitalize()
+        self._cache[word] = pseudo
+        return pseudo
+
+    def _replace(self, match) -> str:
+        if match.group("email"):
+            return "user@example.com"
+        if match.group("url"):
+            return "https://example.com/"
+        return self._pseudo_word(match.group(0))
+
+    def anonymize(self, text: str) -> str:
+        return _TOKEN_RE.sub(self._replace, text or "")
+
+    def anonymize_id(self, value: str) -> str:
+        return self._digest(value).hex()[:16]
+
+
+def export_traces(out_path: str, limit: int, min_turns: int, salt: Optional[str] = None):
+    """从MongoDB导出匿名化的对话轨迹，每行一个会话"""
+    from pymongo import MongoClient, ASCENDING
+    from main.config import MONGO_URI, MONGO_DB_NAME
+
+    client = MongoClient(MONGO_URI)
+    db = client[MONGO_DB_NAME]
+    anonymizer = Anonymizer(salt)
+
+    conversations = db["conversations"].find({}, {"conversation_id": 1}).sort("updated_at", -1).limit(limit)
+    traces = []
+    for conv in conversations:
+        messages = list(db["messages"].find(
+            {"conversation_id": conv["conversation_id"], "role": "user"},
+            {"content": 1, "timestamp": 1}
+        ).sort("timestamp", ASCENDING))
+        if len(messages) < min_turns:
+            continue
+        started = messages[0]["timestamp"]
+        traces.append({
+            "conversation_id": anonymizer.anonymize_id(conv["conversation_id"]),
+            "started_at": started.timestamp(),
+            "turns": [
+                {"at": (msg["timestamp"] - started).total_seconds(), "message": anonymizer.anonymize(msg.get("content", ""))}
+                for msg in messages
+            ],
+        })
+
+    # 会话开始时间转换为相对第一个会话的偏移
+    if traces:
+        first = min(trace["started_at"] for trace in traces)
+        for trace in traces:
+            trace["start_offset"] = trace.pop("started_at") - first
+
+    with open(out_path, "w", encoding="utf-8") as f:
+        for trace in sorted(traces, key=lambda t: t["start_offset"]):
+            f.write(json.dumps(trace, ensure_ascii=False) + "\n")
+    print(f"Exported {len(traces)} conversation traces to {out_path}")
+
+
+def load_traces(path: str) -> List[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+class ReplayStats:
+    def __init__(self):
+        self.ttft: List[float] = []
+        self.latency: List[float] = []
+        self.turns = 0
+        self.errors = 0
+
+    def report(self, elapsed: float, server_calls: Dict[str, int]) -> Dict[str, Any]:
+        def summary(values):
+            return {f"p{p}": round(percentile(values, p), 3) if values else None for p in (50, 90, 95, 99)}
+
+        turns = max(self.turns, 1)
+        return {
+            "turns": self.turns,
+            "errors": self.errors,
+            "error_rate": round(self.errors / turns, 4),
+            "throughput_turns_per_s": round(self.turns / elapsed, 2) if elapsed else None,
+            "ttft_seconds": summary(self.ttft),
+            "latency_seconds": summary(self.latency),
+            "server_calls": server_calls,
+            "server_calls_per_turn": {k: round(v / turns, 2) for k, v in server_calls.items()},
+        }
+
+
+async def _run_turn(client, url: str, conversation_id: str, message: str, stats: ReplayStats):
+    started = time.monotonic()
+    first_token_at = None
+    failed = False
+    try:
+        async with client.stream("POST", f"{url}/api/chat/message",
+                                 json={"message": message, "conversation_id": conversation_id}) as response:
+            if response.status_code != 200:
+                failed = True
+            else:
+                async for line in response.aiter_lines():
+                    if not line.strip():
+                        continue
+                    event = json.loads(line)
+                    if event.get("type") == "error":
+                        failed = True
+                    elif event.get("token") and first_token_at is None:
+                        first_token_at = time.monotonic()
+    except Exception:
+        failed = True
+
+    stats.turns += 1
+    if failed:
+        stats.errors += 1
+        return
+    stats.latency.append(time.monotonic() - started)
+    if first_token_at is not None:
+        stats.ttft.append(first_token_at - started)
+
+
+async def _replay_conversation(client, url: str, trace: Dict[str, Any], start_delay: float,
+                               speed: float, stats: ReplayStats):
+    await asyncio.sleep(start_delay)
+    conversation_id = str(uuid.uuid4())
+    started = time.monotonic()
+    for turn in trace["turns"]:
+        # 保持原始到达间隔（按speed压缩），但下一轮不会早于上一轮回复完成
+        wait = started + turn["at"] / speed - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        await _run_turn(client, url, conversation_id, turn["message"], stats)
+
+
+async def replay_traces(traces_path: str, url: str, speed: float, multiply: int,
+                        max_conversations: Optional[int], timeout: float) -> Dict[str, Any]:
+    import httpx
+
+    traces = load_traces(traces_path)
+    if max_conversations:
+        traces = traces[:max_conversations]
+    url = url.rstrip("/")
+    stats = ReplayStats()
+
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        calls_before = (await client.get(f"{url}/metrics")).json().get("calls", {})
+        started = time.monotonic()
+        jobs = []
+        for copy in range(multiply):
+            for trace in traces:
+                # 放大时给副本的开始时间加入抖动，避免完全同步
+                jitter = random.uniform(0, 1.0) if copy else 0.0
+                jobs.append(_replay_conversation(client, url, trace, trace.get("start_offset", 0) / speed + jitter, speed, stats))
+        await asyncio.gather(*jobs)
+        elapsed = time.monotonic() - started
+        calls_after = (await client.get(f"{url}/metrics")).json().get("calls", {})
+
+    server_calls = {
+        key: calls_after.get(key, 0) - calls_before.get(key, 0)
+        for key in sorted(set(calls_after) | set(calls_before))
+        if calls_after.get(key, 0) - calls_before.get(key, 0)
+    }
+    return stats.report(elapsed, server_calls)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Trace-replay load generator")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Export anonymized conversation traces")
+    export_parser.add_argument("--out", default="traces.jsonl")
+    export_parser.add_argument("--limit", type=int, default=500, help="Maximum number of conversations")
+    export_parser.add_argument("--min-turns", type=int, default=2, help="Skip conversations with fewer user turns")
+    export_parser.add_argument("--salt", default=os.getenv("LOADGEN_SALT"),
+                               help="Secret used to derive pseudo-words and ids (default: LOADGEN_SALT, or a random "
+                                    "salt per export that is never written out). Set it only to keep pseudo-words "
+                                    "stable across exports; anyone holding the salt can de-anonymize the traces")
+
+    replay_parser = subparsers.add_parser("replay", help="Replay traces against a running server")
+    replay_parser.add_argument("--traces", default="traces.jsonl")
+    replay_parser.add_argument("--url", default="http://127.0.0.1:5000")
+    replay_parser.add_argument("--speed", type=float, default=1.0, help="Time compression factor for inter-arrival gaps")
+    replay_parser.add_argument("--multiply", type=int, default=1, help="Replay each conversation N times concurrently")
+    replay_parser.add_argument("--max-conversations", type=int, default=None)
+    replay_parser.add_argument("--timeout", type=float, default=180.0, help="Per-request timeout in seconds")
+
+    args = parser.parse_args()
+    if args.command == "export":
+        export_traces(args.out, args.limit, args.min_turns, args.salt)
+    else:
+        report = asyncio.run(replay_traces(args.traces, args.url, args.speed, args.multiply,
+                                           args.max_conversations, args.timeout))
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,79 @@
 """
 极简FastAPI应用 - 只包含聊天功能
 """
+import asyncio
 import logging
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from bson import ObjectId
 from fastapi.encoders import ENCODERS_BY_TYPE
 
-from main.config import APP_SERVER_PORT
+from main.config import (APP_SERVER_PORT, ARCHIVE_ENABLED, ARCHIVE_IDLE_DAYS, ARCHIVE_INTERVAL_SECONDS,
+                         MEMORY_GC_INTERVAL_SECONDS, DRAIN_GRACE_SECONDS, WARMUP_ENABLED,
+                         WARMUP_STEP_TIMEOUT_SECONDS)
 from main.db import mongo_manager
+from main.llm_router import llm_router
+from main.circuit_breaker import breaker_metrics
+from main.metrics import call_counters
+from main.logging_config import setup_logging, shutdown_logging
+from main.memory.gc import memory_gc
+from main.memory.mem0_client import mem0_client
+from main.drain import drain_state
+from main.warmup import warmup
+from main.chat.engine import generation_tasks
 from main.chat.routes import router as chat_router
+from main.chat.ws import router as chat_ws_router
 
-logging.basicConfig(level=logging.INFO)
+log_handler = setup_logging()
 logger = logging.getLogger(__name__)
 
 # 添加ObjectId编码器
 ENCODERS_BY_TYPE[ObjectId] = str
 
+# /health 中数据库 ping 的超时
+HEALTH_DB_PING_TIMEOUT_SECONDS = 1.0
+
+async def archive_loop():
+    """定期将空闲会话归档到冷存储"""
+    while True:
+        try:
+            await mongo_manager.archive_idle_conversations(ARCHIVE_IDLE_DAYS)
+        except Exception as e:
+            logger.error("Archive job failed: %s", e, exc_info=True)
+        await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+
 @asynccontextmanager
 async def lifespan(app_instance: FastAPI):
     """应用生命周期管理"""
     logger.info("App startup...")
     await mongo_manager.initialize_db()
+    background_tasks = [asyncio.create_task(memory_gc.run_worker())]
+    if MEMORY_GC_INTERVAL_SECONDS > 0:
+        background_tasks.append(asyncio.create_task(memory_gc.run_compaction_loop(MEMORY_GC_INTERVAL_SECONDS)))
+    if ARCHIVE_ENABLED:
+        background_tasks.append(asyncio.create_task(archive_loop()))
+    # 预热在后台进行：存活检查立即通过，就绪检查等预热完成
+    if WARMUP_ENABLED:
+        background_tasks.append(asyncio.create_task(
+            warmup.run(mongo_manager, mem0_client, llm_router, WARMUP_STEP_TIMEOUT_SECONDS)
+        ))
+    else:
+        warmup.skip()
     logger.info("App startup complete.")
     yield
     logger.info("App shutdown sequence initiated...")
+    # 先排空：等待进行中的生成（保存消息和记忆）与记忆回收队列，再关闭数据库连接
+    await drain_state.start(generation_tasks, memory_gc, DRAIN_GRACE_SECONDS)
+    for task in background_tasks:
+        task.cancel()
+    if mongo_manager.group_writer:
+        await mongo_manager.group_writer.close()
     if mongo_manager and mongo_manager.client:
         mongo_manager.client.close()
     logger.info("App shutdown complete.")
+    shutdown_logging()
 
 app = FastAPI(
     title="Simple Chat Bot",
@@ -45,22 +90,67 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
 # 注册路由
 app.include_router(chat_router)
+app.include_router(chat_ws_router)
 
 @app.get("/", tags=["General"])
 async def root():
     return {"message": "Simple Chat Bot API"}
 
+async def _database_status() -> str:
+    """实时 ping 数据库（短超时），不依赖预热是否完成"""
+    try:
+        await asyncio.wait_for(mongo_manager.db.command("ping"), timeout=HEALTH_DB_PING_TIMEOUT_SECONDS)
+        return "connected"
+    except Exception as e:
+        logger.warning("Health check database ping failed: %s", e)
+        return "disconnected"
+
 @app.get("/health", tags=["General"])
 async def health():
     return {
         "status": "healthy",
-        "database": "connected" if mongo_manager.client else "disconnected"
+        "database": await _database_status(),
+        "llm_endpoints": llm_router.stats(),
+        "circuit_breakers": breaker_metrics(),
+        "drain": drain_state.status(),
+        "warmup": warmup.status()
     }
 
+@app.get("/health/live", tags=["General"])
+async def health_live():
+    """Liveness: the process is up and serving the event loop"""
+    return {"status": "alive"}
+
+@app.get("/health/ready", tags=["General"])
+async def health_ready():
+    """Readiness: warm-up finished with every required step OK and the server is not draining (503 otherwise)"""
+    ready = warmup.ready and not drain_state.draining
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"ready": ready, "draining": drain_state.draining, "warmup": warmup.status()}
+    )
+
+@app.post("/drain", tags=["General"])
+async def start_drain():
+    """Stop accepting new chats and let in-flight work finish (e.g. from a preStop hook)"""
+    drain_state.start(generation_tasks, memory_gc, DRAIN_GRACE_SECONDS)
+    return drain_state.status()
+
+@app.get("/drain", tags=["General"])
+async def drain_status():
+    """Drain progress"""
+    return drain_state.status()
+
+@app.get("/metrics", tags=["General"])
+async def metrics():
+    """Cumulative backend call counters (Mongo commands, LLM requests, mem0 calls)"""
+    return {"calls": call_counters.snapshot(), "log_records_dropped": log_handler.dropped}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
@@ -0,0 +1,74 @@
+"""
+有界的快照通道 - agent工作线程与流式响应之间只保留最新的快照
+
+run_agent 每一步产出的是完整的对话历史快照（后一个包含前一个的全部内容），
+消费方只需要最新的那个。工作线程发布新快照时直接替换尚未取走的旧快照，
+所以无论客户端读取多慢，每个流最多持有一个待处理快照，内存占用不随积压增长。
+"""
+import asyncio
+import threading
+from typing import Any, Optional
+
+
+class SnapshotChannel:
+    """Single-slot, latest-wins channel from a worker thread to an asyncio consumer"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._lock = threading.Lock()
+        self._event = asyncio.Event()
+        self._value: Any = None
+        self._has_value = False
+        self._closed = False
+        self._error: Optional[Exception] = None
+        self._wake_pending = False
+        # 被新快照覆盖、没有被消费方看到的快照数
+        self.superseded = 0
+
+    def _wake(self):
+        # 持锁调用：每次等待最多调度一次唤醒回调
+        if not self._wake_pending:
+            self._wake_pending = True
+            self._loop.call_soon_threadsafe(self._event.set)
+
+    def publish(self, value: Any):
+        """发布快照（工作线程调用），替换尚未取走的旧快照"""
+        with self._lock:
+            if self._closed:
+                return
+            if self._has_value:
+                self.superseded += 1
+            self._value = value
+            self._has_value = True
+            self._wake()
+
+    def close(self, error: Optional[Exception] = None):
+        """结束通道（工作线程调用）；error 会在消费方取完最后一个快照后原样抛出"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._error = error
+            self._wake()
+
+    async def get(self) -> Any:
+        """
+        取最新快照；通道结束后返回None
+
+        Raises:
+            Exception: 工作线程结束时传入的异常
+        """
+        while True:
+            with self._lock:
+                if self._has_value:
+                    value = self._value
+                    self._value = None
+                    self._has_value = False
+                    return value
+                if self._closed:
+                    if self._error is not None:
+                        raise self._error
+                    return None
+                self._event.clear()
+                self._wake_pending = False
+            await self._event.wait()
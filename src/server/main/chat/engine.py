@@ -0,0 +1,117 @@
+"""
+聊天生成引擎 - HTTP流式接口与断线续传共用
+
+start_chat_turn 负责会话准备、保存用户消息，并在后台任务中运行 generate_chat_llm_stream，
+事件写入按 messageId 索引的重放缓冲。生成与客户端连接解耦：客户端断开后生成继续，
+重连时可从偏移量继续读取。
+"""
+import asyncio
+import logging
+import uuid
+from typing import Optional, Set
+
+from main.chat.replay import ReplayBuffer, replay_store
+from main.chat.utils import generate_chat_llm_stream
+from main.config import CHAT_REQUEST_BUDGET_SECONDS, CHAT_PERSIST_MIN_TIMEOUT_SECONDS
+from main.db import mongo_manager
+from main.deadline import Deadline
+from main.drain import drain_state
+from main.metrics import call_counters
+
+logger = logging.getLogger(__name__)
+
+# 运行中的生成任务（保持引用，避免被垃圾回收）
+generation_tasks: Set[asyncio.Task] = set()
+
+
+async def start_chat_turn(
+    user_id: str,
+    message: str,
+    conversation_id: Optional[str] = None,
+    message_id: Optional[str] = None
+) -> ReplayBuffer:
+    """
+    开始一轮对话：准备会话、保存用户消息并启动后台生成
+
+    Args:
+        user_id: 用户ID
+        message: 用户消息（已去除首尾空白）
+        conversation_id: 会话ID，为空时创建新会话
+        message_id: 可选的用户消息ID
+
+    Returns:
+        本轮助手回复的重放缓冲
+    
+    Raises:
+        ServiceDrainingError: 服务器正在排空，不再接受新的聊天
+    """
+    drain_state.check_accepting()
+    # 整个聊天轮次的时间预算，向下传递到每个阶段
+    deadline = Deadline(CHAT_REQUEST_BUDGET_SECONDS)
+    call_counters.increment("chat_turns")
+
+    # Get or create conversation_id
+    if not conversation_id:
+        # Create new conversation
+        conv = await mongo_manager.create_conversation(user_id)
+        conversation_id = conv["conversation_id"]
+
+    # Ensure conversation exists
+    conv_exists = await mongo_manager.conversations_collection.find_one({
+        "conversation_id": conversation_id,
+        "user_id": user_id
+    })
+    if not conv_exists:
+        await mongo_manager.create_conversation(user_id, conversation_id)
+    elif conv_exists.get("archived"):
+        # 归档会话在继续对话前恢复，保证短期记忆完整
+        await mongo_manager.restore_conversation(user_id, conversation_id)
+
+    # Save user message
+    await asyncio.wait_for(
+        mongo_manager.add_message(
+            user_id=user_id,
+            conversation_id=conversation_id,
+            role="user",
+            content=message,
+            message_id=message_id
+        ),
+        timeout=deadline.timeout(floor=CHAT_PERSIST_MIN_TIMEOUT_SECONDS)
+    )
+
+    assistant_message_id = str(uuid.uuid4())
+    buffer = replay_store.create(assistant_message_id, conversation_id)
+    # 首个事件告知客户端 messageId，断线后可据此续传
+    buffer.append({"type": "streamStart", "messageId": assistant_message_id, "conversation_id": conversation_id})
+
+    task = asyncio.create_task(_run_generation(buffer, user_id, conversation_id, message, deadline))
+    buffer.task = task
+    generation_tasks.add(task)
+    task.add_done_callback(generation_tasks.discard)
+    return buffer
+
+
+async def _run_generation(buffer: ReplayBuffer, user_id: str, conversation_id: str, message: str, deadline: Deadline):
+    """在后台运行生成，把事件写入重放缓冲"""
+    try:
+        async for event in generate_chat_llm_stream(
+            user_id=user_id,
+            conversation_id=conversation_id,
+            user_message=message,
+            db_manager=mongo_manager,
+            deadline=deadline,
+            assistant_message_id=buffer.message_id
+        ):
+            if event:
+                buffer.append(event)
+    except asyncio.CancelledError:
+        buffer.append({"type": "error", "message": "Generation was cancelled."})
+        raise
+    except Exception as e:
+        logger.error("Error in chat stream: %s", e, exc_info=True)
+        buffer.append({
+            "type": "error",
+            "message": "Sorry, I encountered an error while processing your request."
+        })
+    finally:
+        buffer.close()
@@ -0,0 +1,145 @@
+"""
+流式响应重放缓冲 - 客户端断线后从偏移量继续接收，而不是重新生成
+
+每次生成按 messageId 写入一个有界缓冲，token事件带有在助手回复中的字符偏移量。
+生成在后台任务中运行，与HTTP连接解耦；任意数量的订阅者可以从某个偏移量开始读取，
+已完成的缓冲在TTL后过期。
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Dict, Any, AsyncGenerator, Optional
+
+from main.config import STREAM_REPLAY_TTL_SECONDS, STREAM_REPLAY_MAX_CHARS, STREAM_REPLAY_MAX_BUFFERS
+
+
+class ReplayOffsetUnavailable(Exception):
+    """Raised when the requested offset has already been trimmed from the buffer."""
+    pass
+
+
+class ReplayBuffer:
+    """Bounded, append-only log of the events of one assistant generation"""
+
+    def __init__(self, message_id: str, conversation_id: str, max_chars: int):
+        self.message_id = message_id
+        self.conversation_id = conversation_id
+        self.max_chars = max_chars
+        # (position, event)：token事件的position为其起始偏移量，其他事件为写入时的总长度
+        self.events: deque = deque()
+        # events[0] 的序号，头部裁剪时递增
+        self.first_seq = 0
+        self.base_offset = 0
+        self.total_chars = 0
+        self.buffered_chars = 0
+        self.done = False
+        self.updated_at = time.monotonic()
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        self.updated_at = time.monotonic()
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def append(self, event: Dict[str, Any]):
+        """追加一个事件；token事件会被标注 offset"""
+        token = event.get("token") if event.get("type") == "assistantStream" and not event.get("done") else None
+        if token:
+            event = {**event, "offset": self.total_chars}
+            self.events.append((self.total_chars, event))
+            self.total_chars += len(token)
+            self.buffered_chars += len(token)
+            self._trim()
+        else:
+            self.events.append((self.total_chars, event))
+        self._notify()
+
+    def _trim(self):
+        while self.buffered_chars > self.max_chars and len(self.events) > 1:
+            position, event = self.events.popleft()
+            self.first_seq += 1
+            if event.get("type") == "assistantStream" and event.get("token"):
+                self.buffered_chars -= len(event["token"])
+                self.base_offset = position + len(event["token"])
+
+    def close(self):
+        self.done = True
+        self._notify()
+
+    async def subscribe(self, offset: int = 0) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        从字符偏移量 offset 开始读取事件，直到生成结束
+
+        Raises:
+            ReplayOffsetUnavailable: 偏移量早于缓冲中保留的最早内容
+        """
+        if offset < self.base_offset:
+            raise ReplayOffsetUnavailable(f"Offset {offset} is no longer buffered (earliest: {self.base_offset})")
+
+        sent_upto = offset
+        next_seq = self.first_seq
+        while True:
+            changed = self._changed
+            if next_seq < self.first_seq:
+                # 订阅者读取过慢，未读内容已被裁剪
+                yield {"type": "error", "message": "Stream replay buffer overflowed; please reload the conversation."}
+                return
+            while next_seq - self.first_seq < len(self.events):
+                position, event = self.events[next_seq - self.first_seq]
+                next_seq += 1
+                token = event.get("token") if "offset" in event else None
+                if token:
+                    end = position + len(token)
+                    if end <= sent_upto:
+                        continue
+                    if position < sent_upto:
+                        event = {**event, "token": token[sent_upto - position:], "offset": sent_upto}
+                    sent_upto = end
+                    yield event
+                elif position >= offset:
+                    yield event
+            if self.done:
+                return
+            await changed.wait()
+
+
+class ReplayStore:
+    """In-memory registry of replay buffers keyed by assistant messageId"""
+
+    def __init__(self, ttl_seconds: float, max_chars: int, max_buffers: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_chars = max_chars
+        self.max_buffers = max_buffers
+        self._buffers: Dict[str, ReplayBuffer] = {}
+
+    def _expire(self):
+        now = time.monotonic()
+        expired = [
+            message_id for message_id, buffer in self._buffers.items()
+            if buffer.done and now - buffer.updated_at > self.ttl_seconds
+        ]
+        for message_id in expired:
+            del self._buffers[message_id]
+        # 超出数量上限时优先淘汰最早完成的缓冲
+        if len(self._buffers) > self.max_buffers:
+            finished = sorted((b for b in self._buffers.values() if b.done), key=lambda b: b.updated_at)
+            for buffer in finished[:len(self._buffers) - self.max_buffers]:
+                del self._buffers[buffer.message_id]
+
+    def create(self, message_id: str, conversation_id: str) -> ReplayBuffer:
+        self._expire()
+        buffer = ReplayBuffer(message_id, conversation_id, self.max_chars)
+        self._buffers[message_id] = buffer
+        return buffer
+
+    def get(self, message_id: str) -> Optional[ReplayBuffer]:
+        self._expire()
+        return self._buffers.get(message_id)
+
+    def active(self):
+        return [buffer for buffer in self._buffers.values() if not buffer.done]
+
+
+# 全局重放缓冲存储
+replay_store = ReplayStore(STREAM_REPLAY_TTL_SECONDS, STREAM_REPLAY_MAX_CHARS, STREAM_REPLAY_MAX_BUFFERS)
@@ -1,15 +1,19 @@
 """
 Chat routes - No authentication required
 """
-import json
+import datetime
 import logging
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, Request, status
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, Tuple
 
-from main.chat.utils import generate_chat_llm_stream
+from main.chat.engine import start_chat_turn
+from main.chat.replay import ReplayBuffer, replay_store
 from main.db import mongo_manager
+from main.drain import ServiceDrainingError
+from main.memory.gc import memory_gc
+from main.serialization import dumps, FastJSONResponse, etag_matches, not_modified, conditional_json_response
 
 router = APIRouter(
     prefix="/api/chat",
@@ -41,49 +45,50 @@ async def chat_endpoint(request_body: ChatMessageInput):
     if not request_body.message or not request_body.message.strip():
         raise HTTPException(status_code=400, detail="Message cannot be empty")
     
-    user_id = DEFAULT_USER_ID
-    
-    # Get or create conversation_id
-    conversation_id = request_body.conversation_id
-    if not conversation_id:
-        # Create new conversation
-        conv = await mongo_manager.create_conversation(user_id)
-        conversation_id = conv["conversation_id"]
-    
-    # Ensure conversation exists
-    conv_exists = await mongo_manager.conversations_collection.find_one({
-        "conversation_id": conversation_id,
-        "user_id": user_id
-    })
-    if not conv_exists:
-        await mongo_manager.create_conversation(user_id, conversation_id)
-    
-    # Save user message
-    await mongo_manager.add_message(
-        user_id=user_id,
-        conversation_id=conversation_id,
-        role="user",
-        content=request_body.message.strip(),
-        message_id=request_body.message_id
-    )
-    
+    try:
+        buffer = await start_chat_turn(
+            user_id=DEFAULT_USER_ID,
+            message=request_body.message.strip(),
+            conversation_id=request_body.conversation_id,
+            message_id=request_body.message_id
+        )
+    except ServiceDrainingError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": "5"}
+        ) from e
+    return _ndjson_stream(buffer, offset=0)
+
+@router.get("/message/{message_id}/stream", summary="Resume chat message stream")
+async def resume_chat_stream(message_id: str, offset: int = 0):
+    """
+    Reconnect to an in-flight or recently finished generation.
+    `offset` is the number of characters of the assistant reply the client already has.
+    """
+    buffer = replay_store.get(message_id)
+    if not buffer:
+        raise HTTPException(status_code=404, detail="Stream not found or expired")
+    if offset < buffer.base_offset:
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail=f"Offset {offset} is no longer buffered; earliest available offset is {buffer.base_offset}"
+        )
+    return _ndjson_stream(buffer, offset=offset)
+
+def _ndjson_stream(buffer: ReplayBuffer, offset: int) -> StreamingResponse:
+    """Stream replay buffer events as NDJSON; disconnecting does not stop the generation"""
     async def event_stream_generator():
         try:
-            async for event in generate_chat_llm_stream(
-                user_id=user_id,
-                conversation_id=conversation_id,
-                user_message=request_body.message.strip(),
-                db_manager=mongo_manager
-            ):
-                if event:
-                    yield json.dumps(event) + "\n"
+            async for event in buffer.subscribe(offset):
+                yield dumps(event) + b"\n"
         except Exception as e:
-            logger.error(f"Error in chat stream: {e}", exc_info=True)
+            logger.error("Error in chat stream: %s", e, exc_info=True)
             error_response = {
                 "type": "error",
                 "message": "Sorry, I encountered an error while processing your request."
             }
-            yield json.dumps(error_response) + "\n"
+            yield dumps(error_response) + b"\n"
     
     return StreamingResponse(
         event_stream_generator(),
@@ -96,20 +101,76 @@ async def chat_endpoint(request_body: ChatMessageInput):
     )
 
 @router.get("/history", summary="Get chat history")
-async def get_chat_history(conversation_id: str, limit: int = 30):
+async def get_chat_history(request: Request, conversation_id: str, limit: int = 30):
     """
-    Get chat history for a conversation
+    Get chat history for a conversation.
+    Supports If-None-Match: the ETag is the conversation's message version counter.
     """
+    version = await mongo_manager.get_conversation_version(DEFAULT_USER_ID, conversation_id)
+    etag = f'W/"h-{conversation_id}-{version}-{limit}"' if version is not None else None
+    if etag and etag_matches(request, etag):
+        return not_modified(etag)
     messages = await mongo_manager.get_recent_messages(DEFAULT_USER_ID, conversation_id, limit=limit)
-    return {"messages": messages}
+    return conditional_json_response(request, {"messages": messages}, etag)
+
+def _encode_sync_cursor(cursor: Optional[Tuple[datetime.datetime, str]]) -> Optional[str]:
+    """Opaque cursor string: '<epoch milliseconds>:<id>' (the id is empty for a position between items)"""
+    if cursor is None:
+        return None
+    return f"{int(cursor[0].timestamp() * 1000)}:{cursor[1]}"
+
+def _decode_sync_cursor(cursor: str) -> Tuple[datetime.datetime, str]:
+    millis, sep, item_id = cursor.partition(":")
+    if not sep or not millis.isdigit():
+        raise HTTPException(status_code=400, detail="Invalid sync cursor")
+    return datetime.datetime.fromtimestamp(int(millis) / 1000, datetime.timezone.utc), item_id
+
+@router.get("/sync", summary="Get history changes since a cursor")
+async def sync_chat_history(request: Request, conversation_id: str, cursor: Optional[str] = None, limit: int = 200):
+    """
+    Delta sync for a conversation.
+    Without a cursor (or with one older than the tombstone retention) returns the latest messages with
+    `reset: true`. Otherwise returns messages added and message IDs deleted since the cursor; `cleared: true`
+    means the conversation was cleared, so the client drops everything it had before applying `messages`.
+    Pass the returned `cursor` on the next call, and call again immediately while `has_more` is true.
+    The cursor trails the newest changes by SYNC_SAFETY_LAG_SECONDS so that writes committed out of
+    timestamp order are not skipped; changes inside that window are returned again on the next call,
+    so clients apply messages by `message_id` and deletions idempotently.
+    """
+    limit = max(1, min(limit, 500))
+    changes = await mongo_manager.get_changes_since(
+        DEFAULT_USER_ID, conversation_id,
+        cursor=_decode_sync_cursor(cursor) if cursor else None,
+        limit=limit
+    )
+    changes["cursor"] = _encode_sync_cursor(changes["cursor"]) or cursor
+    return conditional_json_response(request, changes)
 
 @router.get("/conversations", summary="Get all conversations")
-async def get_conversations(limit: int = 50):
+async def get_conversations(request: Request, limit: int = 50):
     """
-    Get all conversations for the default user
+    Get all conversations for the default user.
+    Supports If-None-Match: the ETag is built from the conversation count, the latest updated_at
+    and the sum of conversation versions.
     """
+    count, latest, versions = await mongo_manager.get_conversations_version(DEFAULT_USER_ID)
+    stamp = int(latest.timestamp() * 1000) if latest else 0
+    etag = f'W/"c-{count}-{stamp}-{versions}-{limit}"'
+    if etag_matches(request, etag):
+        return not_modified(etag)
     conversations = await mongo_manager.get_conversations(DEFAULT_USER_ID, limit=limit)
-    return {"conversations": conversations}
+    return conditional_json_response(request, {"conversations": conversations}, etag)
+
+@router.get("/usage", summary="Get token usage stats")
+async def get_usage_stats(days: int = 7):
+    """
+    Get cumulative and per-day token usage for the default user.
+    Token counts are estimated locally (the streaming path does not receive provider usage);
+    such documents carry "estimated": true.
+    """
+    days = max(1, min(days, 366))
+    stats = await mongo_manager.get_usage_stats(DEFAULT_USER_ID, days=days)
+    return FastJSONResponse(stats)
 
 @router.post("/conversations", summary="Create new conversation")
 async def create_conversation(title: Optional[str] = None):
@@ -138,6 +199,7 @@ async def delete_conversation(conversation_id: str):
     """
     success = await mongo_manager.delete_conversation(DEFAULT_USER_ID, conversation_id)
     if success:
+        memory_gc.enqueue(DEFAULT_USER_ID, conversation_id)
         return {"message": "Conversation deleted successfully."}
     else:
         raise HTTPException(
@@ -154,6 +216,7 @@ async def delete_message(request: DeleteMessageRequest):
     
     if request.clear_all:
         deleted_count = await mongo_manager.delete_all_messages(user_id, request.conversation_id)
+        memory_gc.enqueue(user_id, request.conversation_id)
         return {"message": f"Successfully deleted {deleted_count} messages."}
     
     if request.message_id:
@@ -2,20 +2,31 @@
 简化的聊天逻辑 - 集成短期记忆（最近5轮）和长期记忆（mem0）
 """
 import asyncio
-import json
 import logging
 import re
 import threading
+import time
 import uuid
-from typing import List, Dict, Any, AsyncGenerator
+from typing import List, Dict, Any, AsyncGenerator, Optional
 from datetime import datetime, timezone
 
-from main.llm import run_agent, LLMProviderDownError
+from main.config import (CHAT_REQUEST_BUDGET_SECONDS, CHAT_FIRST_TOKEN_TIMEOUT_SECONDS,
+                         CHAT_INTER_TOKEN_TIMEOUT_SECONDS, CHAT_HISTORY_TIMEOUT_SECONDS,
+                         MEMORY_SEARCH_TIMEOUT_SECONDS, MEMORY_EXTRACT_TIMEOUT_SECONDS,
+                         CHAT_PERSIST_MIN_TIMEOUT_SECONDS)
+from main.deadline import Deadline
+from main.llm import run_agent, LLMProviderDownError, LLMTimeoutError
 from main.db import MongoManager
 from main.memory.mem0_client import mem0_client
+from main.usage import build_turn_usage
+from main.chat.channel import SnapshotChannel
+from main.metrics import call_counters
 
 logger = logging.getLogger(__name__)
 
+# run_agent 在工作线程中执行首token/token间超时；消费方只在工作线程没有按时报告时兜底
+WORKER_TIMEOUT_GRACE_SECONDS = 1.0
+
 def parse_assistant_response(assistant_messages: List[Dict[str, Any]]) -> Dict[str, Any]:
     """
     解析助手消息，提取最终内容和turn步骤
@@ -61,7 +72,9 @@ async def generate_chat_llm_stream(
     user_id: str,
     conversation_id: str,
     user_message: str,
-    db_manager: MongoManager
+    db_manager: MongoManager,
+    deadline: Optional[Deadline] = None,
+    assistant_message_id: Optional[str] = None
 ) -> AsyncGenerator[Dict[str, Any], None]:
     """
     生成聊天流式响应，集成短期和长期记忆
@@ -71,24 +84,55 @@ async def generate_chat_llm_stream(
         conversation_id: 会话ID
         user_message: 用户消息
         db_manager: MongoDB管理器
+        deadline: 请求截止时间，各阶段只使用剩余预算
+        assistant_message_id: 可选的助手消息ID（用于重放缓冲的键）
         
     Yields:
         流式响应事件
     """
-    assistant_message_id = str(uuid.uuid4())
+    assistant_message_id = assistant_message_id or str(uuid.uuid4())
+    deadline = deadline or Deadline(CHAT_REQUEST_BUDGET_SECONDS)
     
     try:
         # 1. 获取短期记忆（最近5轮对话 = 10条消息）
-        recent_messages = await db_manager.get_recent_messages(user_id, conversation_id, limit=10)
-        logger.info(f"Retrieved {len(recent_messages)} recent messages for user {user_id}")
+        recent_messages = []
+        try:
+            recent_messages = await db_manager.get_recent_messages(
+                user_id, conversation_id, limit=10,
+                timeout=deadline.timeout(CHAT_HISTORY_TIMEOUT_SECONDS, floor=0.1)
+            )
+            logger.info("Retrieved %d recent messages for user %s", len(recent_messages), user_id)
+        except Exception as e:
+            logger.warning("Failed to retrieve recent messages within budget: %s", e)
         
         # 2. 检索长期记忆（mem0）- 使用 conversation_id 隔离不同对话的记忆
+        # 长期记忆是可选的：剩余预算不足以同时等待检索和首token时跳过
         long_term_memories = []
-        try:
-            long_term_memories = await mem0_client.search_memories(user_id, user_message, limit=5, conversation_id=conversation_id)
-            logger.info(f"Retrieved {len(long_term_memories)} long-term memories for user {user_id} (conversation: {conversation_id})")
-        except Exception as e:
-            logger.warning(f"Failed to retrieve long-term memories: {e}")
+        if deadline.has_budget_for(MEMORY_SEARCH_TIMEOUT_SECONDS + CHAT_FIRST_TOKEN_TIMEOUT_SECONDS):
+            # 门控：寒暄、过短或只引用上文的消息不值得一次embedding和向量检索
+            gate = mem0_client.retrieval_gate
+            partition = f"{user_id}:{conversation_id}"
+            # 当前用户消息已经保存时不计入窗口
+            window = recent_messages
+            if window and window[-1].get("role") == "user" and window[-1].get("content") == user_message:
+                window = window[:-1]
+            decision = gate.decide(partition, user_message, window)
+            if decision["retrieve"]:
+                try:
+                    results = await mem0_client.search_memories(
+                        user_id, user_message, limit=decision["top_k"], conversation_id=conversation_id,
+                        timeout=deadline.timeout(MEMORY_SEARCH_TIMEOUT_SECONDS)
+                    )
+                    gate.observe(partition, results)
+                    long_term_memories = gate.filter(results)
+                    logger.info("Retrieved %d long-term memories (%d above threshold) for user %s (conversation: %s)",
+                                len(results), len(long_term_memories), user_id, conversation_id)
+                except Exception as e:
+                    logger.warning("Failed to retrieve long-term memories: %s", e)
+            else:
+                call_counters.increment("memory_searches_gated")
+        else:
+            logger.info("Skipping long-term memory search, %.2fs of budget left", deadline.remaining())
         
         # 3. 构建消息列表
         messages = []
@@ -121,21 +165,36 @@ Your role is to have natural, helpful conversations. Be friendly, informative, a
         
         # 5. 运行LLM代理
         loop = asyncio.get_running_loop()
-        queue: asyncio.Queue[Optional[Any]] = asyncio.Queue()
+        # 只保留最新的历史快照，客户端读取慢时内存不随积压增长
+        channel = SnapshotChannel(loop)
+        stop_event = threading.Event()
+        # run_agent 在首个输出到达时填入实际使用的端点和模型
+        run_info: Dict[str, Any] = {}
         
         def worker():
             try:
-                logger.info(f"Starting agent worker for user {user_id}")
-                for new_history_step in run_agent(system_message=system_prompt, function_list=[], messages=messages):
+                logger.info("Starting agent worker for user %s", user_id)
+                # 超时和截止时间在 run_agent 内部执行；stop_event（客户端取消）让阻塞中的 run_agent 也能及时退出
+                for new_history_step in run_agent(
+                    system_message=system_prompt, function_list=[], messages=messages, run_info=run_info,
+                    first_token_timeout=CHAT_FIRST_TOKEN_TIMEOUT_SECONDS,
+                    inter_token_timeout=CHAT_INTER_TOKEN_TIMEOUT_SECONDS,
+                    deadline=deadline, cancel_event=stop_event
+                ):
+                    if stop_event.is_set():
+                        # 停止迭代会关闭run_agent并取消上游请求
+                        break
                     if new_history_step:
-                        loop.call_soon_threadsafe(queue.put_nowait, new_history_step)
-                logger.info(f"Agent worker completed for user {user_id}")
+                        channel.publish(new_history_step)
+                logger.info("Agent worker completed for user %s", user_id)
             except Exception as e:
-                logger.error(f"Error in chat worker thread for user {user_id}: {e}", exc_info=True)
-                loop.call_soon_threadsafe(queue.put_nowait, {"_error": str(e)})
+                logger.error("Error in chat worker thread for user %s: %s", user_id, e, exc_info=True)
+                channel.close(error=e)
             finally:
-                loop.call_soon_threadsafe(queue.put_nowait, None)
+                channel.close()
         
+        agent_started_at = time.monotonic()
+        first_token_at: Optional[float] = None
         thread = threading.Thread(target=worker, daemon=True)
         thread.start()
         
@@ -143,12 +202,19 @@ Your role is to have natural, helpful conversations. Be friendly, informative, a
         final_assistant_messages = []
         
         try:
+            received_first = False
             while True:
-                current_history = await queue.get()
+                token_timeout = CHAT_INTER_TOKEN_TIMEOUT_SECONDS if received_first else CHAT_FIRST_TOKEN_TIMEOUT_SECONDS
+                try:
+                    current_history = await asyncio.wait_for(
+                        channel.get(), timeout=deadline.timeout(token_timeout) + WORKER_TIMEOUT_GRACE_SECONDS
+                    )
+                except asyncio.TimeoutError:
+                    stage = "inter-token" if received_first else "first-token"
+                    raise LLMTimeoutError(f"LLM {stage} timeout (budget left: {deadline.remaining():.2f}s)") from None
                 if current_history is None:
                     break
-                if isinstance(current_history, dict) and "_error" in current_history:
-                    raise Exception(f"Qwen Agent worker failed: {current_history['_error']}")
+                received_first = True
                 if not isinstance(current_history, list):
                     continue
                 
@@ -172,6 +238,8 @@ Your role is to have natural, helpful conversations. Be friendly, informative, a
                 
                 if len(current_final_content) > len(last_yielded_final_content):
                     new_token = current_final_content[len(last_yielded_final_content):]
+                    if first_token_at is None:
+                        first_token_at = time.monotonic()
                     event_payload = {
                         "type": "assistantStream",
                         "token": new_token,
@@ -182,14 +250,21 @@ Your role is to have natural, helpful conversations. Be friendly, informative, a
                     last_yielded_final_content = current_final_content
         
         except asyncio.CancelledError:
+            stop_event.set()
             raise
+        except LLMTimeoutError as e:
+            stop_event.set()
+            logger.error("LLM timed out for user %s: %s", user_id, e)
+            yield {"type": "error", "message": "Sorry, the AI provider took too long to respond. Please try again."}
         except LLMProviderDownError as e:
-            logger.error(f"LLM provider is down for user {user_id}: {e}", exc_info=True)
-            yield json.dumps({"type": "error", "message": "Sorry, our AI provider is currently down. Please try again later."}) + "\n"
+            stop_event.set()
+            logger.error("LLM provider is down for user %s: %s", user_id, e, exc_info=True)
+            yield {"type": "error", "message": "Sorry, our AI provider is currently down. Please try again later."}
         except Exception as e:
+            stop_event.set()
             error_msg = str(e)
-            logger.error(f"Error during main chat agent run for user {user_id}: {error_msg}", exc_info=True)
-            yield json.dumps({"type": "error", "message": f"An unexpected error occurred: {error_msg}"}) + "\n"
+            logger.error("Error during main chat agent run for user %s: %s", user_id, error_msg, exc_info=True)
+            yield {"type": "error", "message": f"An unexpected error occurred: {error_msg}"}
         finally:
             # 保存最终响应
             if final_assistant_messages:
@@ -198,23 +273,53 @@ Your role is to have natural, helpful conversations. Be friendly, informative, a
                 turn_steps = parsed_data.get("turn_steps", [])
                 
                 if final_content:
-                    # 保存助手消息到数据库
-                    await db_manager.add_message(
-                        user_id=user_id,
-                        conversation_id=conversation_id,
-                        role="assistant",
-                        content=final_content,
-                        message_id=assistant_message_id,
-                        turn_steps=turn_steps
+                    # 本轮用量（本地估算）；分词在线程中执行，不阻塞事件循环上的其他流
+                    usage = await asyncio.to_thread(
+                        build_turn_usage,
+                        system_prompt, messages, final_assistant_messages, final_content, run_info,
+                        latency_seconds=time.monotonic() - agent_started_at,
+                        ttft_seconds=first_token_at - agent_started_at if first_token_at else None
+                    )
+                    
+                    # 保存助手消息到数据库（即使预算耗尽也保留最小超时）
+                    assistant_doc = await asyncio.wait_for(
+                        db_manager.add_message(
+                            user_id=user_id,
+                            conversation_id=conversation_id,
+                            role="assistant",
+                            content=final_content,
+                            message_id=assistant_message_id,
+                            turn_steps=turn_steps,
+                            usage=usage
+                        ),
+                        timeout=deadline.timeout(floor=CHAT_PERSIST_MIN_TIMEOUT_SECONDS)
                     )
                     
-                    # 提取并存储长期记忆（异步，不阻塞响应）
+                    # 累加按用户/按天的用量统计
+                    try:
+                        await asyncio.wait_for(
+                            db_manager.record_usage(user_id, usage),
+                            timeout=deadline.timeout(floor=CHAT_PERSIST_MIN_TIMEOUT_SECONDS)
+                        )
+                    except Exception as e:
+                        logger.warning("Failed to record usage stats: %s", e)
+                    
+                    # 提取并存储长期记忆：只处理高水位线之后的消息
                     try:
-                        # 构建对话历史用于记忆提取
-                        conversation_for_memory = messages + [{"role": "assistant", "content": final_content}]
-                        await mem0_client.extract_and_store(user_id, conversation_for_memory, conversation_id=conversation_id)
+                        # 短期记忆已包含本轮用户消息（生成前已保存）；读取失败时补上
+                        history_for_memory = list(recent_messages)
+                        if not history_for_memory or history_for_memory[-1].get("role") != "user":
+                            history_for_memory.append({"role": "user", "content": user_message, "timestamp": None})
+                        history_for_memory.append(assistant_doc)
+                        watermark = await db_manager.get_memory_watermark(user_id, conversation_id)
+                        new_watermark = await mem0_client.extract_incremental(
+                            user_id, history_for_memory, watermark, conversation_id=conversation_id,
+                            timeout=deadline.timeout(MEMORY_EXTRACT_TIMEOUT_SECONDS, floor=CHAT_PERSIST_MIN_TIMEOUT_SECONDS)
+                        )
+                        if new_watermark:
+                            await db_manager.set_memory_watermark(user_id, conversation_id, new_watermark)
                     except Exception as e:
-                        logger.warning(f"Failed to extract memories: {e}")
+                        logger.warning("Failed to extract memories: %s", e)
                 
                 # 发送完成事件
                 final_payload = {
@@ -228,6 +333,6 @@ Your role is to have natural, helpful conversations. Be friendly, informative, a
                 yield final_payload
     
     except Exception as e:
-        logger.error(f"Error in generate_chat_llm_stream for user {user_id}: {e}", exc_info=True)
-        yield json.dumps({"type": "error", "message": f"An unexpected error occurred: {str(e)}"}) + "\n"
+        logger.error("Error in generate_chat_llm_stream for user %s: %s", user_id, e, exc_info=True)
+        yield {"type": "error", "message": f"An unexpected error occurred: {str(e)}"}
 
@@ -0,0 +1,231 @@
+"""
+Chat WebSocket transport - multiple concurrent conversations over one connection
+
+Shares the generation engine (start_chat_turn + replay buffers) with
+POST /api/chat/message. Every frame is a JSON object tagged with a
+client-chosen `stream_id`.
+
+Client -> server:
+    {"type": "chat", "stream_id": "s1", "message": "...", "conversation_id": "...", "message_id": "..."}
+    {"type": "resume", "stream_id": "s1", "messageId": "...", "offset": 0}
+    {"type": "ack", "stream_id": "s1", "offset": 1234}   # characters consumed (flow control)
+    {"type": "cancel", "stream_id": "s1"}                 # stop the generation server-side
+
+Server -> client:
+    the same events as the NDJSON stream, plus "stream_id", and
+    {"type": "streamEnd", "stream_id": "s1"} when a stream finishes.
+"""
+import asyncio
+import json
+import logging
+from typing import Dict, Any, Optional, Set
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+
+from main.chat.engine import start_chat_turn
+from main.chat.replay import ReplayBuffer, replay_store
+from main.config import WS_STREAM_WINDOW_CHARS, WS_MAX_STREAMS_PER_CONNECTION
+from main.drain import ServiceDrainingError
+from main.serialization import dumps
+
+router = APIRouter(
+    prefix="/api/chat",
+    tags=["Chat"]
+)
+
+logger = logging.getLogger(__name__)
+
+# Fixed user ID for all users (no authentication), same as the HTTP routes
+DEFAULT_USER_ID = "default-user"
+
+
+class _Stream:
+    """One multiplexed stream: relays a replay buffer under a credit window"""
+
+    def __init__(self, stream_id: str, buffer: ReplayBuffer, offset: int):
+        self.stream_id = stream_id
+        self.buffer = buffer
+        self.offset = offset
+        self.sent_chars = offset
+        self.acked_chars = offset
+        self.credit = asyncio.Event()
+        self.credit.set()
+        self.task: Optional[asyncio.Task] = None
+
+    def ack(self, offset: int):
+        if offset > self.acked_chars:
+            self.acked_chars = offset
+            if self.sent_chars - self.acked_chars < WS_STREAM_WINDOW_CHARS:
+                self.credit.set()
+
+
+class ChatConnection:
+    """State of one WebSocket connection"""
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.streams: Dict[str, _Stream] = {}
+        # Chat turns still being set up (history, user message); they hold their stream_id
+        self.starting: Dict[str, asyncio.Task] = {}
+        self._cancel_on_start: Set[str] = set()
+        self.closed = False
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, payload: Dict[str, Any]):
+        # Starlette websockets do not allow concurrent sends
+        async with self._send_lock:
+            await self.websocket.send_text(dumps(payload).decode("utf-8"))
+
+    async def send_error(self, message: str, stream_id: Optional[str] = None):
+        payload = {"type": "error", "message": message}
+        if stream_id:
+            payload["stream_id"] = stream_id
+        await self.send(payload)
+
+    async def handle(self, frame: Dict[str, Any]):
+        frame_type = frame.get("type")
+        stream_id = frame.get("stream_id")
+        if not stream_id:
+            await self.send_error("stream_id is required")
+            return
+
+        if frame_type in ("chat", "resume"):
+            if stream_id in self.streams or stream_id in self.starting:
+                await self.send_error("stream_id is already in use", stream_id)
+                return
+            if len(self.streams) + len(self.starting) >= WS_MAX_STREAMS_PER_CONNECTION:
+                await self.send_error("Too many concurrent streams on this connection", stream_id)
+                return
+            if frame_type == "chat":
+                # Setting up a turn awaits the database; run it as a task so the receive
+                # loop keeps handling acks and cancels for the other streams meanwhile
+                self.starting[stream_id] = asyncio.create_task(self._start_chat(stream_id, frame))
+            else:
+                await self._resume(stream_id, frame)
+        elif frame_type == "ack":
+            stream = self.streams.get(stream_id)
+            if stream:
+                stream.ack(int(frame.get("offset", 0)))
+        elif frame_type == "cancel":
+            await self._cancel(stream_id)
+        else:
+            await self.send_error(f"Unknown frame type: {frame_type}", stream_id)
+
+    async def _start_chat(self, stream_id: str, frame: Dict[str, Any]):
+        try:
+            message = (frame.get("message") or "").strip()
+            if not message:
+                await self.send_error("Message cannot be empty", stream_id)
+                return
+            try:
+                buffer = await start_chat_turn(
+                    user_id=DEFAULT_USER_ID,
+                    message=message,
+                    conversation_id=frame.get("conversation_id"),
+                    message_id=frame.get("message_id")
+                )
+            except ServiceDrainingError as e:
+                await self.send_error(str(e), stream_id)
+                return
+            if stream_id in self._cancel_on_start and buffer.task and not buffer.task.done():
+                buffer.task.cancel()
+            if not self.closed:
+                self._open(stream_id, buffer, offset=0)
+        except (WebSocketDisconnect, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            logger.error("Error starting websocket stream %s: %s", stream_id, e, exc_info=True)
+            try:
+                await self.send_error("Sorry, I encountered an error while processing your request.", stream_id)
+            except Exception:
+                pass
+        finally:
+            self.starting.pop(stream_id, None)
+            self._cancel_on_start.discard(stream_id)
+
+    async def _resume(self, stream_id: str, frame: Dict[str, Any]):
+        buffer = replay_store.get(frame.get("messageId") or "")
+        offset = int(frame.get("offset", 0))
+        if not buffer:
+            await self.send_error("Stream not found or expired", stream_id)
+            return
+        if offset < buffer.base_offset:
+            await self.send_error(f"Offset {offset} is no longer buffered", stream_id)
+            return
+        self._open(stream_id, buffer, offset=offset)
+
+    def _open(self, stream_id: str, buffer: ReplayBuffer, offset: int):
+        stream = _Stream(stream_id, buffer, offset)
+        self.streams[stream_id] = stream
+        stream.task = asyncio.create_task(self._pump(stream))
+
+    async def _pump(self, stream: _Stream):
+        """Relay buffer events, pausing while the unacknowledged window is full"""
+        try:
+            async for event in stream.buffer.subscribe(stream.offset):
+                token = event.get("token") if "offset" in event else None
+                if token:
+                    while stream.sent_chars - stream.acked_chars >= WS_STREAM_WINDOW_CHARS:
+                        stream.credit.clear()
+                        await stream.credit.wait()
+                    stream.sent_chars = event["offset"] + len(token)
+                await self.send({**event, "stream_id": stream.stream_id})
+            await self.send({"type": "streamEnd", "stream_id": stream.stream_id})
+        except (WebSocketDisconnect, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            logger.error("Error in websocket stream %s: %s", stream.stream_id, e, exc_info=True)
+        finally:
+            self.streams.pop(stream.stream_id, None)
+
+    async def _cancel(self, stream_id: str):
+        if stream_id in self.starting:
+            # Cancelled before the turn finished starting: cancel the generation once it exists
+            self._cancel_on_start.add(stream_id)
+            return
+        stream = self.streams.get(stream_id)
+        if not stream:
+            await self.send_error("Unknown stream", stream_id)
+            return
+        # Cancelling the generation task stops the agent; the pump then relays
+        # the cancellation event and the final payload before closing
+        if stream.buffer.task and not stream.buffer.task.done():
+            stream.buffer.task.cancel()
+
+    def close(self):
+        # Generations keep running after a disconnect so they can be resumed;
+        # turns still starting finish setting up but open no stream
+        self.closed = True
+        for stream in list(self.streams.values()):
+            if stream.task:
+                stream.task.cancel()
+
+
+@router.websocket("/ws")
+async def chat_websocket(websocket: WebSocket):
+    await websocket.accept()
+    connection = ChatConnection(websocket)
+    try:
+        while True:
+            text = await websocket.receive_text()
+            # A malformed frame is answered with an error; it must not drop the other streams
+            try:
+                frame = json.loads(text)
+            except ValueError:
+                frame = None
+            if not isinstance(frame, dict):
+                await connection.send_error("Frames must be JSON objects")
+                continue
+            try:
+                await connection.handle(frame)
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                logger.error("Error handling websocket frame: %s", e, exc_info=True)
+                await connection.send_error(
+                    "Sorry, I encountered an error while processing your request.", frame.get("stream_id")
+                )
+    except WebSocketDisconnect:
+        logger.info("Chat websocket disconnected")
+    finally:
+        connection.close()
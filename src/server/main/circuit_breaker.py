@@ -0,0 +1,139 @@
+"""
+熔断器 - 保护LLM、embedding和向量库等外部依赖
+
+CLOSED: 正常放行，连续失败达到阈值后进入 OPEN
+OPEN: 直接拒绝（调用方快速失败或降级），经过恢复时间后进入 HALF_OPEN
+HALF_OPEN: 放行有限数量的探测请求，成功则恢复 CLOSED，失败则重新 OPEN；
+           探测超过 probe_timeout 仍未报告结果时视为失败，重新 OPEN
+"""
+import logging
+import threading
+import time
+from typing import Dict, Any
+
+from main.config import (CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RECOVERY_SECONDS,
+                         CIRCUIT_HALF_OPEN_MAX_CALLS, CIRCUIT_PROBE_TIMEOUT_SECONDS)
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected because its circuit breaker is open."""
+    pass
+
+
+class CircuitBreaker:
+    """Thread-safe circuit breaker with closed, open and half-open states"""
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_seconds: float = 30.0,
+                 half_open_max_calls: int = 1, probe_timeout: float = 60.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.half_open_max_calls = half_open_max_calls
+        self.probe_timeout = probe_timeout
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.half_open_in_flight = 0
+        self.probe_started_at = 0.0
+        self.total_successes = 0
+        self.total_failures = 0
+        self.total_rejected = 0
+        self.times_opened = 0
+        self._lock = threading.Lock()
+
+    def _transition(self, state: str):
+        if self.state != state:
+            logger.warning("Circuit breaker '%s' %s -> %s", self.name, self.state, state)
+            self.state = state
+
+    def _open(self):
+        # 持锁调用
+        if self.state != OPEN:
+            self.times_opened += 1
+        self._transition(OPEN)
+        self.opened_at = time.monotonic()
+
+    def allow_request(self) -> bool:
+        """是否放行本次调用；放行后必须调用 record_success / record_failure / record_cancel 之一"""
+        with self._lock:
+            if (self.state == HALF_OPEN and self.half_open_in_flight
+                    and time.monotonic() - self.probe_started_at >= self.probe_timeout):
+                # 探测调用挂起没有报告结果：按失败处理并释放名额，而不是永远停在半开
+                logger.warning("Circuit breaker '%s' probe timed out after %.1fs", self.name, self.probe_timeout)
+                self.total_failures += 1
+                self.consecutive_failures += 1
+                self.half_open_in_flight = 0
+                self._open()
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.recovery_seconds:
+                    self.total_rejected += 1
+                    return False
+                self._transition(HALF_OPEN)
+                self.half_open_in_flight = 0
+            if self.state == HALF_OPEN:
+                if self.half_open_in_flight >= self.half_open_max_calls:
+                    self.total_rejected += 1
+                    return False
+                self.half_open_in_flight += 1
+                self.probe_started_at = time.monotonic()
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.total_successes += 1
+            self.consecutive_failures = 0
+            if self.state == HALF_OPEN:
+                self.half_open_in_flight = max(0, self.half_open_in_flight - 1)
+                self._transition(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.total_failures += 1
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN:
+                self.half_open_in_flight = max(0, self.half_open_in_flight - 1)
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                self._open()
+
+    def record_cancel(self):
+        """调用在得出结果前被放弃（例如客户端断开），释放半开探测名额"""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.half_open_in_flight = max(0, self.half_open_in_flight - 1)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "successes": self.total_successes,
+                "failures": self.total_failures,
+                "rejected": self.total_rejected,
+                "times_opened": self.times_opened,
+            }
+
+
+def _make_breaker(name: str) -> CircuitBreaker:
+    return CircuitBreaker(
+        name,
+        failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+        recovery_seconds=CIRCUIT_RECOVERY_SECONDS,
+        half_open_max_calls=CIRCUIT_HALF_OPEN_MAX_CALLS,
+        probe_timeout=CIRCUIT_PROBE_TIMEOUT_SECONDS,
+    )
+
+
+# 全局熔断器实例
+llm_breaker = _make_breaker("llm")
+memory_search_breaker = _make_breaker("mem0_search")
+memory_extract_breaker = _make_breaker("mem0_extract")
+
+
+def breaker_metrics() -> Dict[str, Dict[str, Any]]:
+    return {breaker.name: breaker.metrics() for breaker in (llm_breaker, memory_search_breaker, memory_extract_breaker)}
@@ -18,15 +18,116 @@ logging.info(f"[Config] Environment: {ENVIRONMENT}")
 # --- Server ---
 APP_SERVER_PORT = int(os.getenv("APP_SERVER_PORT", 5000))
 
+# 读接口的JSON响应超过该字节数且客户端接受gzip时压缩（NDJSON流不压缩）
+HTTP_GZIP_MIN_BYTES = int(os.getenv("HTTP_GZIP_MIN_BYTES", 1024))
+HTTP_GZIP_LEVEL = int(os.getenv("HTTP_GZIP_LEVEL", 5))
+
+# --- 日志 ---
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# json: 每行一个JSON对象；text: 传统的 LEVEL:logger:message 格式
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+# 高频INFO日志按logger采样，如 "main.db=0.1,main.chat.utils=0.25"
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+# 日志队列容量，写出跟不上时丢弃新记录而不是阻塞调用方
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+
 # --- Database ---
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/sentient_db")
 MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "sentient_db")
 
+# 冷热分层：空闲超过阈值的会话压缩归档，访问时自动恢复
+ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "false").lower() == "true"
+ARCHIVE_IDLE_DAYS = int(os.getenv("ARCHIVE_IDLE_DAYS", 30))
+ARCHIVE_INTERVAL_SECONDS = int(os.getenv("ARCHIVE_INTERVAL_SECONDS", 3600))
+ARCHIVE_BLOCK_SIZE = int(os.getenv("ARCHIVE_BLOCK_SIZE", 100))
+# 归档会话的保留天数，0表示永久保留
+ARCHIVE_TTL_DAYS = int(os.getenv("ARCHIVE_TTL_DAYS", 0))
+# 删除记录（墓碑）保留天数，增量同步的游标早于该期限时客户端需要完整重新加载
+MESSAGE_TOMBSTONE_TTL_DAYS = int(os.getenv("MESSAGE_TOMBSTONE_TTL_DAYS", 30))
+# 增量同步的安全窗口：消息时间在写入前生成，并发写入（尤其是组提交）的可见顺序与时间顺序不一致，
+# 同步游标不越过 now - 该窗口，窗口内的变更在下次同步时重新返回。应大于一次消息写入的最长耗时
+SYNC_SAFETY_LAG_SECONDS = float(os.getenv("SYNC_SAFETY_LAG_SECONDS", 15))
+# 组提交（可选）：刷新间隔内所有流的消息写入合并为一次 insert_many 和一次 bulk_write
+MONGO_GROUP_COMMIT_ENABLED = os.getenv("MONGO_GROUP_COMMIT_ENABLED", "false").lower() == "true"
+MONGO_GROUP_COMMIT_INTERVAL_MS = float(os.getenv("MONGO_GROUP_COMMIT_INTERVAL_MS", 5))
+MONGO_GROUP_COMMIT_MAX_BATCH = int(os.getenv("MONGO_GROUP_COMMIT_MAX_BATCH", 100))
+
 # --- LLM配置 ---
 OPENAI_API_BASE_URL = os.getenv("OPENAI_API_BASE_URL", "https://llmapi.paratera.com/v1")
 OPENAI_MODEL_NAME = os.getenv("OPENAI_MODEL_NAME", "DeepSeek-V3.2")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 
+# 多端点路由：JSON列表 [{"name", "base_url", "model", "api_key"}]，未设置时只使用上面的端点
+LLM_ENDPOINTS_JSON = os.getenv("LLM_ENDPOINTS", "")
+# 对冲请求：首个端点在其p95 TTFT内没有输出时，向次优端点发起第二个请求
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+LLM_HEDGE_DEFAULT_DELAY_SECONDS = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY_SECONDS", 2.0))
+LLM_ENDPOINT_MAX_ERROR_RATE = float(os.getenv("LLM_ENDPOINT_MAX_ERROR_RATE", 0.5))
+
+# --- 请求时间预算 ---
+CHAT_REQUEST_BUDGET_SECONDS = float(os.getenv("CHAT_REQUEST_BUDGET_SECONDS", 120))
+CHAT_FIRST_TOKEN_TIMEOUT_SECONDS = float(os.getenv("CHAT_FIRST_TOKEN_TIMEOUT_SECONDS", 30))
+CHAT_INTER_TOKEN_TIMEOUT_SECONDS = float(os.getenv("CHAT_INTER_TOKEN_TIMEOUT_SECONDS", 15))
+CHAT_HISTORY_TIMEOUT_SECONDS = float(os.getenv("CHAT_HISTORY_TIMEOUT_SECONDS", 2))
+MEMORY_SEARCH_TIMEOUT_SECONDS = float(os.getenv("MEMORY_SEARCH_TIMEOUT_SECONDS", 3))
+MEMORY_EXTRACT_TIMEOUT_SECONDS = float(os.getenv("MEMORY_EXTRACT_TIMEOUT_SECONDS", 30))
+# 持久化消息的最小超时，即使请求预算已耗尽也尽量保存
+CHAT_PERSIST_MIN_TIMEOUT_SECONDS = float(os.getenv("CHAT_PERSIST_MIN_TIMEOUT_SECONDS", 5))
+
+# 启动预热：每个步骤（Mongo、embedding、向量集合、LLM端点）的超时
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+WARMUP_STEP_TIMEOUT_SECONDS = float(os.getenv("WARMUP_STEP_TIMEOUT_SECONDS", 15))
+
+# 优雅排空：关闭前等待进行中的生成和记忆任务完成的最长时间
+DRAIN_GRACE_SECONDS = float(os.getenv("DRAIN_GRACE_SECONDS", 60))
+
+# --- 熔断器 (LLM / mem0) ---
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5))
+CIRCUIT_RECOVERY_SECONDS = float(os.getenv("CIRCUIT_RECOVERY_SECONDS", 30))
+CIRCUIT_HALF_OPEN_MAX_CALLS = int(os.getenv("CIRCUIT_HALF_OPEN_MAX_CALLS", 1))
+# 半开探测超过该时间仍未报告结果（调用方挂起）时释放探测名额
+CIRCUIT_PROBE_TIMEOUT_SECONDS = float(os.getenv("CIRCUIT_PROBE_TIMEOUT_SECONDS", 60))
+
 if not OPENAI_API_KEY:
     logging.warning("OPENAI_API_KEY is not set. LLM functionality will not work.")
 
+
+# --- 长期记忆 (mem0) ---
+# 词法快速通道：BM25命中足够可信时跳过embedding和向量检索
+# CONFIDENT_SCORE 与归一化BM25分数（0~1，相对查询的理想分数）比较
+MEMORY_LEXICAL_ENABLED = os.getenv("MEMORY_LEXICAL_ENABLED", "true").lower() == "true"
+MEMORY_LEXICAL_CONFIDENT_SCORE = float(os.getenv("MEMORY_LEXICAL_CONFIDENT_SCORE", 0.8))
+MEMORY_LEXICAL_CONFIDENT_COVERAGE = float(os.getenv("MEMORY_LEXICAL_CONFIDENT_COVERAGE", 0.8))
+MEMORY_LEXICAL_BOOTSTRAP_LIMIT = int(os.getenv("MEMORY_LEXICAL_BOOTSTRAP_LIMIT", 1000))
+# 已删除会话的记忆回收：周期性清理孤立的记忆分区，0表示只在删除时回收
+MEMORY_GC_INTERVAL_SECONDS = int(os.getenv("MEMORY_GC_INTERVAL_SECONDS", 86400))
+# 检索结果缓存：按分区缓存，写入时失效
+MEMORY_SEARCH_CACHE_ENABLED = os.getenv("MEMORY_SEARCH_CACHE_ENABLED", "true").lower() == "true"
+MEMORY_SEARCH_CACHE_SIZE = int(os.getenv("MEMORY_SEARCH_CACHE_SIZE", 64))
+MEMORY_SEARCH_CACHE_TTL_SECONDS = int(os.getenv("MEMORY_SEARCH_CACHE_TTL_SECONDS", 600))
+# 增量提取：只发送高水位线之后的消息，外加少量上下文重叠；预过滤跳过只有寒暄或过短消息的轮次
+MEMORY_EXTRACT_OVERLAP_MESSAGES = int(os.getenv("MEMORY_EXTRACT_OVERLAP_MESSAGES", 2))
+MEMORY_EXTRACT_PREFILTER_ENABLED = os.getenv("MEMORY_EXTRACT_PREFILTER_ENABLED", "true").lower() == "true"
+# 检索门控：寒暄、过短或只引用上文的消息跳过检索；按新颖度和近期命中分数调整top-k，低于阈值的结果丢弃
+MEMORY_GATE_ENABLED = os.getenv("MEMORY_GATE_ENABLED", "true").lower() == "true"
+MEMORY_GATE_MIN_TERMS = int(os.getenv("MEMORY_GATE_MIN_TERMS", 2))
+MEMORY_GATE_MIN_NOVELTY = float(os.getenv("MEMORY_GATE_MIN_NOVELTY", 0.3))
+MEMORY_MIN_SCORE = float(os.getenv("MEMORY_MIN_SCORE", 0.35))
+MEMORY_GATE_MIN_TOP_K = int(os.getenv("MEMORY_GATE_MIN_TOP_K", 2))
+MEMORY_GATE_MAX_TOP_K = int(os.getenv("MEMORY_GATE_MAX_TOP_K", 8))
+# embedding微批处理：并发请求在窗口内（或凑满一批）合并为一次批量调用
+MEMORY_EMBED_BATCH_ENABLED = os.getenv("MEMORY_EMBED_BATCH_ENABLED", "true").lower() == "true"
+MEMORY_EMBED_BATCH_WINDOW_MS = float(os.getenv("MEMORY_EMBED_BATCH_WINDOW_MS", 5))
+MEMORY_EMBED_BATCH_MAX = int(os.getenv("MEMORY_EMBED_BATCH_MAX", 32))
+# 向量集合按用户哈希分片（1 = 单个 "memories" 集合）；修改后需运行 reshard_memories.py 迁移已有数据
+MEM0_SHARD_COUNT = int(os.getenv("MEM0_SHARD_COUNT", 1))
+
+# --- 流式响应重放（断线续传） ---
+STREAM_REPLAY_TTL_SECONDS = int(os.getenv("STREAM_REPLAY_TTL_SECONDS", 300))
+STREAM_REPLAY_MAX_CHARS = int(os.getenv("STREAM_REPLAY_MAX_CHARS", 200000))
+STREAM_REPLAY_MAX_BUFFERS = int(os.getenv("STREAM_REPLAY_MAX_BUFFERS", 1000))
+
+# --- WebSocket 传输 ---
+# 每个流未确认字符数上限（流量控制窗口）
+WS_STREAM_WINDOW_CHARS = int(os.getenv("WS_STREAM_WINDOW_CHARS", 16384))
+WS_MAX_STREAMS_PER_CONNECTION = int(os.getenv("WS_MAX_STREAMS_PER_CONNECTION", 16))
@@ -4,27 +4,70 @@
 import datetime
 import uuid
 import logging
+import zlib
+import bson
 import motor.motor_asyncio
-from pymongo import ASCENDING, DESCENDING, IndexModel
-from bson import ObjectId
-from typing import Dict, List, Optional, Any
+from pymongo import ASCENDING, DESCENDING, IndexModel, UpdateOne
+from pymongo.errors import BulkWriteError
+from bson import ObjectId, Binary
+from typing import Dict, List, Optional, Any, Tuple
 
-from main.config import MONGO_URI, MONGO_DB_NAME
+from main.config import MONGO_URI, MONGO_DB_NAME, ARCHIVE_BLOCK_SIZE, ARCHIVE_TTL_DAYS, MESSAGE_TOMBSTONE_TTL_DAYS
+from main.config import SYNC_SAFETY_LAG_SECONDS
+from main.config import MONGO_GROUP_COMMIT_ENABLED, MONGO_GROUP_COMMIT_INTERVAL_MS, MONGO_GROUP_COMMIT_MAX_BATCH
+from main.metrics import call_counters, MongoCommandCounter
+from main.memory.extraction import to_utc_datetime
+from main.group_commit import GroupCommitWriter
+from main.usage import usage_day, usage_increments
 
 logger = logging.getLogger(__name__)
 
 MESSAGES_COLLECTION = "messages"
 CONVERSATIONS_COLLECTION = "conversations"
+ARCHIVED_CONVERSATIONS_COLLECTION = "archived_conversations"
+USAGE_STATS_COLLECTION = "usage_stats"
+MESSAGE_TOMBSTONES_COLLECTION = "message_tombstones"
+
+# 会话列表中最后一条消息预览的最大长度
+LAST_MESSAGE_PREVIEW_LENGTH = 120
+
+# 读接口的投影：查询结果即响应形状，不再在Python中逐条重建字典
+MESSAGE_PROJECTION = {"_id": 0, "role": 1, "content": 1, "message_id": 1, "timestamp": 1}
+CONVERSATION_LIST_PROJECTION = {
+    "_id": 0,
+    "conversation_id": 1,
+    "title": {"$ifNull": ["$title", "New Chat"]},
+    "created_at": 1,
+    "updated_at": 1,
+    "last_updated": "$updated_at",
+    "message_count": {"$ifNull": ["$message_count", 0]},
+    "last_message_preview": {"$ifNull": ["$last_message_preview", ""]},
+    "last_role": {"$ifNull": ["$last_role", None]},
+}
+TOMBSTONE_PROJECTION = {"_id": 0, "tombstone_id": 1, "kind": 1, "message_id": 1, "deleted_at": 1}
 
 class MongoManager:
     """简化的MongoDB管理器 - 只处理消息"""
     
-    def __init__(self):
-        self.client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URI)
-        self.db = self.client[MONGO_DB_NAME]
+    def __init__(self, db_name: Optional[str] = None):
+        self.client = motor.motor_asyncio.AsyncIOMotorClient(
+            MONGO_URI, event_listeners=[MongoCommandCounter(call_counters)]
+        )
+        self.db = self.client[db_name or MONGO_DB_NAME]
         self.messages_collection = self.db[MESSAGES_COLLECTION]
         self.conversations_collection = self.db[CONVERSATIONS_COLLECTION]
-        logger.info(f"[MongoManager] Initialized. Database: {MONGO_DB_NAME}")
+        self.archived_conversations_collection = self.db[ARCHIVED_CONVERSATIONS_COLLECTION]
+        self.usage_stats_collection = self.db[USAGE_STATS_COLLECTION]
+        self.tombstones_collection = self.db[MESSAGE_TOMBSTONES_COLLECTION]
+        # 可选的组提交：并发流的消息写入合并为批量操作
+        self.group_writer: Optional[GroupCommitWriter] = None
+        if MONGO_GROUP_COMMIT_ENABLED:
+            self.group_writer = GroupCommitWriter(
+                self.messages_collection, self.conversations_collection, LAST_MESSAGE_PREVIEW_LENGTH,
+                flush_interval_seconds=MONGO_GROUP_COMMIT_INTERVAL_MS / 1000,
+                max_batch=MONGO_GROUP_COMMIT_MAX_BATCH
+            )
+        logger.info("[MongoManager] Initialized. Database: %s", self.db.name)
 
     async def initialize_db(self):
         """初始化数据库索引"""
@@ -34,19 +77,51 @@ class MongoManager:
             IndexModel([("message_id", ASCENDING)], unique=True, name="message_id_unique_idx"),
             IndexModel([("user_id", ASCENDING), ("timestamp", DESCENDING)], name="message_user_timestamp_idx"),
             IndexModel([("conversation_id", ASCENDING), ("timestamp", DESCENDING)], name="message_conversation_timestamp_idx"),
+            # 会话内查询都同时按 user_id + conversation_id 过滤并按时间排序
+            IndexModel([("user_id", ASCENDING), ("conversation_id", ASCENDING), ("timestamp", DESCENDING)],
+                       name="message_user_conversation_timestamp_idx"),
+            # 增量同步按 (timestamp, message_id) 游标正序读取
+            IndexModel([("user_id", ASCENDING), ("conversation_id", ASCENDING), ("timestamp", ASCENDING),
+                        ("message_id", ASCENDING)], name="message_sync_cursor_idx"),
         ]
         
         conversation_indexes = [
             IndexModel([("conversation_id", ASCENDING)], unique=True, name="conversation_id_unique_idx"),
             IndexModel([("user_id", ASCENDING), ("updated_at", DESCENDING)], name="conversation_user_updated_idx"),
+            # 归档扫描按 updated_at 范围查找未归档的空闲会话
+            IndexModel([("updated_at", ASCENDING), ("archived", ASCENDING)], name="conversation_updated_archived_idx"),
+        ]
+        
+        archive_indexes = [
+            IndexModel([("conversation_id", ASCENDING)], unique=True, name="archive_conversation_id_unique_idx"),
         ]
         
+        tombstone_indexes = [
+            IndexModel([("user_id", ASCENDING), ("conversation_id", ASCENDING), ("deleted_at", ASCENDING),
+                        ("tombstone_id", ASCENDING)], name="tombstone_sync_cursor_idx"),
+            IndexModel([("deleted_at", ASCENDING)], expireAfterSeconds=MESSAGE_TOMBSTONE_TTL_DAYS * 86400,
+                       name="tombstone_ttl_idx"),
+        ]
+        
+        if ARCHIVE_TTL_DAYS > 0:
+            # 归档文档与会话文档在同一时间过期
+            ttl_seconds = ARCHIVE_TTL_DAYS * 86400
+            archive_indexes.append(
+                IndexModel([("archived_at", ASCENDING)], expireAfterSeconds=ttl_seconds, name="archive_ttl_idx")
+            )
+            conversation_indexes.append(
+                IndexModel([("archived_at", ASCENDING)], expireAfterSeconds=ttl_seconds,
+                           partialFilterExpression={"archived": True}, name="conversation_archived_ttl_idx")
+            )
+        
         try:
             await self.messages_collection.create_indexes(message_indexes)
             await self.conversations_collection.create_indexes(conversation_indexes)
-            logger.info("Indexes ensured for messages and conversations collections")
+            await self.archived_conversations_collection.create_indexes(archive_indexes)
+            await self.tombstones_collection.create_indexes(tombstone_indexes)
+            logger.info("Indexes ensured for messages, conversations, archive and tombstone collections")
         except Exception as e:
-            logger.error(f"Index creation failed: {e}", exc_info=True)
+            logger.error("Index creation failed: %s", e, exc_info=True)
 
     async def create_conversation(self, user_id: str, conversation_id: Optional[str] = None, title: Optional[str] = None) -> Dict:
         """创建新会话"""
@@ -61,31 +136,53 @@ class MongoManager:
             "title": title or "New Chat",
             "created_at": now_utc,
             "updated_at": now_utc,
+            "message_count": 0,
+            "last_message_preview": "",
+            "last_role": None,
+            "version": 0,
         }
         
         await self.conversations_collection.insert_one(conversation_doc)
-        logger.info(f"Created conversation {conversation_id} for user {user_id}")
+        logger.info("Created conversation %s for user %s", conversation_id, user_id)
         return conversation_doc
 
     async def get_conversations(self, user_id: str, limit: int = 50) -> List[Dict]:
-        """获取用户的所有会话列表"""
-        cursor = self.conversations_collection.find(
-            {"user_id": user_id}
-        ).sort("updated_at", DESCENDING).limit(limit)
-        
-        conversations = await cursor.to_list(length=limit)
-        
-        result = []
-        for conv in conversations:
-            result.append({
-                "conversation_id": conv.get("conversation_id"),
-                "title": conv.get("title", "New Chat"),
-                "created_at": conv.get("created_at").isoformat() if isinstance(conv.get("created_at"), datetime.datetime) else conv.get("created_at"),
-                "updated_at": conv.get("updated_at").isoformat() if isinstance(conv.get("updated_at"), datetime.datetime) else conv.get("updated_at"),
-                "last_updated": conv.get("updated_at").isoformat() if isinstance(conv.get("updated_at"), datetime.datetime) else conv.get("updated_at"),
-            })
-        
-        return result
+        """获取用户的所有会话列表（由投影直接生成响应形状，可直接编码为JSON）"""
+        cursor = self.conversations_collection.aggregate([
+            {"$match": {"user_id": user_id}},
+            {"$sort": {"updated_at": DESCENDING}},
+            {"$limit": limit},
+            {"$project": CONVERSATION_LIST_PROJECTION},
+        ])
+        return await cursor.to_list(length=limit)
+
+    async def get_conversations_version(self, user_id: str) -> Tuple[int, Optional[datetime.datetime], int]:
+        """
+        会话列表的版本：会话数量、最新的 updated_at 和所有会话 version 之和（用于ETag）
+
+        新增/删除会话改变数量，新消息和改标题推进 updated_at，删除消息只递增 version。
+        """
+        result = await self.conversations_collection.aggregate([
+            {"$match": {"user_id": user_id}},
+            {"$group": {
+                "_id": None,
+                "count": {"$sum": 1},
+                "latest": {"$max": "$updated_at"},
+                "versions": {"$sum": {"$ifNull": ["$version", 0]}},
+            }},
+        ]).to_list(length=1)
+        if not result:
+            return 0, None, 0
+        return result[0]["count"], result[0]["latest"], result[0]["versions"]
+
+    async def get_conversation_version(self, user_id: str, conversation_id: str) -> Optional[int]:
+        """会话消息的版本号（每次添加/删除消息递增），会话不存在时返回None"""
+        doc = await self.conversations_collection.find_one(
+            {"user_id": user_id, "conversation_id": conversation_id}, {"_id": 0, "version": 1}
+        )
+        if doc is None:
+            return None
+        return doc.get("version", 0)
 
     async def update_conversation_title(self, user_id: str, conversation_id: str, title: str):
         """更新会话标题"""
@@ -102,13 +199,18 @@ class MongoManager:
             "conversation_id": conversation_id
         })
         
-        # 删除会话的所有消息
+        # 删除会话的所有消息（包括归档）
         msg_result = await self.messages_collection.delete_many({
             "user_id": user_id,
             "conversation_id": conversation_id
         })
+        await self.archived_conversations_collection.delete_one({
+            "user_id": user_id,
+            "conversation_id": conversation_id
+        })
+        await self._add_tombstone(user_id, conversation_id, kind="clear")
         
-        logger.info(f"Deleted conversation {conversation_id} and {msg_result.deleted_count} messages")
+        logger.info("Deleted conversation %s and %d messages", conversation_id, msg_result.deleted_count)
         return conv_result.deleted_count > 0
 
     async def add_message(
@@ -118,7 +220,8 @@ class MongoManager:
         content: str, 
         conversation_id: str,
         message_id: Optional[str] = None,
-        turn_steps: Optional[List[Dict]] = None
+        turn_steps: Optional[List[Dict]] = None,
+        usage: Optional[Dict[str, Any]] = None
     ) -> Dict:
         """
         添加消息到数据库
@@ -129,6 +232,7 @@ class MongoManager:
             content: 消息内容
             message_id: 可选的消息ID
             turn_steps: 可选的turn步骤（用于assistant消息）
+            usage: 可选的本轮用量（用于assistant消息）
             
         Returns:
             创建的消息文档
@@ -147,20 +251,34 @@ class MongoManager:
             "timestamp": now_utc,
             "turn_steps": turn_steps or []
         }
+        if usage:
+            message_doc["usage"] = usage
+        
+        if self.group_writer:
+            await self.group_writer.submit(message_doc)
+            logger.info("Added %s message for user %s in conversation %s", role, user_id, conversation_id)
+            return message_doc
         
         await self.messages_collection.insert_one(message_doc)
         
-        # 更新会话的更新时间
+        # 更新会话的更新时间和列表摘要（单文档原子更新）
         await self.conversations_collection.update_one(
             {"conversation_id": conversation_id, "user_id": user_id},
-            {"$set": {"updated_at": now_utc}},
+            {
+                "$set": {
+                    "updated_at": now_utc,
+                    "last_message_preview": content[:LAST_MESSAGE_PREVIEW_LENGTH],
+                    "last_role": role,
+                },
+                "$inc": {"message_count": 1, "version": 1},
+            },
             upsert=True
         )
         
-        logger.info(f"Added {role} message for user {user_id} in conversation {conversation_id}")
+        logger.info("Added %s message for user %s in conversation %s", role, user_id, conversation_id)
         return message_doc
 
-    async def get_recent_messages(self, user_id: str, conversation_id: str, limit: int = 10) -> List[Dict]:
+    async def get_recent_messages(self, user_id: str, conversation_id: str, limit: int = 10, timeout: Optional[float] = None) -> List[Dict]:
         """
         获取会话最近的消息（用于短期记忆）
         
@@ -168,29 +286,52 @@ class MongoManager:
             user_id: 用户ID
             conversation_id: 会话ID
             limit: 返回的消息数量（默认10，即5轮对话）
+            timeout: 可选的查询超时（秒），超时抛出 ExecutionTimeout
             
         Returns:
-            消息列表，按时间倒序
+            消息列表，按时间正序，每条为 {role, content, message_id, timestamp(datetime)}
         """
         cursor = self.messages_collection.find(
-            {"user_id": user_id, "conversation_id": conversation_id}
+            {"user_id": user_id, "conversation_id": conversation_id}, MESSAGE_PROJECTION
         ).sort("timestamp", DESCENDING).limit(limit)
+        if timeout is not None:
+            cursor = cursor.max_time_ms(max(1, int(timeout * 1000)))
         
         messages = await cursor.to_list(length=limit)
-        # 反转顺序，使其按时间正序
-        messages.reverse()
         
-        # 转换为标准格式
-        result = []
-        for msg in messages:
-            result.append({
-                "role": msg.get("role"),
-                "content": msg.get("content", ""),
-                "message_id": msg.get("message_id"),
-                "timestamp": msg.get("timestamp").isoformat() if isinstance(msg.get("timestamp"), datetime.datetime) else msg.get("timestamp")
-            })
+        # 热数据不足一页且会话标记为已归档时合并恢复（归档期间到达的新消息留在热数据中）；
+        # 从未归档的短会话只多一次会话文档的索引查询，不读取归档集合
+        archived = len(messages) < limit and await self._is_archived(user_id, conversation_id)
+        if archived and await self.restore_conversation(user_id, conversation_id):
+            messages = await self.messages_collection.find(
+                {"user_id": user_id, "conversation_id": conversation_id}, MESSAGE_PROJECTION
+            ).sort("timestamp", DESCENDING).limit(limit).to_list(length=limit)
         
-        return result
+        # 反转顺序，使其按时间正序
+        messages.reverse()
+        return messages
+
+    async def _is_archived(self, user_id: str, conversation_id: str) -> bool:
+        """会话文档是否带有归档标记"""
+        conv = await self.conversations_collection.find_one(
+            {"user_id": user_id, "conversation_id": conversation_id, "archived": True}, {"_id": 1}
+        )
+        return conv is not None
+
+    async def get_memory_watermark(self, user_id: str, conversation_id: str) -> Optional[datetime.datetime]:
+        """获取会话长期记忆提取的高水位线（已处理的最后一条消息时间）"""
+        conv = await self.conversations_collection.find_one(
+            {"user_id": user_id, "conversation_id": conversation_id},
+            {"_id": 0, "memory_extracted_at": 1}
+        )
+        return (conv or {}).get("memory_extracted_at")
+
+    async def set_memory_watermark(self, user_id: str, conversation_id: str, watermark: datetime.datetime):
+        """推进高水位线（$max 保证并发轮次下只前进不后退）"""
+        await self.conversations_collection.update_one(
+            {"user_id": user_id, "conversation_id": conversation_id},
+            {"$max": {"memory_extracted_at": watermark}}
+        )
 
     async def get_message_history(
         self, 
@@ -216,22 +357,54 @@ class MongoManager:
                 before_dt = datetime.datetime.fromisoformat(before_timestamp_iso.replace('Z', '+00:00'))
                 query["timestamp"] = {"$lt": before_dt}
             except Exception as e:
-                logger.warning(f"Invalid timestamp format: {before_timestamp_iso}, {e}")
+                logger.warning("Invalid timestamp format: %s, %s", before_timestamp_iso, e)
         
-        cursor = self.messages_collection.find(query).sort("timestamp", DESCENDING).limit(limit)
+        cursor = self.messages_collection.find(query, MESSAGE_PROJECTION).sort("timestamp", DESCENDING).limit(limit)
         messages = await cursor.to_list(length=limit)
         messages.reverse()
+        return messages
+
+    async def record_usage(self, user_id: str, usage: Dict[str, Any], timestamp: Optional[datetime.datetime] = None):
+        """
+        累加一轮用量到按天和累计的统计文档（_id 为 "{user_id}:{YYYY-MM-DD}" 和 "{user_id}:total"）
         
-        result = []
-        for msg in messages:
-            result.append({
-                "role": msg.get("role"),
-                "content": msg.get("content", ""),
-                "message_id": msg.get("message_id"),
-                "timestamp": msg.get("timestamp").isoformat() if isinstance(msg.get("timestamp"), datetime.datetime) else msg.get("timestamp")
-            })
-        
-        return result
+        只做 $inc 增量更新，统计接口按 _id 直接读取，不需要扫描消息集合。
+        """
+        day = usage_day(timestamp)
+        increments = usage_increments(usage)
+        now_utc = datetime.datetime.now(datetime.timezone.utc)
+        await self.usage_stats_collection.bulk_write([
+            UpdateOne(
+                {"_id": f"{user_id}:{day}"},
+                {"$inc": increments, "$set": {"user_id": user_id, "day": day, "updated_at": now_utc}},
+                upsert=True
+            ),
+            UpdateOne(
+                {"_id": f"{user_id}:total"},
+                {"$inc": increments, "$set": {"user_id": user_id, "updated_at": now_utc}},
+                upsert=True
+            ),
+        ], ordered=False)
+
+    async def get_usage_stats(self, user_id: str, days: int = 7) -> Dict[str, Any]:
+        """
+        读取累计用量和最近 days 天的按天用量（按 _id 点查）
+
+        含有估算轮次的统计文档带 "estimated": true（目前所有token数都是本地估算）。
+        """
+        today = datetime.datetime.now(datetime.timezone.utc)
+        day_keys = [usage_day(today - datetime.timedelta(days=i)) for i in range(days)]
+        ids = [f"{user_id}:total"] + [f"{user_id}:{day}" for day in day_keys]
+        docs = {
+            doc["_id"]: doc
+            async for doc in self.usage_stats_collection.find({"_id": {"$in": ids}}, {"updated_at": 0})
+        }
+        for doc in docs.values():
+            doc["estimated"] = doc.get("estimated_turns", 0) > 0
+        return {
+            "total": docs.get(f"{user_id}:total"),
+            "days": [docs[f"{user_id}:{day}"] for day in day_keys if f"{user_id}:{day}" in docs],
+        }
 
     async def delete_message(self, user_id: str, conversation_id: str, message_id: str) -> bool:
         """删除指定消息"""
@@ -240,15 +413,350 @@ class MongoManager:
             "conversation_id": conversation_id,
             "message_id": message_id
         })
+        if result.deleted_count > 0:
+            await self._add_tombstone(user_id, conversation_id, kind="message", message_id=message_id)
+            await self._refresh_conversation_summary(user_id, conversation_id, count_delta=-result.deleted_count)
         return result.deleted_count > 0
 
+    async def _refresh_conversation_summary(self, user_id: str, conversation_id: str, count_delta: int):
+        """删除消息后更新会话的消息计数和最后一条消息预览"""
+        last_message = await self.messages_collection.find_one(
+            {"user_id": user_id, "conversation_id": conversation_id},
+            {"content": 1, "role": 1},
+            sort=[("timestamp", DESCENDING)]
+        )
+        await self.conversations_collection.update_one(
+            {"user_id": user_id, "conversation_id": conversation_id},
+            {
+                "$set": {
+                    "last_message_preview": (last_message or {}).get("content", "")[:LAST_MESSAGE_PREVIEW_LENGTH],
+                    "last_role": (last_message or {}).get("role"),
+                },
+                # updated_at 只跟随新消息推进，删除不改变会话在列表中的位置；列表ETag靠 version 感知变化
+                "$inc": {"message_count": count_delta, "version": 1},
+            }
+        )
+
     async def delete_all_messages(self, user_id: str, conversation_id: str) -> int:
         """删除会话的所有消息"""
         result = await self.messages_collection.delete_many({
             "user_id": user_id,
             "conversation_id": conversation_id
         })
-        return result.deleted_count
+        deleted_count = result.deleted_count
+        
+        archive_doc = await self.archived_conversations_collection.find_one_and_delete(
+            {"user_id": user_id, "conversation_id": conversation_id},
+            {"message_count": 1}
+        )
+        if archive_doc:
+            deleted_count += archive_doc.get("message_count", 0)
+        
+        # 一条 "clear" 墓碑代替逐条记录
+        await self._add_tombstone(user_id, conversation_id, kind="clear")
+        
+        await self.conversations_collection.update_one(
+            {"user_id": user_id, "conversation_id": conversation_id},
+            {
+                "$set": {
+                    "message_count": 0,
+                    "last_message_preview": "",
+                    "last_role": None,
+                },
+                "$inc": {"version": 1},
+                "$unset": {"archived": "", "archived_at": ""},
+            }
+        )
+        return deleted_count
+
+    async def backfill_conversation_summaries(self, only_missing: bool = True, batch_size: int = 500) -> int:
+        """
+        由消息集合重新计算会话的 message_count、last_message_preview、last_role 和 version（一次性迁移）
+
+        摘要字段引入之前创建的会话没有这些字段，列表会显示为空。归档会话的消息数加上归档文档中的数量；
+        version 只增不减，不会让客户端已缓存的ETag与旧版本碰撞。updated_at 保持不变。
+
+        Args:
+            only_missing: 只处理缺少 version 字段的会话
+            batch_size: 每批处理的会话数量
+
+        Returns:
+            更新的会话数量
+        """
+        query = {"version": {"$exists": False}} if only_missing else {}
+        cursor = self.conversations_collection.find(query, {"_id": 0, "conversation_id": 1, "user_id": 1})
+        updated = 0
+        batch: List[Dict] = []
+        async for conv in cursor:
+            batch.append(conv)
+            if len(batch) >= batch_size:
+                updated += await self._backfill_summary_batch(batch)
+                batch = []
+        if batch:
+            updated += await self._backfill_summary_batch(batch)
+        logger.info("Backfilled summaries for %d conversations", updated)
+        return updated
+
+    async def _backfill_summary_batch(self, conversations: List[Dict]) -> int:
+        conversation_ids = [conv["conversation_id"] for conv in conversations]
+        stats = {
+            doc["_id"]: doc
+            for doc in await self.messages_collection.aggregate([
+                {"$match": {"conversation_id": {"$in": conversation_ids}}},
+                {"$sort": {"timestamp": ASCENDING}},
+                {"$group": {
+                    "_id": "$conversation_id",
+                    "count": {"$sum": 1},
+                    "last_content": {"$last": "$content"},
+                    "last_role": {"$last": "$role"},
+                }},
+            ]).to_list(length=None)
+        }
+        archived_counts = {
+            doc["conversation_id"]: doc.get("message_count", 0)
+            async for doc in self.archived_conversations_collection.find(
+                {"conversation_id": {"$in": conversation_ids}}, {"_id": 0, "conversation_id": 1, "message_count": 1}
+            )
+        }
+
+        operations = []
+        for conv in conversations:
+            conversation_id = conv["conversation_id"]
+            hot = stats.get(conversation_id)
+            count = (hot or {}).get("count", 0) + archived_counts.get(conversation_id, 0)
+            fields: Dict[str, Any] = {"message_count": count}
+            if hot:
+                fields["last_message_preview"] = (hot.get("last_content") or "")[:LAST_MESSAGE_PREVIEW_LENGTH]
+                fields["last_role"] = hot.get("last_role")
+            elif conversation_id not in archived_counts:
+                fields["last_message_preview"] = ""
+                fields["last_role"] = None
+            operations.append(UpdateOne(
+                {"conversation_id": conversation_id, "user_id": conv["user_id"]},
+                {"$set": fields, "$max": {"version": count}}
+            ))
+        if not operations:
+            return 0
+        result = await self.conversations_collection.bulk_write(operations, ordered=False)
+        return result.matched_count
+
+    async def _add_tombstone(self, user_id: str, conversation_id: str, kind: str, message_id: Optional[str] = None):
+        """
+        记录删除，供增量同步返回给客户端
+
+        kind 为 "message"（删除单条消息）或 "clear"（清空会话，客户端丢弃此前的所有消息）。
+        """
+        await self.tombstones_collection.insert_one({
+            "tombstone_id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "conversation_id": conversation_id,
+            "kind": kind,
+            "message_id": message_id,
+            "deleted_at": datetime.datetime.now(datetime.timezone.utc),
+        })
+
+    async def get_changes_since(
+        self,
+        user_id: str,
+        conversation_id: str,
+        cursor: Optional[Tuple[datetime.datetime, str]] = None,
+        limit: int = 200
+    ) -> Dict[str, Any]:
+        """
+        增量同步：返回游标之后新增的消息和删除记录
+
+        游标为 (时间, ID)，消息按 (timestamp, message_id)、墓碑按 (deleted_at, tombstone_id) 排在同一序列中。
+        没有游标或游标早于墓碑保留期时返回最近 limit 条消息，并标记 reset（客户端替换本地数据）。
+
+        时间在写入之前生成，并发写入的提交顺序不一定与时间顺序一致：较早时间的消息可能在较晚的之后才可见。
+        返回的游标因此不越过 now - SYNC_SAFETY_LAG_SECONDS；窗口内的变更照常返回，并在下次同步时重新返回，
+        客户端按 message_id 幂等地应用。
+        
+        Returns:
+            {"reset", "cleared", "messages", "deleted", "cursor": (时间, ID) 或 None, "has_more"}
+        """
+        by_conversation = {"user_id": user_id, "conversation_id": conversation_id}
+        now_utc = datetime.datetime.now(datetime.timezone.utc)
+        horizon = now_utc - datetime.timedelta(days=MESSAGE_TOMBSTONE_TTL_DAYS)
+        # 早于该位置的写入都已可见；ID为空串的位置排在同一时刻的所有条目之前
+        stable = (now_utc - datetime.timedelta(seconds=SYNC_SAFETY_LAG_SECONDS), "")
+        
+        if cursor is None or cursor[0] < horizon:
+            messages = await self.get_recent_messages(user_id, conversation_id, limit=limit)
+            return {
+                "reset": True,
+                "cleared": False,
+                "messages": messages,
+                "deleted": [],
+                "cursor": stable,
+                "has_more": False,
+            }
+        
+        cursor = (to_utc_datetime(cursor[0]), cursor[1])
+        cursor_time, cursor_id = cursor
+        messages = await self.messages_collection.find(
+            {
+                **by_conversation,
+                "timestamp": {"$gte": cursor_time},
+                "$nor": [{"timestamp": cursor_time, "message_id": {"$lte": cursor_id}}],
+            },
+            MESSAGE_PROJECTION
+        ).sort([("timestamp", ASCENDING), ("message_id", ASCENDING)]).limit(limit + 1).to_list(length=limit + 1)
+        tombstones = await self.tombstones_collection.find(
+            {
+                **by_conversation,
+                "deleted_at": {"$gte": cursor_time},
+                "$nor": [{"deleted_at": cursor_time, "tombstone_id": {"$lte": cursor_id}}],
+            },
+            TOMBSTONE_PROJECTION
+        ).sort([("deleted_at", ASCENDING), ("tombstone_id", ASCENDING)]).limit(limit + 1).to_list(length=limit + 1)
+        
+        # 合并两个有序序列，最多取 limit 个变更
+        events = sorted(
+            [(to_utc_datetime(msg["timestamp"]), msg["message_id"], "message", msg) for msg in messages] +
+            [(to_utc_datetime(t["deleted_at"]), t["tombstone_id"], "tombstone", t) for t in tombstones],
+            key=lambda event: (event[0], event[1])
+        )
+        truncated = len(events) > limit
+        events = events[:limit]
+        
+        # 完整返回时游标推进到安全位置；截断时不越过本页最后一条
+        next_cursor = stable
+        if truncated:
+            next_cursor = min((events[-1][0], events[-1][1]), stable)
+        result = {
+            "reset": False,
+            "cleared": False,
+            "messages": [],
+            "deleted": [],
+            "cursor": max(next_cursor, cursor),
+            # 剩余的变更都在安全窗口内时不要求立即再取，下次同步会重新返回
+            "has_more": truncated and next_cursor > cursor,
+        }
+        for _, _, kind, doc in events:
+            if kind == "message":
+                result["messages"].append(doc)
+            elif doc["kind"] == "clear":
+                # 清空之前的变更都已失效
+                result["cleared"] = True
+                result["messages"] = []
+                result["deleted"] = []
+            else:
+                result["deleted"].append(doc["message_id"])
+        return result
+
+    async def archive_idle_conversations(self, idle_days: int, batch_limit: int = 100) -> int:
+        """
+        将空闲超过阈值的会话移入归档集合（冷数据）
+        
+        每个会话归档为一个文档，消息按块BSON编码后zlib压缩。
+        
+        Args:
+            idle_days: 空闲天数阈值
+            batch_limit: 单次最多归档的会话数量
+            
+        Returns:
+            归档的会话数量
+        """
+        cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=idle_days)
+        cursor = self.conversations_collection.find(
+            {"updated_at": {"$lt": cutoff}, "archived": {"$ne": True}},
+            {"conversation_id": 1, "user_id": 1, "updated_at": 1}
+        ).limit(batch_limit)
+        
+        archived = 0
+        async for conv in cursor:
+            try:
+                if await self._archive_conversation(conv["user_id"], conv["conversation_id"], conv["updated_at"]):
+                    archived += 1
+            except Exception as e:
+                logger.error("Failed to archive conversation %s: %s", conv.get("conversation_id"), e,
+                             exc_info=True, extra={"conversation_id": conv.get("conversation_id")})
+        
+        if archived:
+            logger.info("Archived %d idle conversations (idle > %d days)", archived, idle_days,
+                        extra={"archived": archived, "idle_days": idle_days})
+        return archived
+
+    async def _archive_conversation(self, user_id: str, conversation_id: str, idle_since: datetime.datetime) -> bool:
+        """
+        归档单个会话的所有消息
+
+        idle_since 是扫描时读到的 updated_at。归档期间有新消息到达时会话的 updated_at 会推进，
+        此时放弃归档并把已移走的消息恢复为热数据，避免会话带着热消息被标记为已归档。
+        """
+        messages = await self.messages_collection.find(
+            {"user_id": user_id, "conversation_id": conversation_id}
+        ).sort("timestamp", ASCENDING).to_list(length=None)
+        
+        now_utc = datetime.datetime.now(datetime.timezone.utc)
+        blocks = [
+            Binary(zlib.compress(bson.encode({"messages": messages[i:i + ARCHIVE_BLOCK_SIZE]})))
+            for i in range(0, len(messages), ARCHIVE_BLOCK_SIZE)
+        ]
+        
+        await self.archived_conversations_collection.replace_one(
+            {"conversation_id": conversation_id},
+            {
+                "conversation_id": conversation_id,
+                "user_id": user_id,
+                "archived_at": now_utc,
+                "message_count": len(messages),
+                "blocks": blocks,
+            },
+            upsert=True
+        )
+        
+        # 只删除已写入归档的消息，归档期间新到达的消息保持为热数据
+        if messages:
+            await self.messages_collection.delete_many({
+                "message_id": {"$in": [msg["message_id"] for msg in messages]}
+            })
+        
+        result = await self.conversations_collection.update_one(
+            {"user_id": user_id, "conversation_id": conversation_id, "updated_at": idle_since},
+            {"$set": {"archived": True, "archived_at": now_utc}}
+        )
+        if result.matched_count == 0:
+            logger.info("Conversation %s became active during archiving, rolling back", conversation_id)
+            await self.restore_conversation(user_id, conversation_id)
+            return False
+        return True
+
+    async def restore_conversation(self, user_id: str, conversation_id: str) -> bool:
+        """
+        将归档会话的消息恢复到热数据集合
+        
+        Returns:
+            是否恢复了归档数据
+        """
+        archive_doc = await self.archived_conversations_collection.find_one(
+            {"conversation_id": conversation_id, "user_id": user_id}
+        )
+        if not archive_doc:
+            return False
+        
+        messages = []
+        for block in archive_doc.get("blocks", []):
+            messages.extend(bson.decode(zlib.decompress(block))["messages"])
+        
+        if messages:
+            try:
+                await self.messages_collection.insert_many(messages, ordered=False)
+            except BulkWriteError as e:
+                # 之前中断的恢复可能已写入部分消息，忽略重复键
+                non_duplicate = [err for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+                if non_duplicate:
+                    raise
+        
+        await self.conversations_collection.update_one(
+            {"user_id": user_id, "conversation_id": conversation_id},
+            {"$unset": {"archived": "", "archived_at": ""}}
+        )
+        await self.archived_conversations_collection.delete_one({"_id": archive_doc["_id"]})
+        logger.info("Restored archived conversation %s (%d messages)", conversation_id, len(messages),
+                    extra={"conversation_id": conversation_id, "messages": len(messages)})
+        return True
 
 # 全局MongoDB管理器实例
 mongo_manager = MongoManager()
@@ -0,0 +1,41 @@
+"""
+请求截止时间 - 在聊天请求的各个阶段之间传递剩余时间预算
+
+chat_endpoint 创建 Deadline，并依次传给 get_recent_messages、search_memories、
+run_agent（首token与token间超时）和 add_message，每个阶段只使用剩余预算。
+"""
+import time
+from typing import Optional
+
+
+class Deadline:
+    """Absolute deadline for one request, measured on the monotonic clock"""
+
+    def __init__(self, budget_seconds: float):
+        self.budget_seconds = budget_seconds
+        self.expires_at = time.monotonic() + budget_seconds
+
+    def remaining(self) -> float:
+        """剩余秒数（不小于0）"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0.0
+
+    def timeout(self, cap: Optional[float] = None, floor: float = 0.0) -> float:
+        """
+        某个阶段可用的超时时间
+
+        Args:
+            cap: 该阶段自身的超时上限
+            floor: 最小超时（用于持久化等即使超出预算也应尽量完成的工作）
+        """
+        remaining = self.remaining()
+        if cap is not None:
+            remaining = min(remaining, cap)
+        return max(remaining, floor)
+
+    def has_budget_for(self, seconds: float) -> bool:
+        """剩余预算是否足够执行一个预计耗时 seconds 的可选阶段"""
+        return self.remaining() >= seconds
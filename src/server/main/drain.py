@@ -0,0 +1,96 @@
+"""
+优雅排空 - 滚动重启时不丢失进行中的生成和记忆任务
+
+进入排空模式后拒绝新的聊天（503），等待后台生成任务（包括保存助手消息和记忆提取）
+以及记忆回收队列在宽限期内完成，超时后取消剩余任务（取消时仍会保存已生成的部分内容）。
+排空可以由 POST /drain 提前触发（如容器 preStop 钩子），关闭时也会自动执行。
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, Any, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceDrainingError(Exception):
+    """Raised when a new chat is rejected because the server is draining."""
+    pass
+
+
+class DrainState:
+    """Drain flag and progress shared by the chat entry points and the health endpoints"""
+
+    def __init__(self):
+        self.draining = False
+        self.completed = False
+        self.started_at: Optional[float] = None
+        self.grace_seconds: Optional[float] = None
+        self.in_flight_generations = 0
+        self.pending_memory_jobs = 0
+        self.cancelled_generations = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def check_accepting(self):
+        """新聊天入口调用；排空期间抛出 ServiceDrainingError"""
+        if self.draining:
+            raise ServiceDrainingError("Server is draining for a restart; please retry shortly.")
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "draining": self.draining,
+            "completed": self.completed,
+            "elapsed_seconds": round(time.monotonic() - self.started_at, 2) if self.started_at else 0.0,
+            "grace_seconds": self.grace_seconds,
+            "in_flight_generations": self.in_flight_generations,
+            "pending_memory_jobs": self.pending_memory_jobs,
+            "cancelled_generations": self.cancelled_generations,
+        }
+
+    def start(self, tasks: Set[asyncio.Task], memory_gc, grace_seconds: float) -> asyncio.Task:
+        """开始排空（幂等），返回排空任务"""
+        if self._task is None:
+            # 立即停止接受新聊天，不等待排空任务开始运行
+            self.draining = True
+            self.started_at = time.monotonic()
+            self.grace_seconds = grace_seconds
+            self._task = asyncio.create_task(self._drain(tasks, memory_gc, grace_seconds))
+        return self._task
+
+    async def _drain(self, tasks: Set[asyncio.Task], memory_gc, grace_seconds: float):
+        deadline = self.started_at + grace_seconds
+        logger.info("Drain started: %d generations in flight, %d memory jobs queued (grace %.0fs)",
+                    len(tasks), memory_gc.pending_jobs, grace_seconds)
+
+        while True:
+            self.in_flight_generations = len(tasks)
+            self.pending_memory_jobs = memory_gc.pending_jobs
+            remaining = deadline - time.monotonic()
+            if (not tasks and not memory_gc.pending_jobs) or remaining <= 0:
+                break
+            # 生成任务结束（或每秒一次）时汇报进度
+            if tasks:
+                await asyncio.wait(set(tasks), timeout=min(1.0, remaining), return_when=asyncio.FIRST_COMPLETED)
+            else:
+                await asyncio.sleep(min(0.2, remaining))
+            logger.info("Draining: %d generations in flight, %d memory jobs pending, %.1fs left",
+                        len(tasks), memory_gc.pending_jobs, max(deadline - time.monotonic(), 0))
+
+        if tasks:
+            # 宽限期用尽：取消剩余生成，finally 中仍会保存已生成的内容
+            leftover = set(tasks)
+            self.cancelled_generations = len(leftover)
+            logger.warning("Drain grace period expired, cancelling %d generations", len(leftover))
+            for task in leftover:
+                task.cancel()
+            await asyncio.wait(leftover, timeout=5)
+
+        self.in_flight_generations = len(tasks)
+        self.pending_memory_jobs = memory_gc.pending_jobs
+        self.completed = True
+        logger.info("Drain complete after %.1fs (%d generations cancelled, %d memory jobs left)",
+                    time.monotonic() - self.started_at, self.cancelled_generations, self.pending_memory_jobs)
+
+
+# 全局排空状态
+drain_state = DrainState()
@@ -0,0 +1,191 @@
+"""
+消息持久化的组提交（可选）
+
+高并发时每个流结束都单独执行一次 insert_one 和一次 update_one。组提交把一个很短的刷新间隔内
+所有并发流的消息合并为一次 insert_many，同一会话的摘要更新（updated_at、预览、message_count、
+version）合并为一条，所有会话的更新再合并为一次 bulk_write。每个调用方仍然等待自己消息的确认：
+写入成功时返回消息文档，失败（如重复的 message_id、未满足写关注）时抛出对应的异常。
+消息已写入而摘要更新失败时不影响调用方的结果，失败的会话由消息集合重新计算摘要；
+写入结果未知（未满足写关注、连接中断）时调用方收到异常，涉及的会话同样重新计算摘要。
+"""
+import asyncio
+import logging
+from typing import Dict, List, Any, Optional, Set, Tuple
+
+from pymongo import DESCENDING, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, WriteConcernError
+
+from main.metrics import call_counters
+
+logger = logging.getLogger(__name__)
+
+
+class GroupCommitWriter:
+    """Batches message inserts and conversation summary updates from concurrent streams"""
+
+    def __init__(self, messages_collection, conversations_collection, preview_length: int,
+                 flush_interval_seconds: float = 0.005, max_batch: int = 100):
+        self.messages_collection = messages_collection
+        self.conversations_collection = conversations_collection
+        self.preview_length = preview_length
+        self.flush_interval_seconds = flush_interval_seconds
+        self.max_batch = max_batch
+        self._pending: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    async def submit(self, message_doc: Dict[str, Any]) -> Dict[str, Any]:
+        """加入下一次组提交，等待写入确认后返回消息文档"""
+        if self._closed:
+            raise RuntimeError("Group commit writer is closed")
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((message_doc, future))
+        # 第一条消息开始计时刷新间隔，凑满一批时立即刷新
+        if len(self._pending) == 1 or len(self._pending) >= self.max_batch:
+            self._wakeup.set()
+        return await future
+
+    async def close(self):
+        """停止接收新消息，写完队列中剩余的消息"""
+        self._closed = True
+        if self._task is not None:
+            self._wakeup.set()
+            await self._task
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if not self._closed and len(self._pending) < self.max_batch:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+            while self._pending:
+                batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+                await self._flush(batch)
+            if self._closed:
+                return
+
+    async def _flush(self, batch: List[Tuple[Dict[str, Any], asyncio.Future]]):
+        docs = [doc for doc, _ in batch]
+        errors: Dict[int, Exception] = {}
+        # 不确定是否已持久化的消息：不能 $inc，由消息集合重新计算其会话的摘要（幂等）
+        unknown: Set[int] = set()
+        try:
+            await self.messages_collection.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            # ordered=False：其余文档已写入，只有出错的文档失败
+            for err in e.details.get("writeErrors", []):
+                error_class = DuplicateKeyError if err.get("code") == 11000 else BulkWriteError
+                errors[err["index"]] = error_class(err.get("errmsg", "write error"))
+            if e.details.get("writeConcernErrors"):
+                # 写入了主节点但未满足写关注，与 insert_one 一样让调用方看到 WriteConcernError
+                concern_error = WriteConcernError(e.details["writeConcernErrors"][0].get("errmsg", "write concern error"))
+                for i in range(len(batch)):
+                    if i not in errors:
+                        errors[i] = concern_error
+                        unknown.add(i)
+        except Exception as e:
+            errors = {i: e for i in range(len(batch))}
+            unknown = set(range(len(batch)))
+        call_counters.increment("group_commit_batches")
+        call_counters.increment("group_commit_messages", len(batch))
+
+        # 每个会话合并为一条更新：计数累加，摘要取最后一条消息
+        summaries: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for i, doc in enumerate(docs):
+            if i in errors:
+                continue
+            key = (doc["user_id"], doc["conversation_id"])
+            summary = summaries.setdefault(key, {"count": 0, "last": doc})
+            summary["count"] += 1
+            if doc["timestamp"] >= summary["last"]["timestamp"]:
+                summary["last"] = doc
+        if summaries:
+            await self._update_summaries(summaries)
+        for key in dict.fromkeys((docs[i]["user_id"], docs[i]["conversation_id"]) for i in sorted(unknown)):
+            await self._repair_summary(*key)
+
+        # 调用方的结果只取决于消息本身是否写入；摘要更新失败已单独修复
+        for i, (doc, future) in enumerate(batch):
+            if future.done():
+                # 调用方已超时取消
+                continue
+            if i in errors:
+                future.set_exception(errors[i])
+            else:
+                future.set_result(doc)
+        if len(batch) > 1:
+            logger.debug("Group commit wrote %d messages across %d conversations", len(batch) - len(errors), len(summaries))
+
+    async def _update_summaries(self, summaries: Dict[Tuple[str, str], Dict[str, Any]]):
+        keys = list(summaries)
+        operations = [
+            UpdateOne(
+                {"conversation_id": conversation_id, "user_id": user_id},
+                {
+                    "$max": {"updated_at": summary["last"]["timestamp"]},
+                    "$set": {
+                        "last_message_preview": summary["last"]["content"][:self.preview_length],
+                        "last_role": summary["last"]["role"],
+                    },
+                    "$inc": {"message_count": summary["count"], "version": summary["count"]},
+                },
+                upsert=True
+            )
+            for (user_id, conversation_id), summary in summaries.items()
+        ]
+        failed: List[int] = []
+        try:
+            await self.conversations_collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            failed = [err["index"] for err in e.details.get("writeErrors", [])]
+            if e.details.get("writeConcernErrors"):
+                # 是否持久未知：全部修复（修复是幂等的）
+                failed = list(range(len(operations)))
+            logger.error("Group commit conversation update failed for %d of %d conversations: %s",
+                         len(failed), len(operations), e)
+        except Exception as e:
+            failed = list(range(len(operations)))
+            logger.error("Group commit conversation update failed for %d conversations: %s", len(operations), e)
+        for i in failed:
+            await self._repair_summary(*keys[i])
+
+    async def _repair_summary(self, user_id: str, conversation_id: str):
+        """
+        由消息集合重新计算会话摘要
+
+        批量更新失败时 $inc 是否生效未知、消息写入未确认时消息是否持久未知，都不能直接 $inc；这里用 $set 写入实际的消息数和最后一条消息（幂等），
+        version 递增使列表和历史的ETag失效。
+        """
+        by_conversation = {"user_id": user_id, "conversation_id": conversation_id}
+        try:
+            count = await self.messages_collection.count_documents(by_conversation)
+            last = await self.messages_collection.find_one(
+                by_conversation, {"content": 1, "role": 1, "timestamp": 1}, sort=[("timestamp", DESCENDING)]
+            )
+            update: Dict[str, Any] = {
+                "$set": {
+                    "message_count": count,
+                    "last_message_preview": (last or {}).get("content", "")[:self.preview_length],
+                    "last_role": (last or {}).get("role"),
+                },
+                "$inc": {"version": 1},
+            }
+            if last:
+                update["$max"] = {"updated_at": last["timestamp"]}
+            await self.conversations_collection.update_one(
+                {"conversation_id": conversation_id, "user_id": user_id}, update, upsert=True
+            )
+            call_counters.increment("group_commit_summary_repairs")
+            logger.warning("Repaired conversation summary for %s after a failed or unconfirmed group write", conversation_id)
+        except Exception as e:
+            call_counters.increment("group_commit_summary_failures")
+            logger.error("Conversation summary repair failed for %s: %s", conversation_id, e, exc_info=True,
+                         extra={"conversation_id": conversation_id})
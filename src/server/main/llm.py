@@ -1,12 +1,16 @@
 import os
 import logging
+import queue
+import threading
 import time
 import httpx
 from qwen_agent.agents import Assistant
 from qwen_agent.llm import get_chat_model
 
-from main.config import (OPENAI_API_KEY, OPENAI_API_BASE_URL,
-                         OPENAI_MODEL_NAME)
+from main.llm_router import llm_router, LLMEndpoint
+from main.circuit_breaker import llm_breaker
+from main.deadline import Deadline
+from main.metrics import call_counters
 
 logger = logging.getLogger(__name__)
 
@@ -15,29 +19,227 @@ class LLMProviderDownError(Exception):
     pass
 
 
-def run_agent(system_message: str, function_list: list, messages: list):
+class LLMTimeoutError(Exception):
+    """Raised when the LLM produces no output within the first-token or inter-token timeout."""
+    pass
+
+
+# Sentinel pushed by an endpoint stream when its generator is exhausted
+_STREAM_DONE = object()
+
+# How often a blocked run_agent checks whether its caller has cancelled the run
+CANCEL_POLL_SECONDS = 0.25
+
+
+class _EndpointStream:
+    """Runs one agent attempt against a single endpoint in its own thread."""
+
+    def __init__(self, endpoint: LLMEndpoint, system_message: str, function_list: list,
+                 messages: list, out: "queue.Queue"):
+        self.endpoint = endpoint
+        self.out = out
+        self.cancelled = threading.Event()
+        self.finished = False
+        self.started_at = time.monotonic()
+        self._thread = threading.Thread(
+            target=self._run, args=(system_message, function_list, messages), daemon=True
+        )
+        self._thread.start()
+
+    def _run(self, system_message: str, function_list: list, messages: list):
+        try:
+            bot = Assistant(llm=self.endpoint.llm_cfg, system_message=system_message, function_list=function_list or [])
+            generator = bot.run(messages=messages)
+            try:
+                for step in generator:
+                    if self.cancelled.is_set():
+                        break
+                    self.out.put((self, step))
+            finally:
+                # Closing the generator tears down the underlying HTTP stream
+                generator.close()
+            self.out.put((self, _STREAM_DONE))
+        except Exception as e:
+            self.out.put((self, e))
+
+
+def run_agent(system_message: str, function_list: list, messages: list, run_info: dict = None,
+              first_token_timeout: float = None, inter_token_timeout: float = None,
+              deadline: Deadline = None, cancel_event: threading.Event = None):
     """
     Initializes and runs a Qwen Assistant.
-    Relies on the underlying LLM provider (e.g., LiteLLM) to handle fallbacks and retries.
+    The router picks the fastest healthy endpoint. Attempts that fail before the
+    first token fail over to the next endpoint, and with hedging enabled a second
+    endpoint is raced when the first produces nothing within its p95 TTFT.
+    If `run_info` is given it is filled with the winning endpoint, model, TTFT
+    and number of attempts once the first output arrives.
+    The first-token and inter-token timeouts (both capped by `deadline`) are
+    enforced here, in the calling thread, and raise LLMTimeoutError. Setting
+    `cancel_event` ends the run within CANCEL_POLL_SECONDS even while no output
+    is arriving; the endpoint threads are cancelled either way.
     """
-    if not OPENAI_API_KEY:
+    if not llm_router.endpoints:
         raise ValueError("No OpenAI API key configured.")
+    if not llm_breaker.allow_request():
+        # Fail fast instead of waiting out a timeout against a provider known to be down
+        raise LLMProviderDownError("LLM circuit breaker is open; provider considered down.")
+
+    out: "queue.Queue" = queue.Queue()
+    streams = []
+    tried = []
+
+    def launch():
+        endpoint = llm_router.select(exclude=tried)
+        if endpoint is None:
+            return None
+        tried.append(endpoint)
+        call_counters.increment("llm_requests")
+        logger.info("Running agent with model: %s (endpoint: %s)", endpoint.model, endpoint.name)
+        stream = _EndpointStream(endpoint, system_message, function_list, messages, out)
+        streams.append(stream)
+        return stream
 
-    llm_cfg = {
-        'model': OPENAI_MODEL_NAME,
-        'model_server': OPENAI_API_BASE_URL,
-        'api_key': OPENAI_API_KEY,
-        'generate_cfg': {
-            'max_input_tokens': 128000 # Set a high limit to avoid truncation errors
-        }
-    }
+    def wait_until(*limits):
+        """Earliest of the given monotonic times and the request deadline (None for no limit)"""
+        limits = [limit for limit in limits if limit is not None]
+        if deadline is not None:
+            limits.append(deadline.expires_at)
+        return min(limits) if limits else None
 
+    def next_item(until):
+        """
+        Next (stream, item) from the endpoint threads.
+        Returns None when the caller cancelled the run and raises queue.Empty once `until` passes.
+        """
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                return None
+            timeout = CANCEL_POLL_SECONDS if cancel_event is not None else None
+            if until is not None:
+                left = until - time.monotonic()
+                if left <= 0:
+                    raise queue.Empty
+                timeout = left if timeout is None else min(timeout, left)
+            try:
+                return out.get(timeout=timeout)
+            except queue.Empty:
+                if until is not None and time.monotonic() >= until:
+                    raise
+
+    winner = None
+    last_error = None
+    breaker_recorded = False
+    can_hedge = llm_router.hedge_enabled
+    started_at = time.monotonic()
+    first_token_until = wait_until(started_at + first_token_timeout if first_token_timeout else None)
     try:
-        logger.info(f"Running agent with model: {OPENAI_MODEL_NAME}")
-        bot = Assistant(llm=llm_cfg, system_message=system_message, function_list=function_list or [])
-        yield from bot.run(messages=messages)
+        launch()
+        # Phase 1: wait for the first output from any attempt
+        while winner is None:
+            active = [s for s in streams if not s.finished]
+            if not active:
+                # Every attempt failed before producing output; fail over
+                if launch() is None:
+                    raise LLMProviderDownError(f"Agent run failed: {last_error}") from last_error
+                continue
+
+            hedge_at = None
+            if can_hedge and len(active) == 1:
+                hedge_at = active[0].started_at + llm_router.hedge_delay(active[0].endpoint)
+            until = first_token_until if hedge_at is None else wait_until(hedge_at, first_token_until)
+
+            try:
+                received = next_item(until)
+            except queue.Empty:
+                if first_token_until is not None and time.monotonic() >= first_token_until:
+                    raise LLMTimeoutError(
+                        f"No output within first-token timeout ({time.monotonic() - started_at:.2f}s, "
+                        f"{len(streams)} attempts)"
+                    ) from None
+                hedge = launch()
+                if hedge is None:
+                    can_hedge = False
+                else:
+                    logger.info("Hedging agent run on endpoint %s after no output from %s",
+                                hedge.endpoint.name, active[0].endpoint.name)
+                continue
+            if received is None:
+                return
+            stream, item = received
+
+            if stream.finished:
+                continue
+            if isinstance(item, Exception):
+                stream.finished = True
+                last_error = item
+                llm_router.record_error(stream.endpoint)
+                logger.warning("Agent run on endpoint %s failed before first token: %s", stream.endpoint.name, item)
+                continue
+
+            winner = stream
+            llm_breaker.record_success()
+            breaker_recorded = True
+            now = time.monotonic()
+            llm_router.record_success(winner.endpoint, now - winner.started_at)
+            if run_info is not None:
+                run_info.update({
+                    "endpoint": winner.endpoint.name,
+                    "model": winner.endpoint.model,
+                    "ttft": now - winner.started_at,
+                    "attempts": len(streams),
+                })
+            for other in streams:
+                if other is not winner and not other.finished:
+                    other.cancelled.set()
+                    other.finished = True
+                    llm_router.record_slow(other.endpoint, now - other.started_at)
+            if item is _STREAM_DONE:
+                return
+            yield item
+
+        # Phase 2: relay the winning stream
+        last_output_at = time.monotonic()
+        while True:
+            try:
+                received = next_item(wait_until(last_output_at + inter_token_timeout if inter_token_timeout else None))
+            except queue.Empty:
+                raise LLMTimeoutError(
+                    f"No output within inter-token timeout ({time.monotonic() - last_output_at:.2f}s since last output)"
+                ) from None
+            if received is None:
+                return
+            stream, item = received
+            if stream is not winner:
+                continue
+            last_output_at = time.monotonic()
+            if item is _STREAM_DONE:
+                return
+            if isinstance(item, Exception):
+                llm_router.record_error(winner.endpoint)
+                raise item
+            yield item
+    except LLMTimeoutError as e:
+        # A hung provider never errors on its own; count the timeout even after a first token
+        llm_breaker.record_failure()
+        breaker_recorded = True
+        logger.error("Agent run timed out: %s", e)
+        raise
+    except LLMProviderDownError as e:
+        if not breaker_recorded:
+            llm_breaker.record_failure()
+            breaker_recorded = True
+        logger.error(str(e), exc_info=True)
+        raise
     except Exception as e:
+        if not breaker_recorded:
+            llm_breaker.record_failure()
+            breaker_recorded = True
         error_message = f"Agent run failed: {e}"
         logger.error(error_message, exc_info=True)
         # Re-raise as a specific exception to be caught by the caller
         raise LLMProviderDownError(error_message) from e
+    finally:
+        if not breaker_recorded:
+            llm_breaker.record_cancel()
+        for stream in streams:
+            stream.cancelled.set()
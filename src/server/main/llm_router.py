@@ -0,0 +1,168 @@
+"""
+多端点LLM路由 - 按首token延迟(TTFT)和错误率选择最快的健康端点
+
+每个端点维护TTFT的指数移动平均和最近样本（用于p95），以及错误率的移动平均。
+路由总是选择健康端点中TTFT最低的一个；启用对冲时，若首个请求在该端点
+p95 TTFT 内没有产生任何输出，则向次优端点发起第二个请求，先出token者胜出。
+"""
+import json
+import logging
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional, Any, Iterable
+
+from main.config import (OPENAI_API_KEY, OPENAI_API_BASE_URL, OPENAI_MODEL_NAME,
+                         LLM_ENDPOINTS_JSON, LLM_HEDGE_ENABLED, LLM_HEDGE_DEFAULT_DELAY_SECONDS,
+                         LLM_ENDPOINT_MAX_ERROR_RATE, CHAT_FIRST_TOKEN_TIMEOUT_SECONDS,
+                         CHAT_INTER_TOKEN_TIMEOUT_SECONDS)
+
+logger = logging.getLogger(__name__)
+
+# 移动平均的平滑系数
+EWMA_ALPHA = 0.2
+# 用于计算p95的TTFT样本窗口
+TTFT_WINDOW = 100
+# 错误率过高的端点在冷却期后才重新参与路由（半开探测）
+UNHEALTHY_COOLDOWN_SECONDS = 30.0
+
+
+class LLMEndpoint:
+    """An OpenAI-compatible endpoint with rolling latency and error statistics"""
+
+    def __init__(self, name: str, base_url: str, model: str, api_key: str):
+        self.name = name
+        self.base_url = base_url
+        self.model = model
+        self.api_key = api_key
+        self.ewma_ttft: Optional[float] = None
+        self.error_rate = 0.0
+        self.ttft_samples: deque = deque(maxlen=TTFT_WINDOW)
+        self.last_error_at = 0.0
+        self.requests = 0
+        self.errors = 0
+
+    @property
+    def llm_cfg(self) -> Dict[str, Any]:
+        """qwen-agent 的 LLM 配置"""
+        return {
+            'model': self.model,
+            'model_server': self.base_url,
+            'api_key': self.api_key,
+            'generate_cfg': {
+                'max_input_tokens': 128000,  # Set a high limit to avoid truncation errors
+                # HTTP read timeout of the OpenAI client: a hung stream unblocks the endpoint thread
+                # instead of holding it until the TCP connection dies
+                'request_timeout': max(CHAT_FIRST_TOKEN_TIMEOUT_SECONDS, CHAT_INTER_TOKEN_TIMEOUT_SECONDS),
+            }
+        }
+
+    def p95_ttft(self) -> Optional[float]:
+        if not self.ttft_samples:
+            return None
+        ordered = sorted(self.ttft_samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "model": self.model,
+            "ewma_ttft": self.ewma_ttft,
+            "p95_ttft": self.p95_ttft(),
+            "error_rate": round(self.error_rate, 4),
+            "requests": self.requests,
+            "errors": self.errors,
+        }
+
+
+class LLMRouter:
+    """Routes agent runs to the fastest healthy endpoint"""
+
+    def __init__(self, endpoints: List[LLMEndpoint], hedge_enabled: bool = False,
+                 hedge_default_delay: float = 2.0, max_error_rate: float = 0.5):
+        self.endpoints = endpoints
+        self.hedge_enabled = hedge_enabled
+        self.hedge_default_delay = hedge_default_delay
+        self.max_error_rate = max_error_rate
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls) -> "LLMRouter":
+        """
+        从配置构建路由
+
+        LLM_ENDPOINTS 为JSON列表，例如
+        [{"name": "primary", "base_url": "...", "model": "...", "api_key": "..."}]；
+        未配置时使用 OPENAI_API_BASE_URL / OPENAI_MODEL_NAME / OPENAI_API_KEY 作为唯一端点。
+        """
+        endpoints = []
+        if LLM_ENDPOINTS_JSON:
+            try:
+                for i, item in enumerate(json.loads(LLM_ENDPOINTS_JSON)):
+                    endpoints.append(LLMEndpoint(
+                        name=item.get("name") or f"endpoint-{i}",
+                        base_url=item["base_url"],
+                        model=item.get("model") or OPENAI_MODEL_NAME,
+                        api_key=item.get("api_key") or OPENAI_API_KEY,
+                    ))
+            except (ValueError, KeyError, TypeError) as e:
+                logger.error("Invalid LLM_ENDPOINTS configuration, falling back to default endpoint: %s", e)
+                endpoints = []
+        if not endpoints and OPENAI_API_KEY:
+            endpoints.append(LLMEndpoint("default", OPENAI_API_BASE_URL, OPENAI_MODEL_NAME, OPENAI_API_KEY))
+        return cls(endpoints, hedge_enabled=LLM_HEDGE_ENABLED,
+                   hedge_default_delay=LLM_HEDGE_DEFAULT_DELAY_SECONDS,
+                   max_error_rate=LLM_ENDPOINT_MAX_ERROR_RATE)
+
+    def _is_healthy(self, endpoint: LLMEndpoint, now: float) -> bool:
+        if endpoint.error_rate < self.max_error_rate:
+            return True
+        return now - endpoint.last_error_at >= UNHEALTHY_COOLDOWN_SECONDS
+
+    def select(self, exclude: Iterable[LLMEndpoint] = ()) -> Optional[LLMEndpoint]:
+        """选择TTFT最低的健康端点；尚无样本的端点优先，以便获得测量"""
+        excluded = set(id(ep) for ep in exclude)
+        now = time.monotonic()
+        with self._lock:
+            candidates = [ep for ep in self.endpoints if id(ep) not in excluded]
+            if not candidates:
+                return None
+            healthy = [ep for ep in candidates if self._is_healthy(ep, now)] or candidates
+            return min(healthy, key=lambda ep: (ep.ewma_ttft is not None, ep.ewma_ttft or 0.0, ep.error_rate))
+
+    def hedge_delay(self, endpoint: LLMEndpoint) -> float:
+        """发起对冲请求前等待的时间：端点的p95 TTFT"""
+        with self._lock:
+            p95 = endpoint.p95_ttft()
+        return p95 if p95 is not None else self.hedge_default_delay
+
+    def record_success(self, endpoint: LLMEndpoint, ttft: float):
+        with self._lock:
+            endpoint.requests += 1
+            endpoint.ttft_samples.append(ttft)
+            endpoint.ewma_ttft = ttft if endpoint.ewma_ttft is None else (
+                EWMA_ALPHA * ttft + (1 - EWMA_ALPHA) * endpoint.ewma_ttft)
+            endpoint.error_rate = (1 - EWMA_ALPHA) * endpoint.error_rate
+
+    def record_slow(self, endpoint: LLMEndpoint, elapsed: float):
+        """被对冲请求取消的慢端点：把已等待时间作为TTFT下界计入"""
+        with self._lock:
+            endpoint.requests += 1
+            endpoint.ttft_samples.append(elapsed)
+            endpoint.ewma_ttft = elapsed if endpoint.ewma_ttft is None else max(
+                endpoint.ewma_ttft, EWMA_ALPHA * elapsed + (1 - EWMA_ALPHA) * endpoint.ewma_ttft)
+
+    def record_error(self, endpoint: LLMEndpoint):
+        with self._lock:
+            endpoint.requests += 1
+            endpoint.errors += 1
+            endpoint.last_error_at = time.monotonic()
+            endpoint.error_rate = EWMA_ALPHA + (1 - EWMA_ALPHA) * endpoint.error_rate
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [ep.snapshot() for ep in self.endpoints]
+
+
+# 全局LLM路由实例
+llm_router = LLMRouter.from_config()
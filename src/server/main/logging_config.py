@@ -0,0 +1,142 @@
+"""
+非阻塞结构化日志 - 调用方只把日志记录放入队列，格式化和写出在后台线程完成
+
+- QueueHandler + QueueListener：事件循环和工作线程中的 logger.info 不再直接写stderr
+- JSON格式：每条记录一行，extra 字段（user_id、conversation_id等）作为顶层键输出
+- 按logger采样：高频的INFO行按比例保留，WARNING及以上总是保留
+- 延迟格式化：消息参数在监听线程中才拼接（调用方使用 logger.info("... %s", x)）
+"""
+import copy
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+from typing import Dict, Optional
+
+from main.config import LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE_RATES, LOG_QUEUE_SIZE
+
+# LogRecord 的标准属性，其余属性视为 extra 字段
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as a single-line JSON object"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            payload["exc_info"] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Randomly samples records at INFO level and below for configured loggers
+
+    Rates are matched by the longest logger name prefix, e.g. {"main.db": 0.1}
+    keeps each INFO record of main.db and its children with probability 0.1.
+    WARNING and above are always kept.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        # 最长前缀优先
+        self.rates = sorted(rates.items(), key=lambda item: len(item[0]), reverse=True)
+
+    def _rate_for(self, name: str) -> Optional[float]:
+        for prefix, rate in self.rates:
+            if name == prefix or name.startswith(prefix + "."):
+                return rate
+        return None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO or not self.rates:
+            return True
+        rate = self._rate_for(record.name)
+        if rate is None or rate >= 1:
+            return True
+        if rate <= 0:
+            return False
+        # 按概率保留，任意比例都准确（计数取模会把 0.3 量化为 1/3）
+        return random.random() < rate
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that defers formatting to the listener and drops records when the queue is full"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 默认实现会在调用方线程中格式化消息；进程内队列不需要序列化，直接转交原始记录
+        return copy.copy(record)
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    """解析 "main.db=0.1,main.chat.utils=0.25" 格式的采样配置"""
+    rates = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        name, rate = item.split("=", 1)
+        try:
+            rates[name.strip()] = float(rate)
+        except ValueError:
+            continue
+    return rates
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging() -> NonBlockingQueueHandler:
+    """Route the root logger through a background QueueListener"""
+    global _listener
+    stream_handler = logging.StreamHandler(sys.stderr)
+    if LOG_FORMAT == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter("%(levelname)s:%(name)s:%(message)s"))
+
+    queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    queue_handler.addFilter(SamplingFilter(parse_sample_rates(LOG_SAMPLE_RATES)))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(LOG_LEVEL)
+
+    if _listener is not None:
+        _listener.stop()
+    _listener = logging.handlers.QueueListener(queue_handler.queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    return queue_handler
+
+
+def shutdown_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,100 @@
+"""
+跨请求的embedding微批处理
+
+mem0 在工作线程中逐条调用 embedding_model.embed()；并发的检索和记忆提取各自发出一次
+只含一条输入的embedding请求。批处理器替换共享embedder的 embed 方法：调用方把文本放入队列后阻塞等待，
+后台线程在首条输入到达后等待一个很短的窗口（或凑满 max_batch 条），用一次
+embed_batch（即一次 client.embeddings.create(input=[...])）取回整批向量，再按顺序分发给各调用方。
+同一批中按 memory_action 分组（各自一次请求），组内重复文本只请求一次。
+"""
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from main.metrics import call_counters
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingBatcher:
+    """Coalesces concurrent single-text embed() calls into provider batch calls"""
+
+    def __init__(self, embedder, window_seconds: float = 0.005, max_batch: int = 32, max_in_flight: int = 4):
+        self.embedder = embedder
+        self.window_seconds = window_seconds
+        self.max_batch = max_batch
+        self._embed_one = embedder.embed
+        # mem0 基类的 embed_batch 逐条调用 self.embed（即批处理器本身），只使用子类自己实现的批量接口
+        batch_impl = getattr(type(embedder), "embed_batch", None)
+        self._native_batch = batch_impl is not None and batch_impl.__qualname__.split(".")[0] != "EmbeddingBase"
+        self._pending: List[Tuple[str, Optional[str], Future]] = []
+        self._first_at: Optional[float] = None
+        self._cond = threading.Condition()
+        # 上一批还在等待服务端时继续收集下一批
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="embed-batch")
+        self._thread = threading.Thread(target=self._collect, name="embed-batcher", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def install(cls, embedder, **kwargs) -> "EmbeddingBatcher":
+        """替换embedder实例的 embed 方法（共用同一embedder的各分片一起生效）"""
+        batcher = cls(embedder, **kwargs)
+        embedder.embed = batcher.embed
+        return batcher
+
+    def embed(self, text, memory_action=None) -> List[float]:
+        """与 EmbeddingBase.embed 签名相同，在调用线程中阻塞直到整批返回"""
+        if not isinstance(text, str):
+            return self._embed_one(text, memory_action)
+        future: Future = Future()
+        with self._cond:
+            if not self._pending:
+                self._first_at = time.monotonic()
+            self._pending.append((text, memory_action, future))
+            self._cond.notify()
+        return future.result()
+
+    def _collect(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                # 等到窗口结束或凑满一批
+                while len(self._pending) < self.max_batch:
+                    remaining = self._first_at + self.window_seconds - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending[:self.max_batch]
+                self._pending = self._pending[self.max_batch:]
+                if self._pending:
+                    self._first_at = time.monotonic()
+            self._executor.submit(self._flush, batch)
+
+    def _flush(self, batch: List[Tuple[str, Optional[str], Future]]):
+        groups: Dict[Optional[str], List[Tuple[str, Future]]] = {}
+        for text, memory_action, future in batch:
+            groups.setdefault(memory_action, []).append((text, future))
+        for memory_action, items in groups.items():
+            self._flush_group(memory_action, items)
+
+    def _flush_group(self, memory_action: Optional[str], items: List[Tuple[str, Future]]):
+        texts = list(dict.fromkeys(text for text, _ in items))
+        try:
+            if self._native_batch:
+                vectors = self.embedder.embed_batch(texts, memory_action=memory_action)
+            else:
+                vectors = [self._embed_one(text, memory_action) for text in texts]
+            call_counters.increment("embedding_requests")
+            call_counters.increment("embedding_inputs", len(items))
+        except BaseException as e:
+            for _, future in items:
+                future.set_exception(e)
+            return
+        by_text = dict(zip(texts, vectors, strict=True))
+        for text, future in items:
+            future.set_result(by_text[text])
+        if len(items) > 1:
+            logger.debug("Embedded %d inputs (%d unique, action %s) in one request", len(items), len(texts), memory_action)
@@ -0,0 +1,92 @@
+"""
+增量记忆提取 - 只把高水位线之后的新消息（加少量上下文重叠）交给mem0提取
+
+每个会话在 conversations 文档上记录 memory_extracted_at（已处理的最后一条消息时间），
+每轮只发送其后的消息，而不是整个短期记忆窗口；廉价的预过滤跳过不可能含有事实的轮次
+（寒暄、致谢、过短的消息）。被跳过的轮次不会再被提取，所以预过滤只排除确定没有内容的消息。
+"""
+import datetime
+import re
+from typing import List, Dict, Any, Optional, Tuple
+
+# 寒暄/确认类消息：整条消息只包含这些内容时不可能有可提取的事实
+_SMALL_TALK_RE = re.compile(
+    r"^\s*(hi|hello|hey|thanks?|thank you|thx|ok(ay)?|sure|yes|no|yep|nope|cool|great|nice|got it|bye|good (morning|night)"
+    r"|你好|谢谢|好的|嗯+|行|可以|再见|收到)"
+    r"[\s!.,?~。！，？]*$",
+    re.IGNORECASE
+)
+# 短于该长度（去掉首尾空白后）的消息不值得一次提取调用；中文四个字已能表达一个事实
+_MIN_CONTENT_CHARS = 4
+
+
+def to_utc_datetime(value: Any) -> Optional[datetime.datetime]:
+    """把消息时间戳（datetime或ISO字符串，可能不带时区）统一为UTC datetime"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        try:
+            value = datetime.datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if not isinstance(value, datetime.datetime):
+        return None
+    # MongoDB 返回不带时区的UTC时间
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value
+
+
+def select_new_messages(
+    history: List[Dict[str, Any]],
+    watermark: Optional[datetime.datetime],
+    overlap: int
+) -> Tuple[List[Dict[str, str]], List[Dict[str, str]], Optional[datetime.datetime]]:
+    """
+    从按时间正序的历史中选出高水位线之后的消息
+
+    Args:
+        history: 消息列表，每条包含 role、content、timestamp（没有时间戳的视为新消息）
+        watermark: 已处理的最后一条消息时间，None表示从未提取过
+        overlap: 新消息之前额外带上的上下文消息数
+
+    Returns:
+        (发送给mem0的消息, 其中的新消息, 新的高水位线)
+    """
+    watermark = to_utc_datetime(watermark)
+    first_new = len(history)
+    for i, msg in enumerate(history):
+        ts = to_utc_datetime(msg.get("timestamp"))
+        if watermark is None or ts is None or ts > watermark:
+            first_new = i
+            break
+    if first_new == len(history):
+        return [], [], watermark
+
+    timestamps = [to_utc_datetime(msg.get("timestamp")) for msg in history[first_new:]]
+    new_watermark = max((ts for ts in timestamps if ts is not None), default=watermark)
+
+    start = max(0, first_new - overlap)
+    batch = [{"role": msg.get("role"), "content": msg.get("content", "")} for msg in history[start:]]
+    return batch, batch[first_new - start:], new_watermark
+
+
+def is_small_talk(text: str) -> bool:
+    """整条消息只是寒暄/确认"""
+    return bool(_SMALL_TALK_RE.match(text or ""))
+
+
+def has_extractable_facts(messages: List[Dict[str, str]]) -> bool:
+    """
+    廉价预过滤：新消息中至少有一条用户消息不是寒暄且达到最小长度
+
+    事实不一定以第一人称表述（"周五的会议改到了上海"），这里不做语义判断，交给提取LLM。
+    """
+    for msg in messages:
+        if msg.get("role") != "user":
+            continue
+        content = (msg.get("content") or "").strip()
+        if len(content) < _MIN_CONTENT_CHARS or is_small_talk(content):
+            continue
+        return True
+    return False
@@ -0,0 +1,168 @@
+"""
+长期记忆检索门控 - 在本地判断本轮是否值得调用embedding和向量检索
+
+"ok"、"谢谢"之类的寒暄，以及只是在追问上文、没有引入新内容的消息，检索长期记忆几乎不会
+带来新信息，却同样要付出一次embedding调用和一次向量检索。门控使用的信号：
+- 消息长度：去掉停用词后的检索词太少时跳过
+- 新颖度：消息中不在短期记忆窗口里出现过的检索词比例，太低说明只是在引用上文
+- 命中分数的EWMA：分区最近检索的最高分持续偏低时（没有相关记忆）跳过，并定期探测一次
+
+检索时按新颖度和EWMA调整top-k，结果按分数阈值过滤。每个决策都记录日志（JSON日志带有
+各项信号字段），用于调整阈值。
+"""
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional
+
+from main.memory.extraction import is_small_talk
+from main.memory.lexical_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+
+class _PartitionStats:
+    __slots__ = ("ewma", "observations", "cold_skips")
+
+    def __init__(self):
+        self.ewma: Optional[float] = None
+        self.observations = 0
+        self.cold_skips = 0
+
+
+def novelty(message: str, window: List[Dict[str, Any]]) -> float:
+    """消息检索词中未在短期记忆窗口出现过的比例（0~1，没有检索词时为0）"""
+    terms = set(tokenize(message))
+    if not terms:
+        return 0.0
+    seen = set()
+    for msg in window:
+        seen.update(tokenize(str(msg.get("content") or "")))
+    return len(terms - seen) / len(terms)
+
+
+class RetrievalGate:
+    """Decides per message whether to search long-term memory, and how many results to ask for"""
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        min_terms: int = 2,
+        min_novelty: float = 0.3,
+        min_score: float = 0.35,
+        ewma_alpha: float = 0.3,
+        warmup_observations: int = 3,
+        probe_every: int = 5,
+        min_top_k: int = 2,
+        max_top_k: int = 8,
+        max_partitions: int = 10000
+    ):
+        self.enabled = enabled
+        self.min_terms = min_terms
+        self.min_novelty = min_novelty
+        self.min_score = min_score
+        self.ewma_alpha = ewma_alpha
+        self.warmup_observations = warmup_observations
+        self.probe_every = probe_every
+        self.min_top_k = min_top_k
+        self.max_top_k = max_top_k
+        self.max_partitions = max_partitions
+        self._partitions: "OrderedDict[str, _PartitionStats]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _stats(self, partition: str) -> _PartitionStats:
+        stats = self._partitions.get(partition)
+        if stats is None:
+            stats = self._partitions[partition] = _PartitionStats()
+            while len(self._partitions) > self.max_partitions:
+                self._partitions.popitem(last=False)
+        else:
+            self._partitions.move_to_end(partition)
+        return stats
+
+    def decide(self, partition: str, message: str, window: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        判断本轮是否检索长期记忆
+
+        Args:
+            partition: 记忆分区ID（{user_id}:{conversation_id}）
+            message: 当前用户消息
+            window: 短期记忆窗口（最近的消息）
+
+        Returns:
+            {"retrieve": bool, "top_k": int, "reason": str, "terms": int, "novelty": float, "ewma": Optional[float]}
+        """
+        terms = len(set(tokenize(message)))
+        message_novelty = novelty(message, window) if window else 1.0
+        with self._lock:
+            stats = self._stats(partition)
+            ewma = stats.ewma
+            warm = stats.observations >= self.warmup_observations
+
+            if not self.enabled:
+                retrieve, reason = True, "disabled"
+            elif is_small_talk(message):
+                retrieve, reason = False, "small_talk"
+            elif terms < self.min_terms:
+                retrieve, reason = False, "too_short"
+            elif message_novelty < self.min_novelty:
+                retrieve, reason = False, "follow_up"
+            elif warm and ewma is not None and ewma < self.min_score:
+                # 分区最近没有相关记忆；每隔几次仍然检索一次，以便发现新提取的记忆
+                stats.cold_skips += 1
+                if stats.cold_skips >= self.probe_every:
+                    stats.cold_skips = 0
+                    retrieve, reason = True, "probe"
+                else:
+                    retrieve, reason = False, "cold_partition"
+            else:
+                retrieve, reason = True, "novel"
+
+        top_k = 0
+        if retrieve:
+            if not self.enabled:
+                top_k = self.max_top_k
+            else:
+                # 新颖度越高、分区命中越强，请求的结果越多；没有历史分数时按强命中处理
+                strength = (message_novelty + (ewma if ewma is not None else 1.0)) / 2
+                top_k = self.min_top_k + round((self.max_top_k - self.min_top_k) * min(max(strength, 0.0), 1.0))
+
+        decision = {
+            "retrieve": retrieve,
+            "top_k": top_k,
+            "reason": reason,
+            "terms": terms,
+            "novelty": round(message_novelty, 3),
+            "ewma": round(ewma, 3) if ewma is not None else None,
+        }
+        logger.info(
+            "Memory retrieval %s for %s: %s (terms=%d, novelty=%.2f, ewma=%s, top_k=%d)",
+            "run" if retrieve else "skipped", partition, reason, terms, message_novelty,
+            decision["ewma"], top_k,
+            extra={"partition": partition, "gate": decision}
+        )
+        return decision
+
+    def observe(self, partition: str, results: List[Dict[str, Any]]):
+        """记录一次检索的最高分（没有结果计为0），更新分区的EWMA"""
+        top_score = max((float(r.get("score") or 0.0) for r in results), default=0.0)
+        with self._lock:
+            stats = self._stats(partition)
+            if stats.ewma is None:
+                stats.ewma = top_score
+            else:
+                stats.ewma = self.ewma_alpha * top_score + (1 - self.ewma_alpha) * stats.ewma
+            stats.observations += 1
+            if top_score >= self.min_score:
+                stats.cold_skips = 0
+
+    def filter(self, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """丢弃分数低于阈值的结果"""
+        if not self.enabled:
+            return results
+        return [r for r in results if float(r.get("score") or 0.0) >= self.min_score]
+
+    def reset(self, partition: str):
+        """分区写入新记忆或被删除后清空统计"""
+        with self._lock:
+            self._partitions.pop(partition, None)
@@ -0,0 +1,99 @@
+"""
+长期记忆回收 - 删除会话后清理对应的mem0记忆分区
+
+会话删除时将 {user_id}:{conversation_id} 分区加入回收队列，由后台任务异步删除；
+周期性压缩任务对比向量库与MongoDB，删除已没有对应会话的孤立分区。
+回收量按删除的向量数报告：Chroma 的 SQLite 和 HNSW 文件删除后不会立即缩小，目录大小的差值不能反映回收的空间。
+"""
+import asyncio
+import logging
+from typing import Dict, Optional, Any, Tuple
+
+from main.db import MongoManager, mongo_manager
+from main.memory.mem0_client import Mem0Client, mem0_client
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryGarbageCollector:
+    """Deletes mem0 partitions that belong to deleted conversations"""
+
+    def __init__(self, memory_client: Mem0Client, db_manager: MongoManager):
+        self.memory_client = memory_client
+        self.db_manager = db_manager
+        self.queue: asyncio.Queue[Tuple[str, Optional[str]]] = asyncio.Queue()
+        # 已入队但尚未处理完成的任务数（包括正在删除的分区）
+        self.pending_jobs = 0
+
+    def enqueue(self, user_id: str, conversation_id: Optional[str]):
+        """将会话的记忆分区加入回收队列"""
+        self.queue.put_nowait((user_id, conversation_id))
+        self.pending_jobs += 1
+
+    async def run_worker(self):
+        """后台消费回收队列"""
+        while True:
+            user_id, conversation_id = await self.queue.get()
+            try:
+                await self.memory_client.delete_memories(user_id, conversation_id)
+            except Exception as e:
+                logger.error("Memory GC failed for %s:%s: %s", user_id, conversation_id, e, exc_info=True)
+            finally:
+                self.pending_jobs -= 1
+                self.queue.task_done()
+
+    async def compact(self) -> Dict[str, Any]:
+        """
+        查找并删除孤立的记忆分区（会话已不存在）
+
+        Returns:
+            回收报告 {"partitions_deleted", "vectors_deleted"}
+        """
+        report = {"partitions_deleted": 0, "vectors_deleted": 0}
+        if not self.memory_client.memory:
+            return report
+
+        partitions = await asyncio.to_thread(self.memory_client.list_partitions)
+
+        # 只有 {user_id}:{conversation_id} 形式的分区属于某个会话
+        by_conversation = {}
+        for partition, count in partitions.items():
+            user_id, sep, conversation_id = partition.partition(":")
+            if sep and conversation_id:
+                by_conversation[conversation_id] = (user_id, count)
+
+        existing = set()
+        conversation_ids = list(by_conversation)
+        for i in range(0, len(conversation_ids), 500):
+            cursor = self.db_manager.conversations_collection.find(
+                {"conversation_id": {"$in": conversation_ids[i:i + 500]}},
+                {"_id": 0, "conversation_id": 1}
+            )
+            existing.update([doc["conversation_id"] async for doc in cursor])
+
+        for conversation_id, (user_id, count) in by_conversation.items():
+            if conversation_id in existing:
+                continue
+            if await self.memory_client.delete_memories(user_id, conversation_id):
+                report["partitions_deleted"] += 1
+                report["vectors_deleted"] += count
+
+        logger.info(
+            "Memory compaction removed %d orphaned partitions (%d vectors)",
+            report["partitions_deleted"], report["vectors_deleted"],
+            extra={"partitions_deleted": report["partitions_deleted"], "vectors_deleted": report["vectors_deleted"]}
+        )
+        return report
+
+    async def run_compaction_loop(self, interval_seconds: int):
+        """周期性执行孤立分区压缩"""
+        while True:
+            await asyncio.sleep(interval_seconds)
+            try:
+                await self.compact()
+            except Exception as e:
+                logger.error("Memory compaction failed: %s", e, exc_info=True)
+
+
+# 全局记忆回收器实例
+memory_gc = MemoryGarbageCollector(mem0_client, mongo_manager)
@@ -0,0 +1,209 @@
+"""
+本地BM25倒排索引 - 长期记忆检索的词法快速通道
+
+每个记忆分区（{user_id}:{conversation_id}）维护一个内存中的倒排索引，
+与mem0中的记忆保持同步。检索时先查询词法索引：命中足够可信时直接返回，
+跳过远程embedding和向量检索；否则与向量检索结果融合。
+"""
+import math
+import re
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Any
+
+# 英文/数字词（保留 product-id、snake_case 之类的连字符标识符）
+_WORD_RE = re.compile(r"[a-z0-9]+(?:[-_.][a-z0-9]+)*")
+# 中日韩字符序列，按字二元组切分
+_CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]+")
+
+_STOPWORDS = frozenset({
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "do", "does", "for",
+    "from", "has", "have", "how", "i", "in", "is", "it", "its", "me", "my", "of",
+    "on", "or", "so", "that", "the", "this", "to", "was", "we", "what", "when",
+    "where", "which", "who", "why", "will", "with", "you", "your",
+})
+
+
+def tokenize(text: str) -> List[str]:
+    """将文本切分为检索词：英文按词，中日韩文字按二元组"""
+    if not text:
+        return []
+    lowered = text.lower()
+    tokens = [w for w in _WORD_RE.findall(lowered) if w not in _STOPWORDS]
+    for run in _CJK_RE.findall(lowered):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class BM25Index:
+    """Okapi BM25 inverted index over the memories of one partition"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs: Dict[str, Dict[str, Any]] = {}
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def add(self, doc_id: str, text: str):
+        """添加或替换一条记忆"""
+        if doc_id in self.docs:
+            self.remove(doc_id)
+        term_freqs = Counter(tokenize(text))
+        length = sum(term_freqs.values())
+        self.docs[doc_id] = {"text": text, "terms": term_freqs, "length": length}
+        self.total_length += length
+        for term, tf in term_freqs.items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+
+    def remove(self, doc_id: str):
+        """删除一条记忆"""
+        doc = self.docs.pop(doc_id, None)
+        if not doc:
+            return
+        self.total_length -= doc["length"]
+        for term in doc["terms"]:
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            posting.pop(doc_id, None)
+            if not posting:
+                del self.postings[term]
+
+    def search(self, query: str, limit: int = 5) -> List[Dict[str, Any]]:
+        """
+        BM25检索
+
+        Returns:
+            命中列表，按分数倒序，每个元素为 {"id", "memory", "score", "normalized_score", "coverage"}，
+            coverage 为命中文档覆盖的查询词比例（0~1）；normalized_score 为原始BM25分数除以
+            查询的理想分数（每个查询词在平均长度文档中出现一次，按idf加权），截断到0~1，
+            不随语料规模和查询长度漂移，可以和固定阈值比较
+        """
+        query_terms = set(tokenize(query))
+        if not query_terms or not self.docs:
+            return []
+
+        n_docs = len(self.docs)
+        avg_length = self.total_length / n_docs if n_docs else 0.0
+        scores: Dict[str, float] = {}
+        matched: Dict[str, int] = {}
+        ideal_score = 0.0
+        for term in query_terms:
+            posting = self.postings.get(term)
+            doc_freq = len(posting) if posting else 0
+            idf = math.log(1 + (n_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+            ideal_score += idf
+            if not posting:
+                continue
+            for doc_id, tf in posting.items():
+                length = self.docs[doc_id]["length"]
+                norm = self.k1 * (1 - self.b + self.b * length / avg_length) if avg_length else self.k1
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+                matched[doc_id] = matched.get(doc_id, 0) + 1
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [
+            {
+                "id": doc_id,
+                "memory": self.docs[doc_id]["text"],
+                "score": score,
+                "normalized_score": min(1.0, score / ideal_score) if ideal_score else 0.0,
+                "coverage": matched[doc_id] / len(query_terms),
+            }
+            for doc_id, score in ranked
+        ]
+
+
+class LexicalIndexRegistry:
+    """Per-partition BM25 indexes, safe to use from worker threads"""
+
+    def __init__(self):
+        self._indexes: Dict[str, BM25Index] = {}
+        self._lock = threading.Lock()
+
+    def is_loaded(self, partition: str) -> bool:
+        with self._lock:
+            return partition in self._indexes
+
+    def load(self, partition: str, memories: List[Dict[str, Any]]):
+        """用mem0中已有的记忆（{"id", "memory"}）初始化分区索引"""
+        index = BM25Index()
+        for mem in memories:
+            if mem.get("id") and mem.get("memory"):
+                index.add(str(mem["id"]), mem["memory"])
+        with self._lock:
+            self._indexes[partition] = index
+
+    def apply_events(self, partition: str, events: List[Dict[str, Any]]):
+        """
+        将mem0 add() 返回的事件同步到索引
+
+        Args:
+            partition: 记忆分区
+            events: mem0结果列表，格式 [{"id": "...", "memory": "...", "event": "ADD|UPDATE|DELETE"}]
+        """
+        with self._lock:
+            index = self._indexes.get(partition)
+            # 未加载的分区在下次检索时会从mem0完整加载，这里无需处理
+            if index is None:
+                return
+            for event in events or []:
+                doc_id = event.get("id")
+                if not doc_id:
+                    continue
+                kind = (event.get("event") or "ADD").upper()
+                if kind == "DELETE":
+                    index.remove(str(doc_id))
+                elif kind in ("ADD", "UPDATE") and event.get("memory"):
+                    index.add(str(doc_id), event["memory"])
+
+    def drop(self, partition: str):
+        with self._lock:
+            self._indexes.pop(partition, None)
+
+    def search(self, partition: str, query: str, limit: int = 5) -> List[Dict[str, Any]]:
+        with self._lock:
+            index = self._indexes.get(partition)
+            if index is None:
+                return []
+            return index.search(query, limit=limit)
+
+
+def is_confident_hit(hit: Optional[Dict[str, Any]], min_score: float, min_coverage: float) -> bool:
+    """判断词法命中是否足够可信，可以跳过向量检索（比较归一化分数，而不是依赖语料规模的原始BM25分数）"""
+    if not hit:
+        return False
+    return hit["normalized_score"] >= min_score and hit["coverage"] >= min_coverage
+
+
+def merge_results(vector_results: List[Dict[str, Any]], lexical_hits: List[Dict[str, Any]], limit: int, rrf_k: int = 60) -> List[Dict[str, Any]]:
+    """
+    用 Reciprocal Rank Fusion 合并向量检索与词法检索结果
+
+    向量命中保留原始score；仅词法命中的记忆使用查询词覆盖率作为score。
+    """
+    fused: Dict[str, Dict[str, Any]] = {}
+    ranks: Dict[str, float] = {}
+    key_by_text: Dict[str, str] = {}
+
+    for rank, item in enumerate(vector_results):
+        key = str(item.get("id") or item.get("memory"))
+        fused.setdefault(key, item)
+        key_by_text.setdefault(item.get("memory"), key)
+        ranks[key] = ranks.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+
+    for rank, hit in enumerate(lexical_hits):
+        # 向量结果不一定带id，按id或文本去重
+        key = hit["id"] if hit["id"] in fused else key_by_text.get(hit["memory"], hit["id"])
+        fused.setdefault(key, {"id": hit["id"], "memory": hit["memory"], "score": hit["coverage"]})
+        ranks[key] = ranks.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+
+    ordered = sorted(fused, key=lambda key: ranks[key], reverse=True)
+    return [fused[key] for key in ordered[:limit]]
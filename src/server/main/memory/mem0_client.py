@@ -2,9 +2,20 @@
 mem0客户端封装 - 用于长期记忆管理
 """
 import os
+import asyncio
+import datetime
 import logging
 from typing import List, Dict, Any, Optional
 
+from main.memory.lexical_index import LexicalIndexRegistry, is_confident_hit, merge_results
+from main.memory.search_cache import MemorySearchCache
+from main.memory.gating import RetrievalGate
+from main.memory.embedding_batcher import EmbeddingBatcher
+from main.memory.extraction import select_new_messages, has_extractable_facts
+from main.memory.sharding import MEM0_COLLECTION_NAME, shard_collection_name, shard_for_user
+from main.circuit_breaker import CircuitOpenError, memory_search_breaker, memory_extract_breaker
+from main.metrics import call_counters
+
 logger = logging.getLogger(__name__)
 
 # CRITICAL: For ChromaDB 1.4.0+, we must NOT set legacy environment variables
@@ -30,10 +41,38 @@ except (ImportError, AttributeError):
 # Import config to get API key and model name
 try:
     from main.config import OPENAI_API_KEY as CONFIG_API_KEY, OPENAI_MODEL_NAME, OPENAI_API_BASE_URL
+    from main.config import (MEMORY_LEXICAL_ENABLED, MEMORY_LEXICAL_CONFIDENT_SCORE,
+                             MEMORY_LEXICAL_CONFIDENT_COVERAGE, MEMORY_LEXICAL_BOOTSTRAP_LIMIT)
+    from main.config import (MEMORY_SEARCH_CACHE_ENABLED, MEMORY_SEARCH_CACHE_SIZE,
+                             MEMORY_SEARCH_CACHE_TTL_SECONDS)
+    from main.config import MEMORY_EXTRACT_OVERLAP_MESSAGES, MEMORY_EXTRACT_PREFILTER_ENABLED
+    from main.config import MEM0_SHARD_COUNT
+    from main.config import MEMORY_EMBED_BATCH_ENABLED, MEMORY_EMBED_BATCH_WINDOW_MS, MEMORY_EMBED_BATCH_MAX
+    from main.config import (MEMORY_GATE_ENABLED, MEMORY_GATE_MIN_TERMS, MEMORY_GATE_MIN_NOVELTY,
+                             MEMORY_MIN_SCORE, MEMORY_GATE_MIN_TOP_K, MEMORY_GATE_MAX_TOP_K)
 except ImportError:
     CONFIG_API_KEY = None
     OPENAI_MODEL_NAME = None
     OPENAI_API_BASE_URL = None
+    MEMORY_LEXICAL_ENABLED = True
+    MEMORY_LEXICAL_CONFIDENT_SCORE = 0.8
+    MEMORY_LEXICAL_CONFIDENT_COVERAGE = 0.8
+    MEMORY_LEXICAL_BOOTSTRAP_LIMIT = 1000
+    MEMORY_SEARCH_CACHE_ENABLED = True
+    MEMORY_SEARCH_CACHE_SIZE = 64
+    MEMORY_SEARCH_CACHE_TTL_SECONDS = 600
+    MEMORY_EXTRACT_OVERLAP_MESSAGES = 2
+    MEMORY_EXTRACT_PREFILTER_ENABLED = True
+    MEM0_SHARD_COUNT = 1
+    MEMORY_EMBED_BATCH_ENABLED = True
+    MEMORY_EMBED_BATCH_WINDOW_MS = 5
+    MEMORY_EMBED_BATCH_MAX = 32
+    MEMORY_GATE_ENABLED = True
+    MEMORY_GATE_MIN_TERMS = 2
+    MEMORY_GATE_MIN_NOVELTY = 0.3
+    MEMORY_MIN_SCORE = 0.35
+    MEMORY_GATE_MIN_TOP_K = 2
+    MEMORY_GATE_MAX_TOP_K = 8
 
 # Try to import mem0ai (or mem0), make it optional
 try:
@@ -55,7 +94,23 @@ class Mem0Client:
     """mem0 client wrapper for long-term memory management"""
     
     def __init__(self):
+        # 每个分片一个mem0实例（各自的Chroma集合）；memory 为第一个分片，用于可用性判断
+        self.shards: List[MemoryType] = []
         self.memory: Optional[MemoryType] = None
+        self.persist_path = os.path.abspath("./.mem0_db")
+        self.lexical_index = LexicalIndexRegistry()
+        self.search_cache = MemorySearchCache(
+            max_entries_per_partition=MEMORY_SEARCH_CACHE_SIZE,
+            ttl_seconds=MEMORY_SEARCH_CACHE_TTL_SECONDS
+        )
+        self.retrieval_gate = RetrievalGate(
+            enabled=MEMORY_GATE_ENABLED,
+            min_terms=MEMORY_GATE_MIN_TERMS,
+            min_novelty=MEMORY_GATE_MIN_NOVELTY,
+            min_score=MEMORY_MIN_SCORE,
+            min_top_k=MEMORY_GATE_MIN_TOP_K,
+            max_top_k=MEMORY_GATE_MAX_TOP_K
+        )
         self._initialize()
     
     def _initialize(self):
@@ -74,7 +129,7 @@ class Mem0Client:
                 return
             
             # Create persistent storage directory
-            persist_path = os.path.abspath("./.mem0_db")
+            persist_path = self.persist_path
             os.makedirs(persist_path, exist_ok=True)
             
             # Import chromadb AFTER environment variables are set and is_thin_client is fixed
@@ -110,7 +165,7 @@ class Mem0Client:
                 "vector_store": {
                     "provider": "chroma",
                     "config": {
-                        "collection_name": "memories",
+                        "collection_name": MEM0_COLLECTION_NAME,
                         "path": persist_path  # Local storage path
                     }
                 },
@@ -131,13 +186,34 @@ class Mem0Client:
                     }
                 }
             }
-            self.memory = Memory.from_config(config)
-            logger.info("mem0 client initialized successfully")
+            # 按用户哈希分片：每个分片一个Chroma集合，检索只扫描该用户所在分片的索引
+            shards = []
+            for shard in range(max(MEM0_SHARD_COUNT, 1)):
+                config["vector_store"]["config"]["collection_name"] = shard_collection_name(shard, MEM0_SHARD_COUNT)
+                shards.append(Memory.from_config(config))
+            # 各分片共用同一个embedding客户端
+            for shard_memory in shards[1:]:
+                shard_memory.embedding_model = shards[0].embedding_model
+            # 并发的单条embedding请求合并为批量请求
+            if MEMORY_EMBED_BATCH_ENABLED:
+                EmbeddingBatcher.install(
+                    shards[0].embedding_model,
+                    window_seconds=MEMORY_EMBED_BATCH_WINDOW_MS / 1000,
+                    max_batch=MEMORY_EMBED_BATCH_MAX
+                )
+            self.shards = shards
+            self.memory = shards[0]
+            logger.info("mem0 client initialized successfully (%d vector collection shard(s))", len(shards))
         except Exception as e:
-            logger.error(f"Failed to initialize mem0 client: {e}", exc_info=True)
+            logger.error("Failed to initialize mem0 client: %s", e, exc_info=True)
+            self.shards = []
             self.memory = None
     
-    async def search_memories(self, user_id: str, query: str, limit: int = 5, conversation_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    def memory_for(self, user_id: str) -> MemoryType:
+        """返回用户所在分片的mem0实例"""
+        return self.shards[shard_for_user(user_id, len(self.shards))]
+    
+    async def search_memories(self, user_id: str, query: str, limit: int = 5, conversation_id: Optional[str] = None, timeout: Optional[float] = None) -> List[Dict[str, Any]]:
         """
         检索与查询相关的长期记忆
         
@@ -146,6 +222,7 @@ class Mem0Client:
             query: 查询文本
             limit: 返回的最大记忆数量
             conversation_id: 对话ID，用于隔离不同对话的记忆
+            timeout: 向量检索（含embedding）的超时秒数，超时按失败计入熔断器并降级为词法结果
             
         Returns:
             相关记忆列表，每个元素为字典格式 {"memory": str, "score": float}
@@ -159,66 +236,129 @@ class Mem0Client:
             # 格式: {user_id}:{conversation_id} 或 {user_id} (如果没有 conversation_id)
             memory_user_id = f"{user_id}:{conversation_id}" if conversation_id else user_id
             
-            # mem0的search方法
-            results = self.memory.search(query=query, limit=limit, user_id=memory_user_id)
-            
-            # 处理返回结果：确保返回格式统一
-            if not results:
-                return []
-            
-            # mem0 可能返回不同格式：
-            # 1. 字典列表，每个字典包含 "memory" 或 "text" 字段
-            # 2. 字符串列表
-            # 3. 其他格式（如包含 "results" 字段的字典）
-            formatted_results = []
-            
-            # 如果返回的是单个字典，可能包含 "results" 字段
-            if isinstance(results, dict):
-                if "results" in results:
-                    # 提取 results 字段中的内容
-                    results = results["results"]
-                elif "memory" in results or "text" in results:
-                    # 单个记忆字典
-                    formatted_results.append({
-                        "memory": results.get("memory", results.get("text", str(results))),
-                        "score": results.get("score", results.get("distance", 0.0))
-                    })
-                    return formatted_results
+            # 分区未发生写入时，相同的查询直接返回缓存结果
+            if MEMORY_SEARCH_CACHE_ENABLED:
+                cached = self.search_cache.get(memory_user_id, query, limit)
+                if cached is not None:
+                    logger.info("Memory search cache hit for %s", memory_user_id)
+                    return cached
+            cache_version = self.search_cache.version(memory_user_id)
             
-            # 处理列表格式
-            if isinstance(results, (list, tuple)):
-                for item in results:
-                    if isinstance(item, dict):
-                        # 字典格式，提取 memory 或 text 字段
-                        memory_text = item.get("memory") or item.get("text") or item.get("content") or str(item)
-                        score = item.get("score") or item.get("distance") or item.get("similarity") or 0.0
-                        formatted_results.append({
-                            "memory": memory_text,
-                            "score": float(score) if score else 0.0
-                        })
-                    elif isinstance(item, str):
-                        # 字符串格式
-                        formatted_results.append({
-                            "memory": item,
-                            "score": 0.0
-                        })
-                    else:
-                        # 其他格式，尝试转换为字符串
-                        formatted_results.append({
-                            "memory": str(item),
-                            "score": 0.0
-                        })
+            # 先查本地词法索引，命中足够可信时跳过embedding和向量检索
+            lexical_hits = await self._search_lexical(memory_user_id, query, limit)
+            if lexical_hits and is_confident_hit(lexical_hits[0], MEMORY_LEXICAL_CONFIDENT_SCORE, MEMORY_LEXICAL_CONFIDENT_COVERAGE):
+                logger.info("Lexical fast path hit for %s, skipping vector search", memory_user_id)
+                formatted_results = merge_results([], lexical_hits, limit)
+            elif not memory_search_breaker.allow_request():
+                # 熔断打开：不等待embedding和向量库，降级为仅词法结果（不缓存）
+                logger.warning("Memory search circuit open, using lexical results only for %s", memory_user_id)
+                return merge_results([], lexical_hits, limit)
             else:
-                # 单个非字典结果
-                formatted_results.append({
-                    "memory": str(results),
-                    "score": 0.0
-                })
+                # mem0的search方法
+                call_counters.increment("memory_vector_searches")
+                try:
+                    # 在线程中执行，超时后不再等待（embedding和向量检索都是阻塞调用）
+                    results = await asyncio.wait_for(
+                        asyncio.to_thread(self.memory_for(user_id).search, query=query, limit=limit, user_id=memory_user_id),
+                        timeout=timeout
+                    )
+                except asyncio.TimeoutError:
+                    memory_search_breaker.record_failure()
+                    logger.warning("Memory search timed out after %.2fs for %s, using lexical results only", timeout, memory_user_id)
+                    return merge_results([], lexical_hits, limit)
+                except asyncio.CancelledError:
+                    memory_search_breaker.record_cancel()
+                    raise
+                except Exception:
+                    memory_search_breaker.record_failure()
+                    raise
+                memory_search_breaker.record_success()
+                formatted_results = merge_results(self._format_search_results(results), lexical_hits, limit)
             
+            if MEMORY_SEARCH_CACHE_ENABLED:
+                self.search_cache.put(memory_user_id, query, limit, formatted_results, cache_version)
             return formatted_results
         except Exception as e:
-            logger.error(f"Error searching memories for user {user_id} (conversation: {conversation_id}): {e}", exc_info=True)
+            logger.error("Error searching memories for user %s (conversation: %s): %s", user_id, conversation_id, e, exc_info=True)
+            return []
+    
+    async def _search_lexical(self, memory_user_id: str, query: str, limit: int) -> List[Dict[str, Any]]:
+        """查询分区的BM25索引，首次访问时从mem0加载已有记忆（在线程中读取，不阻塞事件循环）"""
+        if not MEMORY_LEXICAL_ENABLED:
+            return []
+        try:
+            if not self.lexical_index.is_loaded(memory_user_id):
+                existing = await asyncio.to_thread(
+                    self.memory_for(memory_user_id).get_all,
+                    user_id=memory_user_id, limit=MEMORY_LEXICAL_BOOTSTRAP_LIMIT
+                )
+                if isinstance(existing, dict):
+                    existing = existing.get("results", [])
+                self.lexical_index.load(memory_user_id, [m for m in existing or [] if isinstance(m, dict)])
+            return self.lexical_index.search(memory_user_id, query, limit=limit)
+        except Exception as e:
+            logger.warning("Lexical memory search failed for %s: %s", memory_user_id, e)
+            return []
+    
+    @staticmethod
+    def _format_search_results(results: Any) -> List[Dict[str, Any]]:
+        """将mem0 search的返回统一为 [{"memory": str, "score": float}] 格式"""
+        if not results:
             return []
+        
+        # mem0 可能返回不同格式：
+        # 1. 字典列表，每个字典包含 "memory" 或 "text" 字段
+        # 2. 字符串列表
+        # 3. 其他格式（如包含 "results" 字段的字典）
+        formatted_results = []
+        
+        # 如果返回的是单个字典，可能包含 "results" 字段
+        if isinstance(results, dict):
+            if "results" in results:
+                # 提取 results 字段中的内容
+                results = results["results"]
+            elif "memory" in results or "text" in results:
+                # 单个记忆字典
+                formatted_results.append({
+                    "memory": results.get("memory", results.get("text", str(results))),
+                    "score": results.get("score", results.get("distance", 0.0))
+                })
+                return formatted_results
+        
+        # 处理列表格式
+        if isinstance(results, (list, tuple)):
+            for item in results:
+                if isinstance(item, dict):
+                    # 字典格式，提取 memory 或 text 字段
+                    memory_text = item.get("memory") or item.get("text") or item.get("content") or str(item)
+                    score = item.get("score") or item.get("distance") or item.get("similarity") or 0.0
+                    formatted = {
+                        "memory": memory_text,
+                        "score": float(score) if score else 0.0
+                    }
+                    if item.get("id"):
+                        formatted["id"] = str(item["id"])
+                    formatted_results.append(formatted)
+                elif isinstance(item, str):
+                    # 字符串格式
+                    formatted_results.append({
+                        "memory": item,
+                        "score": 0.0
+                    })
+                else:
+                    # 其他格式，尝试转换为字符串
+                    formatted_results.append({
+                        "memory": str(item),
+                        "score": 0.0
+                    })
+        else:
+            # 单个非字典结果
+            formatted_results.append({
+                "memory": str(results),
+                "score": 0.0
+            })
+        
+        return formatted_results
     
     async def add_memory(self, user_id: str, memory_text: str, metadata: Optional[Dict[str, Any]] = None, conversation_id: Optional[str] = None) -> bool:
         """
@@ -248,14 +388,24 @@ class Mem0Client:
                 memory_metadata["conversation_id"] = conversation_id
             
             # mem0的add方法
-            self.memory.add(memory_text, user_id=memory_user_id, metadata=memory_metadata)
-            logger.info(f"Added memory for user {user_id} (conversation: {conversation_id}): {memory_text[:50]}...")
+            result = self.memory_for(user_id).add(memory_text, user_id=memory_user_id, metadata=memory_metadata)
+            self.search_cache.invalidate(memory_user_id)
+            self.retrieval_gate.reset(memory_user_id)
+            if isinstance(result, dict):
+                self.lexical_index.apply_events(memory_user_id, result.get("results", []))
+            logger.info(
+                "Added memory for user %s (conversation: %s): %s...", user_id, conversation_id, memory_text[:50],
+                extra={"user_id": user_id, "conversation_id": conversation_id}
+            )
             return True
         except Exception as e:
-            logger.error(f"Error adding memory for user {user_id} (conversation: {conversation_id}): {e}", exc_info=True)
+            logger.error(
+                "Error adding memory for user %s (conversation: %s): %s", user_id, conversation_id, e,
+                exc_info=True, extra={"user_id": user_id, "conversation_id": conversation_id}
+            )
             return False
     
-    async def extract_and_store(self, user_id: str, conversation_history: List[Dict[str, Any]], conversation_id: Optional[str] = None) -> bool:
+    async def extract_and_store(self, user_id: str, conversation_history: List[Dict[str, Any]], conversation_id: Optional[str] = None, timeout: Optional[float] = None) -> bool:
         """
         从对话历史中提取重要信息并存储到mem0
         
@@ -263,6 +413,7 @@ class Mem0Client:
             user_id: 用户ID
             conversation_history: 对话历史列表，格式为 [{"role": "user", "content": "..."}, ...]
             conversation_id: 对话ID，用于隔离不同对话的记忆
+            timeout: 提取（LLM + embedding）的超时秒数
             
         Returns:
             是否成功提取和存储
@@ -272,39 +423,172 @@ class Mem0Client:
             return False
         
         try:
-            # 使用 conversation_id 来隔离不同对话的记忆
-            # 格式: {user_id}:{conversation_id} 或 {user_id} (如果没有 conversation_id)
-            memory_user_id = f"{user_id}:{conversation_id}" if conversation_id else user_id
-            
-            # 准备 metadata，包含 conversation_id
-            metadata = {}
-            if conversation_id:
-                metadata["conversation_id"] = conversation_id
+            return await self._extract(user_id, conversation_history, conversation_id, timeout)
+        except CircuitOpenError as e:
+            logger.warning("%s, skipping extraction", e)
+            return False
+        except Exception as e:
+            logger.error("Error extracting memories for user %s (conversation: %s): %s", user_id, conversation_id, e, exc_info=True)
+            return False
+
+    async def extract_incremental(
+        self,
+        user_id: str,
+        history: List[Dict[str, Any]],
+        watermark: Optional[datetime.datetime],
+        conversation_id: Optional[str] = None,
+        timeout: Optional[float] = None
+    ) -> Optional[datetime.datetime]:
+        """
+        只提取高水位线之后的消息（带少量上下文重叠）
+        
+        Args:
+            user_id: 用户ID
+            history: 按时间正序的消息列表，每条包含 role、content、timestamp
+            watermark: 会话上次提取处理到的消息时间
+            conversation_id: 对话ID
+            timeout: 提取的超时秒数
             
-            # mem0 的 add 方法可以接受 messages 参数（列表格式）
-            # 当 infer=True（默认）时，会自动使用 LLM 提取关键事实并决定是添加、更新还是删除相关记忆
-            # add 方法接受 messages 参数，可以是：
-            # - 字符串
-            # - 字典 {"role": "user", "content": "..."}
-            # - 字典列表 [{"role": "user", "content": "..."}, ...]
-            result = self.memory.add(
-                messages=conversation_history,
-                user_id=memory_user_id,
-                metadata=metadata if metadata else None,
-                infer=True  # 使用 LLM 自动提取记忆
+        Returns:
+            新的高水位线；提取失败（或没有新消息）时返回None，下一轮会重新处理这些消息
+        """
+        if not self.memory:
+            return None
+        
+        batch, new_messages, new_watermark = select_new_messages(history, watermark, MEMORY_EXTRACT_OVERLAP_MESSAGES)
+        if not new_messages:
+            return None
+        
+        # 预过滤：只有寒暄或过短消息的轮次不调用提取LLM，但仍推进高水位线（这些消息不会有事实）
+        if MEMORY_EXTRACT_PREFILTER_ENABLED and not has_extractable_facts(new_messages):
+            logger.info("Skipping memory extraction for user %s (conversation: %s): no extractable facts", user_id, conversation_id)
+            return new_watermark
+        
+        try:
+            await self._extract(user_id, batch, conversation_id, timeout)
+            return new_watermark
+        except CircuitOpenError as e:
+            logger.warning("%s, deferring extraction to a later turn", e)
+            return None
+        except Exception as e:
+            logger.error("Error extracting memories for user %s (conversation: %s): %s", user_id, conversation_id, e, exc_info=True)
+            return None
+
+    async def _extract(self, user_id: str, conversation_history: List[Dict[str, Any]], conversation_id: Optional[str], timeout: Optional[float]) -> bool:
+        """调用mem0提取并存储记忆，返回是否有记忆变更；失败或熔断打开时抛出异常"""
+        # 使用 conversation_id 来隔离不同对话的记忆
+        # 格式: {user_id}:{conversation_id} 或 {user_id} (如果没有 conversation_id)
+        memory_user_id = f"{user_id}:{conversation_id}" if conversation_id else user_id
+        
+        # 准备 metadata，包含 conversation_id
+        metadata = {}
+        if conversation_id:
+            metadata["conversation_id"] = conversation_id
+        
+        # mem0 的 add 方法可以接受 messages 参数（列表格式）
+        # 当 infer=True（默认）时，会自动使用 LLM 提取关键事实并决定是添加、更新还是删除相关记忆
+        # add 方法接受 messages 参数，可以是：
+        # - 字符串
+        # - 字典 {"role": "user", "content": "..."}
+        # - 字典列表 [{"role": "user", "content": "..."}, ...]
+        if not memory_extract_breaker.allow_request():
+            raise CircuitOpenError(f"Memory extraction circuit open for {memory_user_id}")
+        call_counters.increment("memory_extractions")
+        try:
+            result = await asyncio.wait_for(
+                asyncio.to_thread(
+                    self.memory_for(user_id).add,
+                    messages=conversation_history,
+                    user_id=memory_user_id,
+                    metadata=metadata if metadata else None,
+                    infer=True  # 使用 LLM 自动提取记忆
+                ),
+                timeout=timeout
             )
+        except asyncio.CancelledError:
+            memory_extract_breaker.record_cancel()
+            raise
+        except Exception:
+            memory_extract_breaker.record_failure()
+            raise
+        memory_extract_breaker.record_success()
+        
+        # result 格式: {"results": [{"id": "...", "memory": "...", "event": "ADD"}]}
+        if result and result.get("results"):
+            self.search_cache.invalidate(memory_user_id)
+            self.retrieval_gate.reset(memory_user_id)
+            self.lexical_index.apply_events(memory_user_id, result["results"])
+            extracted_count = len(result["results"])
+            logger.info("Extracted %d memories for user %s (conversation: %s)", extracted_count, user_id, conversation_id)
+            return True
+        logger.info("No new memories extracted for user %s (conversation: %s)", user_id, conversation_id)
+        return False
+
+    async def delete_memories(self, user_id: str, conversation_id: Optional[str] = None) -> bool:
+        """
+        删除一个记忆分区的所有记忆（会话删除后调用）
+        
+        Args:
+            user_id: 用户ID
+            conversation_id: 对话ID
             
-            # result 格式: {"results": [{"id": "...", "memory": "...", "event": "ADD"}]}
-            if result and result.get("results"):
-                extracted_count = len(result["results"])
-                logger.info(f"Extracted {extracted_count} memories for user {user_id} (conversation: {conversation_id})")
-                return True
-            else:
-                logger.info(f"No new memories extracted for user {user_id} (conversation: {conversation_id})")
-                return False
+        Returns:
+            是否成功删除
+        """
+        if not self.memory:
+            return False
+        
+        memory_user_id = f"{user_id}:{conversation_id}" if conversation_id else user_id
+        try:
+            # 删除可能涉及大量向量，放到线程中避免阻塞事件循环
+            await asyncio.to_thread(self.memory_for(user_id).delete_all, user_id=memory_user_id)
+            self.lexical_index.drop(memory_user_id)
+            self.search_cache.invalidate(memory_user_id)
+            self.retrieval_gate.reset(memory_user_id)
+            logger.info("Deleted memories for partition %s", memory_user_id, extra={"partition": memory_user_id})
+            return True
         except Exception as e:
-            logger.error(f"Error extracting memories for user {user_id} (conversation: {conversation_id}): {e}", exc_info=True)
+            logger.error("Error deleting memories for partition %s: %s", memory_user_id, e,
+                         exc_info=True, extra={"partition": memory_user_id})
             return False
+    
+    def list_partitions(self, page_size: int = 1000) -> Dict[str, int]:
+        """
+        列出所有分片中的记忆分区及其向量数量
+        
+        Returns:
+            {memory_user_id: 向量数量}
+        """
+        partitions: Dict[str, int] = {}
+        for shard_memory in self.shards:
+            collection = shard_memory.vector_store.collection
+            offset = 0
+            while True:
+                page = collection.get(include=["metadatas"], limit=page_size, offset=offset)
+                metadatas = page.get("metadatas") or []
+                for metadata in metadatas:
+                    partition = (metadata or {}).get("user_id")
+                    if partition:
+                        partitions[partition] = partitions.get(partition, 0) + 1
+                if len(metadatas) < page_size:
+                    break
+                offset += page_size
+        return partitions
+    
+    def warm_up_collections(self, vector: Optional[List[float]] = None) -> Dict[str, int]:
+        """
+        打开每个分片的Chroma集合；有预热向量时执行一次查询，把向量索引加载进内存
+        
+        Returns:
+            {集合名称: 向量数量}
+        """
+        counts: Dict[str, int] = {}
+        for shard_memory in self.shards:
+            collection = shard_memory.vector_store.collection
+            counts[collection.name] = collection.count()
+            if vector is not None and counts[collection.name]:
+                collection.query(query_embeddings=[vector], n_results=1)
+        return counts
 
 # 全局mem0客户端实例
 mem0_client = Mem0Client()
@@ -0,0 +1,87 @@
+"""
+长期记忆检索结果缓存
+
+同一对话中每轮都会检索记忆，而记忆分区只在写入（add/extract/delete）时变化。
+缓存按分区存储，键为 (归一化查询, limit)；任何写入都会使分区版本号递增并清空缓存，
+检索开始时记录版本号，结果只在版本未变时写入缓存，避免并发写入导致的脏数据。
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Any, Tuple
+
+_PUNCT_RE = re.compile(r"[\s\?\!\.,;:，。？！；：、]+")
+
+
+def normalize_query(query: str) -> str:
+    """归一化查询文本：小写、合并空白、去除标点"""
+    return _PUNCT_RE.sub(" ", (query or "").lower()).strip()
+
+
+class _Partition:
+    __slots__ = ("version", "entries")
+
+    def __init__(self):
+        self.version = 0
+        self.entries: "OrderedDict[Tuple[str, int], Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
+
+
+class MemorySearchCache:
+    """Per-partition LRU cache of memory search results with write invalidation"""
+
+    def __init__(self, max_entries_per_partition: int = 64, max_partitions: int = 1000, ttl_seconds: float = 600):
+        self.max_entries_per_partition = max_entries_per_partition
+        self.max_partitions = max_partitions
+        self.ttl_seconds = ttl_seconds
+        self._partitions: "OrderedDict[str, _Partition]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _partition(self, partition: str) -> _Partition:
+        entry = self._partitions.get(partition)
+        if entry is None:
+            entry = self._partitions[partition] = _Partition()
+            while len(self._partitions) > self.max_partitions:
+                self._partitions.popitem(last=False)
+        else:
+            self._partitions.move_to_end(partition)
+        return entry
+
+    def version(self, partition: str) -> int:
+        """当前分区版本号，检索开始前记录"""
+        with self._lock:
+            return self._partition(partition).version
+
+    def get(self, partition: str, query: str, limit: int) -> Optional[List[Dict[str, Any]]]:
+        key = (normalize_query(query), limit)
+        with self._lock:
+            entries = self._partition(partition).entries
+            cached = entries.get(key)
+            if cached is None or time.monotonic() - cached[0] > self.ttl_seconds:
+                entries.pop(key, None)
+                self.misses += 1
+                return None
+            entries.move_to_end(key)
+            self.hits += 1
+            return [dict(item) for item in cached[1]]
+
+    def put(self, partition: str, query: str, limit: int, results: List[Dict[str, Any]], version: int):
+        """写入检索结果；若检索期间分区发生写入（版本变化）则丢弃"""
+        key = (normalize_query(query), limit)
+        with self._lock:
+            entry = self._partition(partition)
+            if entry.version != version:
+                return
+            entry.entries[key] = (time.monotonic(), [dict(item) for item in results])
+            entry.entries.move_to_end(key)
+            while len(entry.entries) > self.max_entries_per_partition:
+                entry.entries.popitem(last=False)
+
+    def invalidate(self, partition: str):
+        """分区写入后调用：版本号递增并清空缓存"""
+        with self._lock:
+            entry = self._partition(partition)
+            entry.version += 1
+            entry.entries.clear()
@@ -0,0 +1,33 @@
+"""
+向量集合分片 - 按用户哈希把记忆分散到多个Chroma集合
+
+检索只扫描用户所在分片的索引，而不是整个 "memories" 集合。
+分区ID {user_id}:{conversation_id} 按其中的 user_id 路由，同一用户的所有会话在同一分片。
+本模块没有副作用，迁移脚本（reshard_memories.py）可以直接导入。
+"""
+import hashlib
+
+# 只有一个分片时沿用原来的集合名称
+MEM0_COLLECTION_NAME = "memories"
+
+
+def shard_collection_name(shard: int, shard_count: int) -> str:
+    """分片对应的Chroma集合名称"""
+    return MEM0_COLLECTION_NAME if shard_count <= 1 else f"{MEM0_COLLECTION_NAME}_{shard}"
+
+
+def shard_for_user(user_id: str, shard_count: int) -> int:
+    """按用户哈希选择分片（稳定哈希，跨进程一致）"""
+    if shard_count <= 1:
+        return 0
+    base_user_id = user_id.split(":", 1)[0]
+    digest = hashlib.sha1(base_user_id.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % shard_count
+
+
+def is_shard_collection(name: str) -> bool:
+    """是否为某种分片数量下的记忆集合名称"""
+    if name == MEM0_COLLECTION_NAME:
+        return True
+    prefix, sep, index = name.rpartition("_")
+    return sep == "_" and prefix == MEM0_COLLECTION_NAME and index.isdigit()
@@ -0,0 +1,46 @@
+"""
+进程内调用计数 - 记录MongoDB命令、LLM请求和mem0调用次数
+
+通过 /metrics 暴露，供压测工具（loadgen.py）计算每轮对话的后端调用开销。
+"""
+import threading
+from typing import Dict
+
+from pymongo import monitoring
+
+
+class CallCounters:
+    """Thread-safe named counters"""
+
+    def __init__(self):
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, amount: int = 1):
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + amount
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+
+class MongoCommandCounter(monitoring.CommandListener):
+    """Counts every command sent to MongoDB, by command name"""
+
+    def __init__(self, counters: CallCounters):
+        self.counters = counters
+
+    def started(self, event):
+        self.counters.increment("mongo_commands")
+        self.counters.increment(f"mongo.{event.command_name}")
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        self.counters.increment("mongo_failures")
+
+
+# 全局计数器实例
+call_counters = CallCounters()
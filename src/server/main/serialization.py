@@ -0,0 +1,97 @@
+"""
+快速JSON序列化 - MongoDB查询结果直接编码为JSON字节
+
+读接口（历史消息、会话列表）的文档由查询投影直接生成最终形状，
+再用 orjson 一次编码（datetime 原生支持，ObjectId 转为字符串），
+绕过 FastAPI 的 jsonable_encoder 和逐字段 isoformat() 的中间拷贝。
+
+轮询接口支持条件请求：ETag 由廉价的版本检查生成，If-None-Match 匹配时直接返回304，
+不加载文档；较大的响应按路由gzip压缩（不使用全局 GZipMiddleware，以免缓冲NDJSON流）。
+"""
+import datetime
+import gzip
+import json
+import logging
+from typing import Any, Optional
+
+from bson import ObjectId
+from starlette.requests import Request
+from starlette.responses import Response
+
+try:
+    from main.config import HTTP_GZIP_MIN_BYTES, HTTP_GZIP_LEVEL
+except ImportError:
+    HTTP_GZIP_MIN_BYTES = 1024
+    HTTP_GZIP_LEVEL = 5
+
+logger = logging.getLogger(__name__)
+
+# orjson 是可选依赖，未安装时退回标准库json（较慢但输出兼容）
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    logger.warning("orjson package not installed. Falling back to the standard json encoder.")
+    orjson = None
+    ORJSON_AVAILABLE = False
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime.datetime) and value.tzinfo is None:
+        return value.replace(tzinfo=datetime.timezone.utc).isoformat()
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(obj: Any) -> bytes:
+    """
+    编码为UTF-8 JSON字节
+
+    MongoDB 返回不带时区的UTC时间，编码时标注为UTC（+00:00）。
+    """
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NAIVE_UTC)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    """JSON response rendered with dumps(); return it directly from a route to skip jsonable_encoder"""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """If-None-Match 是否包含该ETag（弱比较）"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+
+def not_modified(etag: str) -> Response:
+    """304响应，带上ETag供客户端继续使用"""
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"})
+
+
+def conditional_json_response(request: Request, content: Any, etag: Optional[str] = None) -> Response:
+    """
+    编码JSON响应，带ETag；客户端接受gzip且响应超过 HTTP_GZIP_MIN_BYTES 时压缩
+
+    Cache-Control: no-cache 让浏览器每次都带 If-None-Match 重新验证。
+    """
+    body = dumps(content)
+    headers = {"Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if etag:
+        headers["ETag"] = etag
+    if len(body) >= HTTP_GZIP_MIN_BYTES and "gzip" in request.headers.get("accept-encoding", ""):
+        body = gzip.compress(body, compresslevel=HTTP_GZIP_LEVEL)
+        headers["Content-Encoding"] = "gzip"
+    return Response(content=body, media_type="application/json", headers=headers)
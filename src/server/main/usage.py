@@ -0,0 +1,115 @@
+"""
+每轮用量统计 - token数、延迟、模型和端点
+
+token数由本地分词器估算：qwen-agent（0.0.34）的流式解析只读取带 choices 的数据块，
+服务端在最后一个数据块中返回的usage（stream_options.include_usage）不会传到调用方，所以没有服务端用量可用。
+估算的记录带 "estimated": true，统计文档中的 estimated_turns 表示其中估算的轮数。
+每轮的用量保存在助手消息上，并通过 $inc 累加到 usage_stats 集合中按用户/按天的计数文档。
+"""
+import datetime
+import logging
+from typing import List, Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# 没有分词器时的估算比例（字符/token）
+CHARS_PER_TOKEN = 4
+
+_tokenizer_count = None
+_tokenizer_loaded = False
+
+
+def _load_tokenizer():
+    """延迟加载 qwen-agent 自带的分词器（首次估算时才加载词表）"""
+    global _tokenizer_count, _tokenizer_loaded
+    if not _tokenizer_loaded:
+        _tokenizer_loaded = True
+        try:
+            from qwen_agent.utils.tokenization_qwen import count_tokens as qwen_count_tokens
+            _tokenizer_count = qwen_count_tokens
+        except ImportError:
+            logger.warning("qwen-agent tokenizer not available, estimating tokens from character counts")
+    return _tokenizer_count
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    tokenizer_count = _load_tokenizer()
+    if tokenizer_count is not None:
+        try:
+            return tokenizer_count(text)
+        except Exception:
+            pass
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def warm_up_tokenizer() -> bool:
+    """加载分词器词表（启动预热时在线程中调用），返回是否使用真实分词器"""
+    count_tokens("warm-up")
+    return _tokenizer_count is not None
+
+
+def build_turn_usage(
+    system_prompt: str,
+    prompt_messages: List[Dict[str, Any]],
+    assistant_messages: List[Dict[str, Any]],
+    final_content: str,
+    run_info: Dict[str, Any],
+    latency_seconds: float,
+    ttft_seconds: Optional[float]
+) -> Dict[str, Any]:
+    """
+    汇总一轮对话的用量（token数为本地估算，见模块说明）
+
+    分词是CPU密集的同步调用，异步代码中应通过 asyncio.to_thread 调用。
+
+    Returns:
+        {"prompt_tokens", "completion_tokens", "total_tokens", "source", "estimated", "model", "endpoint",
+         "latency_ms", "ttft_ms"}
+    """
+    prompt_tokens = count_tokens(system_prompt) + sum(
+        count_tokens(str(msg.get("content") or "")) for msg in prompt_messages
+    )
+    # 包括工具调用等中间步骤的输出
+    completion_tokens = sum(
+        count_tokens(str(msg.get("content") or "")) for msg in assistant_messages
+    ) or count_tokens(final_content)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "source": "estimate",
+        "estimated": True,
+        "model": run_info.get("model"),
+        "endpoint": run_info.get("endpoint"),
+        "latency_ms": int(latency_seconds * 1000),
+        "ttft_ms": int(ttft_seconds * 1000) if ttft_seconds is not None else None,
+    }
+
+
+def usage_day(timestamp: Optional[datetime.datetime] = None) -> str:
+    """统计文档使用的UTC日期键"""
+    timestamp = timestamp or datetime.datetime.now(datetime.timezone.utc)
+    return timestamp.strftime("%Y-%m-%d")
+
+
+def usage_increments(usage: Dict[str, Any]) -> Dict[str, int]:
+    """一轮用量对应的 $inc 字段（模型名中的点号不能出现在字段路径中）"""
+    increments = {
+        "turns": 1,
+        "prompt_tokens": usage.get("prompt_tokens", 0),
+        "completion_tokens": usage.get("completion_tokens", 0),
+        "total_tokens": usage.get("total_tokens", 0),
+        "latency_ms_sum": usage.get("latency_ms", 0),
+        "estimated_turns": 1 if usage.get("estimated") or usage.get("source") == "estimate" else 0,
+    }
+    if usage.get("ttft_ms") is not None:
+        increments["ttft_ms_sum"] = usage["ttft_ms"]
+        increments["ttft_turns"] = 1
+    model = usage.get("model")
+    if model:
+        key = str(model).replace(".", "_").replace("$", "_")
+        increments[f"models.{key}.turns"] = 1
+        increments[f"models.{key}.total_tokens"] = usage.get("total_tokens", 0)
+    return increments
@@ -0,0 +1,109 @@
+"""
+启动预热与就绪检查
+
+部署后的第一批请求不再承担冷启动开销：启动后在后台依次执行预热步骤并计时，
+全部必需步骤成功后 /health/ready 才返回就绪，负载均衡器据此开始转发流量。
+- mongo_ping：确认数据库可达（必需）
+- embedding：调用一次embedding接口，建立到embedding服务的连接（共享的embedder客户端）
+- vector_collections：在每个Chroma分片上执行一次查询，把HNSW索引加载进内存
+- tokenizer：加载用于估算每轮token数的分词器词表，避免首个完成的流在事件循环上同步加载
+- llm_probe：向每个LLM端点发送 GET /models，确认端点可达、密钥有效。这是可用性检查而不是预热：
+  qwen-agent 每次调用都新建 OpenAI 客户端，没有可以预先建立的连接
+
+可选步骤失败只记录在状态中，不阻止就绪（长期记忆和LLM各自有降级与熔断）。
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, Any, Optional, Callable, Awaitable
+
+import httpx
+
+from main.db import MongoManager
+from main.llm_router import LLMRouter
+from main.memory.mem0_client import Mem0Client
+from main.usage import warm_up_tokenizer
+
+logger = logging.getLogger(__name__)
+
+
+class Warmup:
+    """Runs the startup warm-up steps and records how long each one took"""
+
+    def __init__(self):
+        self.started = False
+        self.completed = False
+        self.skipped = False
+        self.steps: Dict[str, Dict[str, Any]] = {}
+
+    @property
+    def ready(self) -> bool:
+        """预热完成且所有必需步骤成功（关闭预热时直接就绪）"""
+        if self.skipped:
+            return True
+        return self.completed and all(step["ok"] for step in self.steps.values() if step["required"])
+
+    def skip(self):
+        """不执行预热（WARMUP_ENABLED=false）"""
+        self.skipped = True
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "started": self.started,
+            "completed": self.completed,
+            "ready": self.ready,
+            "steps": self.steps,
+        }
+
+    async def _step(self, name: str, func: Callable[[], Awaitable[Any]], timeout: float, required: bool = False) -> Any:
+        started_at = time.monotonic()
+        self.steps[name] = {"ok": None, "required": required}
+        try:
+            result = await asyncio.wait_for(func(), timeout=timeout)
+            self.steps[name].update(ok=True, seconds=round(time.monotonic() - started_at, 3))
+            logger.info("Warm-up step %s finished in %.3fs", name, self.steps[name]["seconds"])
+            return result
+        except Exception as e:
+            self.steps[name].update(ok=False, seconds=round(time.monotonic() - started_at, 3), error=str(e) or type(e).__name__)
+            logger.warning("Warm-up step %s failed after %.3fs: %s", name, self.steps[name]["seconds"], e)
+            return None
+
+    async def run(self, db_manager: MongoManager, memory_client: Mem0Client, router: LLMRouter, step_timeout: float):
+        """执行所有预热步骤；必需步骤失败时每隔几秒重试，直到成功"""
+        self.started = True
+        started_at = time.monotonic()
+
+        while not await self._step("mongo_ping", lambda: db_manager.db.command("ping"), step_timeout, required=True):
+            await asyncio.sleep(2)
+
+        vector: Optional[list] = None
+        if memory_client.memory:
+            vector = await self._step(
+                "embedding", lambda: asyncio.to_thread(memory_client.memory.embedding_model.embed, "warm-up"), step_timeout
+            )
+            await self._step(
+                "vector_collections", lambda: asyncio.to_thread(memory_client.warm_up_collections, vector), step_timeout
+            )
+
+        await self._step("tokenizer", lambda: asyncio.to_thread(warm_up_tokenizer), step_timeout)
+
+        if router.endpoints:
+            await self._step("llm_probe", lambda: self._probe_llm_endpoints(router, step_timeout), step_timeout)
+
+        self.completed = True
+        logger.info("Warm-up complete in %.3fs (ready: %s)", time.monotonic() - started_at, self.ready)
+
+    @staticmethod
+    async def _probe_llm_endpoints(router: LLMRouter, timeout: float):
+        """GET /models 探测每个端点（只检查可用性，探测用的连接随客户端关闭）"""
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            for endpoint in router.endpoints:
+                response = await client.get(
+                    endpoint.base_url.rstrip("/") + "/models",
+                    headers={"Authorization": f"Bearer {endpoint.api_key}"}
+                )
+                response.raise_for_status()
+
+
+# 全局预热状态
+warmup = Warmup()
@@ -0,0 +1,127 @@
+"""
+记忆向量集合重新分片迁移
+
+把 .mem0_db 中所有记忆集合（"memories" 以及 "memories_<n>"）的向量按用户哈希
+移动到新分片数量对应的集合中。直接复制已有的embedding和payload，不重新调用embedding接口。
+迁移期间请停止服务器；完成后把 MEM0_SHARD_COUNT 设置为相同的分片数量。
+
+用法:
+    python reshard_memories.py --shards 8
+    python reshard_memories.py --shards 1 --path ./.mem0_db     # 合并回单个 "memories" 集合
+    python reshard_memories.py --shards 8 --dry-run
+"""
+import argparse
+import os
+import sys
+from collections import defaultdict
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+# 与 mem0_client 一致：ChromaDB 1.x 不能使用旧版环境变量
+for key in ("CHROMA_DB_IMPL", "IS_PERSISTENT", "CHROMA_API_IMPL", "CHROMA_SERVER_HOST",
+            "CHROMA_SERVER_HTTP_PORT", "CHROMA_HTTP_HOST", "CHROMA_HTTP_PORT"):
+    os.environ.pop(key, None)
+
+import chromadb
+
+from main.config import MEM0_SHARD_COUNT
+from main.memory.sharding import shard_collection_name, shard_for_user, is_shard_collection
+
+
+def reshard(path: str, shard_count: int, batch_size: int, dry_run: bool) -> Dict[str, int]:
+    client = chromadb.PersistentClient(path=path)
+    source_names = sorted(c.name if hasattr(c, "name") else c for c in client.list_collections())
+    source_names = [name for name in source_names if is_shard_collection(name)]
+    target_names = {shard_collection_name(shard, shard_count) for shard in range(shard_count)}
+    print(f"Source collections: {source_names or '(none)'}")
+    print(f"Target collections: {sorted(target_names)}")
+
+    report = {"vectors_scanned": 0, "vectors_moved": 0, "collections_dropped": 0}
+    targets = {}
+    for source_name in source_names:
+        source = client.get_collection(source_name)
+        moved: Dict[str, List[str]] = defaultdict(list)
+        offset = 0
+        # 先复制，全部复制完成后再从源集合删除，避免分页偏移错位
+        while True:
+            page = source.get(include=["embeddings", "metadatas", "documents"], limit=batch_size, offset=offset)
+            ids = page.get("ids") or []
+            if not ids:
+                break
+            batches = defaultdict(lambda: {"ids": [], "embeddings": [], "metadatas": [], "documents": []})
+            for i, vector_id in enumerate(ids):
+                metadata = (page["metadatas"][i] if page.get("metadatas") is not None else None) or {}
+                partition = metadata.get("user_id")
+                if partition:
+                    target_name = shard_collection_name(shard_for_user(partition, shard_count), shard_count)
+                else:
+                    # 没有用户信息的向量留在原集合（原集合不是目标集合时放入第一个分片）
+                    target_name = source_name if source_name in target_names else shard_collection_name(0, shard_count)
+                if target_name == source_name:
+                    continue
+                batch = batches[target_name]
+                batch["ids"].append(vector_id)
+                batch["embeddings"].append(page["embeddings"][i])
+                batch["metadatas"].append(metadata or None)
+                documents = page.get("documents")
+                batch["documents"].append(documents[i] if documents is not None else None)
+            report["vectors_scanned"] += len(ids)
+
+            for target_name, batch in batches.items():
+                if not dry_run:
+                    if target_name not in targets:
+                        # 与 mem0 的 create_col 相同：不设置embedding函数，向量由调用方提供
+                        targets[target_name] = client.get_or_create_collection(name=target_name, embedding_function=None)
+                    kwargs = {"ids": batch["ids"], "embeddings": batch["embeddings"], "metadatas": batch["metadatas"]}
+                    if any(doc is not None for doc in batch["documents"]):
+                        kwargs["documents"] = batch["documents"]
+                    targets[target_name].upsert(**kwargs)
+                moved[target_name].extend(batch["ids"])
+                report["vectors_moved"] += len(batch["ids"])
+            offset += len(ids)
+
+        moved_count = sum(len(ids) for ids in moved.values())
+        print(f"{source_name}: {moved_count} vectors to move " +
+              ", ".join(f"{name}={len(ids)}" for name, ids in sorted(moved.items())))
+        if dry_run:
+            continue
+
+        moved_ids = [vector_id for ids in moved.values() for vector_id in ids]
+        for i in range(0, len(moved_ids), batch_size):
+            source.delete(ids=moved_ids[i:i + batch_size])
+        if source_name not in target_names and source.count() == 0:
+            client.delete_collection(source_name)
+            report["collections_dropped"] += 1
+            print(f"Dropped empty collection {source_name}")
+
+    # 确保所有目标集合都存在，空分片也能正常打开
+    if not dry_run:
+        for target_name in target_names:
+            client.get_or_create_collection(name=target_name, embedding_function=None)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move mem0 vectors into per-user-hash collection shards")
+    parser.add_argument("--path", default="./.mem0_db", help="Chroma persist directory used by the server")
+    parser.add_argument("--shards", type=int, default=MEM0_SHARD_COUNT, help="Target shard count (MEM0_SHARD_COUNT)")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true", help="Only report how many vectors would move")
+    args = parser.parse_args()
+
+    if args.shards < 1:
+        parser.error("--shards must be at least 1")
+    if not os.path.isdir(args.path):
+        parser.error(f"{args.path} does not exist")
+
+    report = reshard(os.path.abspath(args.path), args.shards, args.batch_size, args.dry_run)
+    print(f"Scanned {report['vectors_scanned']} vectors, "
+          f"{'would move' if args.dry_run else 'moved'} {report['vectors_moved']}, "
+          f"dropped {report['collections_dropped']} collections")
+    if not args.dry_run:
+        print(f"Set MEM0_SHARD_COUNT={args.shards} before restarting the server.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+"""
+单元测试公共配置
+
+与 src/server 下的脚本一样把服务端目录加入 sys.path，测试直接导入 main 包。
+只覆盖不依赖外部服务（MongoDB、LLM、embedding）的模块；数据库集合用内存中的假对象代替。
+运行: cd src/server && python -m pytest -q tests（根目录下的 test_mem0*.py 是需要真实服务的手动脚本）
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
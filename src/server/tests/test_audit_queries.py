@@ -0,0 +1,24 @@
+import datetime
+
+from audit_queries import build_query_shapes, uncovered_methods, recommend_index, QueryShape
+
+SAMPLE = {
+    "user_id": "u",
+    "conversation_id": "c",
+    "message_id": "m",
+    "timestamp": datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc),
+}
+
+
+def test_every_querying_mongo_manager_method_has_a_shape():
+    assert uncovered_methods(build_query_shapes(SAMPLE)) == []
+
+
+def test_dropped_shape_is_reported():
+    shapes = [shape for shape in build_query_shapes(SAMPLE) if "get_conversations_version" not in shape.source]
+    assert uncovered_methods(shapes) == ["get_conversations_version"]
+
+
+def test_recommend_index_follows_esr():
+    shape = QueryShape("q", "messages", {"user_id": "u", "timestamp": {"$lt": 1}}, sort=[("conversation_id", 1)])
+    assert recommend_index(shape) == [("user_id", 1), ("conversation_id", 1), ("timestamp", 1)]
@@ -0,0 +1,64 @@
+import asyncio
+import threading
+
+import pytest
+
+from main.chat.channel import SnapshotChannel
+
+
+def test_latest_snapshot_wins():
+    async def run():
+        channel = SnapshotChannel(asyncio.get_running_loop())
+        for i in range(5):
+            channel.publish([i])
+        channel.close()
+        return [await channel.get(), await channel.get(), channel.superseded]
+
+    assert asyncio.run(run()) == [[4], None, 4]
+
+
+def test_worker_error_is_raised_after_last_snapshot():
+    async def run():
+        channel = SnapshotChannel(asyncio.get_running_loop())
+        channel.publish([1])
+        channel.close(error=ValueError("boom"))
+        first = await channel.get()
+        with pytest.raises(ValueError, match="boom"):
+            await channel.get()
+        return first
+
+    assert asyncio.run(run()) == [1]
+
+
+def test_publish_after_close_is_ignored():
+    async def run():
+        channel = SnapshotChannel(asyncio.get_running_loop())
+        channel.close()
+        channel.publish([1])
+        return await channel.get()
+
+    assert asyncio.run(run()) is None
+
+
+def test_consumer_sees_final_snapshot_from_worker_thread():
+    async def run():
+        channel = SnapshotChannel(asyncio.get_running_loop())
+
+        def worker():
+            for i in range(1000):
+                channel.publish(list(range(i + 1)))
+            channel.close()
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        last = None
+        while True:
+            snapshot = await asyncio.wait_for(channel.get(), timeout=5)
+            if snapshot is None:
+                break
+            last = snapshot
+            await asyncio.sleep(0)
+        thread.join()
+        return last
+
+    assert len(asyncio.run(run())) == 1000
@@ -0,0 +1,80 @@
+import time
+
+from main.circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+
+
+def make_breaker(**kwargs):
+    options = {"failure_threshold": 2, "recovery_seconds": 0.05, "half_open_max_calls": 1, "probe_timeout": 0.1}
+    options.update(kwargs)
+    return CircuitBreaker("test", **options)
+
+
+def test_opens_after_consecutive_failures():
+    breaker = make_breaker()
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow_request()
+    assert breaker.metrics()["rejected"] == 1
+
+
+def test_success_resets_failure_count():
+    breaker = make_breaker()
+    breaker.allow_request()
+    breaker.record_failure()
+    breaker.allow_request()
+    breaker.record_success()
+    breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+
+
+def test_half_open_admits_one_probe_and_closes_on_success():
+    breaker = make_breaker(failure_threshold=1)
+    breaker.allow_request()
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow_request()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+
+
+def test_half_open_failure_reopens():
+    breaker = make_breaker(failure_threshold=1)
+    breaker.allow_request()
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.metrics()["times_opened"] == 2
+
+
+def test_cancel_releases_half_open_slot():
+    breaker = make_breaker(failure_threshold=1)
+    breaker.allow_request()
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow_request()
+    breaker.record_cancel()
+    assert breaker.allow_request()
+
+
+def test_hung_probe_times_out_and_reopens():
+    breaker = make_breaker(failure_threshold=1)
+    breaker.allow_request()
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow_request()
+    # 探测调用一直没有报告结果
+    time.sleep(0.11)
+    assert not breaker.allow_request()
+    assert breaker.state == OPEN
+    time.sleep(0.06)
+    assert breaker.allow_request()
+    assert breaker.state == HALF_OPEN
@@ -0,0 +1,20 @@
+import time
+
+from main.deadline import Deadline
+
+
+def test_timeout_is_capped_by_remaining_budget_and_stage_cap():
+    deadline = Deadline(10)
+    assert 9 < deadline.timeout() <= 10
+    assert deadline.timeout(cap=2) == 2
+    assert deadline.has_budget_for(5)
+    assert not deadline.has_budget_for(11)
+
+
+def test_expired_deadline_keeps_floor():
+    deadline = Deadline(0.01)
+    time.sleep(0.02)
+    assert deadline.expired
+    assert deadline.remaining() == 0.0
+    assert deadline.timeout(cap=3) == 0.0
+    assert deadline.timeout(cap=3, floor=5) == 5
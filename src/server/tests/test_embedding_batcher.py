@@ -0,0 +1,84 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from mem0.embeddings.base import EmbeddingBase
+
+from main.memory.embedding_batcher import EmbeddingBatcher
+
+
+class SingleEmbedder(EmbeddingBase):
+    """Only implements embed(); inherits the sequential embed_batch from EmbeddingBase"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def embed(self, text, memory_action=None):
+        with self.lock:
+            self.calls.append((text, memory_action))
+        return [float(len(text)), 1.0 if memory_action == "search" else 0.0]
+
+
+class BatchEmbedder(SingleEmbedder):
+    def __init__(self, fail=False):
+        super().__init__()
+        self.batches = []
+        self.fail = fail
+
+    def embed_batch(self, texts, memory_action="add"):
+        with self.lock:
+            self.batches.append((list(texts), memory_action))
+        if self.fail:
+            raise ConnectionError("provider unavailable")
+        return [[float(len(text)), 1.0 if memory_action == "search" else 0.0] for text in texts]
+
+
+def embed_concurrently(batcher, inputs):
+    with ThreadPoolExecutor(max_workers=len(inputs)) as pool:
+        return list(pool.map(lambda item: batcher.embed(*item), inputs))
+
+
+def test_concurrent_calls_share_one_batch_with_duplicates_removed():
+    embedder = BatchEmbedder()
+    batcher = EmbeddingBatcher(embedder, window_seconds=0.2, max_batch=32)
+    inputs = [("alpha", "search"), ("beta!", "search"), ("alpha", "search")]
+    vectors = embed_concurrently(batcher, inputs)
+
+    assert vectors == [[5.0, 1.0], [5.0, 1.0], [5.0, 1.0]]
+    (texts, action), = embedder.batches
+    assert sorted(texts) == ["alpha", "beta!"]
+    assert action == "search"
+
+
+def test_memory_action_is_preserved_per_group():
+    embedder = BatchEmbedder()
+    batcher = EmbeddingBatcher(embedder, window_seconds=0.2, max_batch=32)
+    vectors = embed_concurrently(batcher, [("same", "search"), ("same", "add")])
+
+    assert vectors == [[4.0, 1.0], [4.0, 0.0]]
+    assert sorted(action for _, action in embedder.batches) == ["add", "search"]
+
+
+def test_base_class_embed_batch_is_not_used():
+    # EmbeddingBase.embed_batch calls self.embed, which install() points at the batcher itself
+    embedder = SingleEmbedder()
+    batcher = EmbeddingBatcher.install(embedder, window_seconds=0.05, max_batch=32)
+    vectors = embed_concurrently(batcher, [("one", "add"), ("three", "add")])
+
+    assert vectors == [[3.0, 0.0], [5.0, 0.0]]
+    assert sorted(embedder.calls) == [("one", "add"), ("three", "add")]
+
+
+def test_provider_error_reaches_every_caller():
+    batcher = EmbeddingBatcher(BatchEmbedder(fail=True), window_seconds=0.05)
+    with pytest.raises(ConnectionError):
+        batcher.embed("text", "search")
+
+
+def test_non_string_input_bypasses_the_batch():
+    embedder = BatchEmbedder()
+    batcher = EmbeddingBatcher(embedder, window_seconds=0.05)
+    assert batcher.embed(["a", "b"], "add") == [2.0, 0.0]
+    assert embedder.batches == []
@@ -0,0 +1,48 @@
+import datetime
+
+from main.memory.extraction import select_new_messages, has_extractable_facts, is_small_talk, to_utc_datetime
+
+T0 = datetime.datetime(2026, 1, 1, 12, 0, tzinfo=datetime.timezone.utc)
+
+
+def history(count):
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i}",
+         "timestamp": T0 + datetime.timedelta(minutes=i)}
+        for i in range(count)
+    ]
+
+
+def test_first_extraction_sends_everything():
+    batch, new, watermark = select_new_messages(history(3), None, overlap=2)
+    assert len(batch) == len(new) == 3
+    assert watermark == T0 + datetime.timedelta(minutes=2)
+
+
+def test_only_messages_after_watermark_with_overlap():
+    messages = history(6)
+    batch, new, watermark = select_new_messages(messages, T0 + datetime.timedelta(minutes=3), overlap=2)
+    assert [m["content"] for m in new] == ["message 4", "message 5"]
+    assert [m["content"] for m in batch] == ["message 2", "message 3", "message 4", "message 5"]
+    assert watermark == T0 + datetime.timedelta(minutes=5)
+
+
+def test_nothing_new_keeps_watermark():
+    watermark = T0 + datetime.timedelta(minutes=5)
+    assert select_new_messages(history(6), watermark, overlap=2) == ([], [], watermark)
+
+
+def test_naive_and_iso_timestamps_are_treated_as_utc():
+    naive = datetime.datetime(2026, 1, 1, 12, 0)
+    assert to_utc_datetime(naive) == T0
+    assert to_utc_datetime("2026-01-01T12:00:00") == T0
+    assert to_utc_datetime("not a date") is None
+    messages = [{"role": "user", "content": "hi", "timestamp": "2026-01-01T12:01:00"}]
+    assert select_new_messages(messages, naive, overlap=0)[1] == [{"role": "user", "content": "hi"}]
+
+
+def test_prefilter():
+    assert is_small_talk("thanks!")
+    assert not has_extractable_facts([{"role": "user", "content": "ok"}])
+    assert not has_extractable_facts([{"role": "assistant", "content": "Your meeting moved to Friday"}])
+    assert has_extractable_facts([{"role": "user", "content": "周五的会议改到了上海"}])
@@ -0,0 +1,43 @@
+from main.memory.gating import RetrievalGate, novelty
+
+
+def test_novelty_counts_terms_not_in_window():
+    window = [{"role": "assistant", "content": "Green tea is popular in Japan"}]
+    assert novelty("green tea", window) == 0.0
+    assert novelty("green coffee", window) == 0.5
+    assert novelty("", window) == 0.0
+
+
+def test_skips_small_talk_short_and_follow_up_messages():
+    gate = RetrievalGate(min_terms=2)
+    window = [{"role": "assistant", "content": "Your meeting in Shanghai moved to Friday"}]
+    assert gate.decide("p", "thanks", [])["reason"] == "small_talk"
+    assert gate.decide("p", "Shanghai", [])["reason"] == "too_short"
+    assert gate.decide("p", "meeting Shanghai Friday", window)["reason"] == "follow_up"
+
+    decision = gate.decide("p", "what tea do I like", window)
+    assert decision["retrieve"] and decision["reason"] == "novel"
+    assert gate.min_top_k <= decision["top_k"] <= gate.max_top_k
+
+
+def test_cold_partition_is_skipped_and_probed_periodically():
+    gate = RetrievalGate(min_score=0.5, warmup_observations=2, probe_every=3)
+    for _ in range(2):
+        gate.observe("p", [{"score": 0.1}])
+    reasons = [gate.decide("p", "what tea do I like", [])["reason"] for _ in range(3)]
+    assert reasons == ["cold_partition", "cold_partition", "probe"]
+
+    gate.reset("p")
+    assert gate.decide("p", "what tea do I like", [])["reason"] == "novel"
+
+
+def test_disabled_gate_always_retrieves_max_top_k():
+    gate = RetrievalGate(enabled=False, max_top_k=8)
+    decision = gate.decide("p", "ok", [])
+    assert decision == {**decision, "retrieve": True, "reason": "disabled", "top_k": 8}
+    assert gate.filter([{"score": 0.0}]) == [{"score": 0.0}]
+
+
+def test_filter_drops_low_scores():
+    gate = RetrievalGate(min_score=0.35)
+    assert gate.filter([{"score": 0.9}, {"score": 0.1}, {}]) == [{"score": 0.9}]
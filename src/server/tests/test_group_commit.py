@@ -0,0 +1,168 @@
+import asyncio
+import datetime
+
+import pytest
+from pymongo.errors import BulkWriteError, DuplicateKeyError, WriteConcernError
+
+from main.group_commit import GroupCommitWriter
+
+
+class FakeMessages:
+    """In-memory stand-in for the motor messages collection"""
+
+    def __init__(self, duplicate_ids=(), write_concern_error=False):
+        self.docs = []
+        self.insert_calls = 0
+        self.duplicate_ids = set(duplicate_ids)
+        self.write_concern_error = write_concern_error
+
+    async def insert_many(self, docs, ordered=True):
+        self.insert_calls += 1
+        write_errors = []
+        for i, doc in enumerate(docs):
+            if doc["message_id"] in self.duplicate_ids:
+                write_errors.append({"index": i, "code": 11000, "errmsg": "duplicate key"})
+            else:
+                self.docs.append(doc)
+        concern_errors = [{"errmsg": "waiting for replication timed out"}] if self.write_concern_error else []
+        if write_errors or concern_errors:
+            raise BulkWriteError({"writeErrors": write_errors, "writeConcernErrors": concern_errors})
+
+    def _matching(self, query):
+        return [d for d in self.docs if all(d.get(k) == v for k, v in query.items())]
+
+    async def count_documents(self, query):
+        return len(self._matching(query))
+
+    async def find_one(self, query, projection=None, sort=None):
+        matching = sorted(self._matching(query), key=lambda d: d["timestamp"], reverse=True)
+        return matching[0] if matching else None
+
+
+class FakeConversations:
+    def __init__(self, fail_bulk_write=False):
+        self.bulk_calls = []
+        self.repairs = []
+        self.fail_bulk_write = fail_bulk_write
+
+    async def bulk_write(self, operations, ordered=True):
+        self.bulk_calls.append(operations)
+        if self.fail_bulk_write:
+            raise RuntimeError("connection reset")
+
+    async def update_one(self, query, update, upsert=False):
+        self.repairs.append((query, update))
+
+
+def message(message_id, conversation_id="c1", seconds=0, content="hello"):
+    return {
+        "message_id": message_id,
+        "user_id": "u",
+        "conversation_id": conversation_id,
+        "role": "user",
+        "content": content,
+        "timestamp": datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc) + datetime.timedelta(seconds=seconds),
+    }
+
+
+def run_batch(writer, docs):
+    async def run():
+        results = await asyncio.gather(*[writer.submit(doc) for doc in docs], return_exceptions=True)
+        await writer.close()
+        return results
+
+    return asyncio.run(run())
+
+
+def test_concurrent_submits_share_one_insert_and_one_bulk_write():
+    messages, conversations = FakeMessages(), FakeConversations()
+    writer = GroupCommitWriter(messages, conversations, preview_length=3)
+    docs = [message("m1", seconds=1, content="first"), message("m2", seconds=2, content="second"),
+            message("m3", conversation_id="c2")]
+    results = run_batch(writer, docs)
+
+    assert results == docs
+    assert messages.insert_calls == 1
+    assert len(conversations.bulk_calls) == 1
+    updates = {op._filter["conversation_id"]: op._doc for op in conversations.bulk_calls[0]}
+    assert updates["c1"]["$inc"] == {"message_count": 2, "version": 2}
+    assert updates["c1"]["$set"]["last_message_preview"] == "sec"
+    assert updates["c2"]["$inc"] == {"message_count": 1, "version": 1}
+
+
+def test_duplicate_message_fails_only_its_caller():
+    messages, conversations = FakeMessages(duplicate_ids={"m2"}), FakeConversations()
+    writer = GroupCommitWriter(messages, conversations, preview_length=10)
+    results = run_batch(writer, [message("m1"), message("m2")])
+
+    assert results[0]["message_id"] == "m1"
+    assert isinstance(results[1], DuplicateKeyError)
+    (operation,) = conversations.bulk_calls[0]
+    assert operation._doc["$inc"]["message_count"] == 1
+
+
+def test_write_concern_error_is_raised_and_summaries_are_repaired():
+    messages, conversations = FakeMessages(write_concern_error=True), FakeConversations()
+    writer = GroupCommitWriter(messages, conversations, preview_length=10)
+    docs = [message("m1", seconds=1), message("m2", seconds=2, content="second"), message("m3", conversation_id="c2")]
+    results = run_batch(writer, docs)
+
+    assert all(isinstance(result, WriteConcernError) for result in results)
+    # The messages may be on the primary: no $inc, the summaries are recomputed instead
+    assert conversations.bulk_calls == []
+    repairs = {query["conversation_id"]: update for query, update in conversations.repairs}
+    assert repairs["c1"]["$set"]["message_count"] == 2
+    assert repairs["c1"]["$set"]["last_message_preview"] == "second"
+    assert repairs["c2"]["$set"]["message_count"] == 1
+
+
+def test_write_concern_error_does_not_repair_for_rejected_duplicates():
+    messages = FakeMessages(duplicate_ids={"m2"}, write_concern_error=True)
+    conversations = FakeConversations()
+    writer = GroupCommitWriter(messages, conversations, preview_length=10)
+    results = run_batch(writer, [message("m1"), message("m2", conversation_id="c2")])
+
+    assert isinstance(results[0], WriteConcernError)
+    assert isinstance(results[1], DuplicateKeyError)
+    assert [query["conversation_id"] for query, _ in conversations.repairs] == ["c1"]
+
+
+def test_insert_failure_with_unknown_outcome_repairs_summaries():
+    class FailingMessages(FakeMessages):
+        async def insert_many(self, docs, ordered=True):
+            self.docs.extend(docs)
+            raise ConnectionError("connection reset after send")
+
+    messages, conversations = FailingMessages(), FakeConversations()
+    writer = GroupCommitWriter(messages, conversations, preview_length=10)
+    results = run_batch(writer, [message("m1"), message("m2")])
+
+    assert all(isinstance(result, ConnectionError) for result in results)
+    (query, update), = conversations.repairs
+    assert query["conversation_id"] == "c1"
+    assert update["$set"]["message_count"] == 2
+
+
+def test_failed_summary_update_is_repaired_without_failing_callers():
+    messages, conversations = FakeMessages(), FakeConversations(fail_bulk_write=True)
+    writer = GroupCommitWriter(messages, conversations, preview_length=10)
+    docs = [message("m1", seconds=1, content="first"), message("m2", seconds=2, content="second")]
+    results = run_batch(writer, docs)
+
+    assert results == docs
+    (query, update), = conversations.repairs
+    assert query == {"conversation_id": "c1", "user_id": "u"}
+    assert update["$set"]["message_count"] == 2
+    assert update["$set"]["last_message_preview"] == "second"
+    assert update["$inc"] == {"version": 1}
+
+
+def test_submit_after_close_is_rejected():
+    writer = GroupCommitWriter(FakeMessages(), FakeConversations(), preview_length=10)
+
+    async def run():
+        await writer.close()
+        await writer.submit(message("m1"))
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(run())
@@ -0,0 +1,88 @@
+from main.memory.lexical_index import (
+    BM25Index, LexicalIndexRegistry, tokenize, is_confident_hit, merge_results
+)
+
+
+def make_index():
+    index = BM25Index()
+    index.add("1", "User prefers green tea in the morning")
+    index.add("2", "User works as a backend engineer")
+    index.add("3", "User's cat is named Miso")
+    return index
+
+
+def test_tokenize_drops_stopwords_and_splits_cjk():
+    assert "the" not in tokenize("The quick fox")
+    assert "quick" in tokenize("The quick fox")
+    assert tokenize("喜欢绿茶")
+
+
+def test_search_ranks_matching_document_first():
+    hits = make_index().search("green tea")
+    assert hits[0]["id"] == "1"
+    assert hits[0]["coverage"] == 1.0
+    assert 0.0 < hits[0]["normalized_score"] <= 1.0
+
+
+def test_normalized_score_does_not_grow_with_corpus_size():
+    index = make_index()
+    before = index.search("green tea")[0]["normalized_score"]
+    for i in range(50):
+        index.add(f"filler-{i}", f"unrelated memory number {i} about travel plans")
+    after = index.search("green tea")[0]["normalized_score"]
+    assert after <= 1.0
+    assert abs(after - before) < 0.35
+
+
+def test_partial_coverage():
+    hit = make_index().search("green coffee")[0]
+    assert hit["id"] == "1"
+    assert hit["coverage"] == 0.5
+
+
+def test_remove_and_readd():
+    index = make_index()
+    index.remove("1")
+    assert index.search("green tea") == []
+    index.add("1", "User now prefers coffee")
+    assert index.search("coffee")[0]["id"] == "1"
+    assert len(index) == 3
+
+
+def test_registry_applies_mem0_events_only_to_loaded_partitions():
+    registry = LexicalIndexRegistry()
+    registry.apply_events("u:c", [{"id": "1", "memory": "likes tea", "event": "ADD"}])
+    assert not registry.is_loaded("u:c")
+
+    registry.load("u:c", [{"id": "1", "memory": "likes tea"}])
+    registry.apply_events("u:c", [
+        {"id": "1", "event": "DELETE"},
+        {"id": "2", "memory": "likes coffee", "event": "ADD"},
+    ])
+    assert registry.search("u:c", "tea") == []
+    assert registry.search("u:c", "coffee")[0]["id"] == "2"
+    registry.drop("u:c")
+    assert registry.search("u:c", "coffee") == []
+
+
+def test_is_confident_hit():
+    hit = {"normalized_score": 0.9, "coverage": 1.0}
+    assert is_confident_hit(hit, min_score=0.8, min_coverage=0.8)
+    assert not is_confident_hit({**hit, "coverage": 0.5}, min_score=0.8, min_coverage=0.8)
+    assert not is_confident_hit(None, min_score=0.8, min_coverage=0.8)
+
+
+def test_merge_results_fuses_ranks_and_deduplicates_by_text():
+    vector = [
+        {"id": "a", "memory": "likes tea", "score": 0.9},
+        {"memory": "works remotely", "score": 0.7},
+    ]
+    lexical = [
+        {"id": "b", "memory": "works remotely", "score": 3.0, "normalized_score": 0.9, "coverage": 1.0},
+        {"id": "c", "memory": "cat named Miso", "score": 1.0, "normalized_score": 0.4, "coverage": 0.5},
+    ]
+    merged = merge_results(vector, lexical, limit=5)
+    assert [item["memory"] for item in merged] == ["works remotely", "likes tea", "cat named Miso"]
+    assert merged[0]["score"] == 0.7
+    assert merged[2]["score"] == 0.5
+    assert len(merge_results(vector, lexical, limit=1)) == 1
@@ -0,0 +1,86 @@
+import threading
+import time
+
+import pytest
+
+import main.llm as llm
+from main.circuit_breaker import CircuitBreaker, OPEN
+from main.deadline import Deadline
+from main.llm_router import LLMEndpoint, LLMRouter
+
+
+class FakeAssistant:
+    """Replaces qwen-agent's Assistant; `script` is a list of snapshots or float pauses (seconds)"""
+    script = []
+
+    def __init__(self, llm=None, system_message=None, function_list=None):
+        pass
+
+    def run(self, messages):
+        for step in self.script:
+            if isinstance(step, float):
+                time.sleep(step)
+            else:
+                yield step
+
+
+@pytest.fixture
+def agent(monkeypatch):
+    breaker = CircuitBreaker("test-llm", failure_threshold=1, recovery_seconds=60)
+    monkeypatch.setattr(llm, "Assistant", FakeAssistant)
+    monkeypatch.setattr(llm, "llm_router", LLMRouter([LLMEndpoint("fake", "http://fake", "fake-model", "key")]))
+    monkeypatch.setattr(llm, "llm_breaker", breaker)
+
+    def run(script, **kwargs):
+        monkeypatch.setattr(FakeAssistant, "script", script)
+        return list(llm.run_agent("system", [], [{"role": "user", "content": "hi"}], **kwargs))
+
+    run.breaker = breaker
+    return run
+
+
+def test_relays_snapshots_and_reports_run_info(agent):
+    run_info = {}
+    snapshots = agent([["a"], ["a", "b"]], run_info=run_info)
+    assert snapshots == [["a"], ["a", "b"]]
+    assert run_info["endpoint"] == "fake" and run_info["attempts"] == 1
+
+
+def test_first_token_timeout(agent):
+    with pytest.raises(llm.LLMTimeoutError, match="first-token"):
+        agent([1.0, ["late"]], first_token_timeout=0.1)
+    assert agent.breaker.state == OPEN
+
+
+def test_inter_token_timeout_after_first_token(agent):
+    with pytest.raises(llm.LLMTimeoutError, match="inter-token"):
+        agent([["a"], 1.0, ["a", "b"]], inter_token_timeout=0.1)
+    assert agent.breaker.state == OPEN
+
+
+def test_deadline_caps_the_timeouts(agent):
+    started = time.monotonic()
+    with pytest.raises(llm.LLMTimeoutError):
+        agent([1.0], first_token_timeout=10, deadline=Deadline(0.1))
+    assert time.monotonic() - started < 0.5
+
+
+def test_cancel_event_ends_a_silent_run(agent):
+    cancel = threading.Event()
+    threading.Timer(0.05, cancel.set).start()
+    started = time.monotonic()
+    assert agent([2.0, ["late"]], cancel_event=cancel) == []
+    assert time.monotonic() - started < 1.0
+    assert agent.breaker.state != OPEN
+
+
+def test_provider_error_before_first_token(agent, monkeypatch):
+    def failing_run(self, messages):
+        raise ConnectionError("connection refused")
+        yield
+
+    monkeypatch.setattr(FakeAssistant, "run", failing_run)
+    with pytest.raises(llm.LLMProviderDownError):
+        list(llm.run_agent("system", [], []))
+    with pytest.raises(llm.LLMProviderDownError, match="circuit breaker"):
+        list(llm.run_agent("system", [], []))
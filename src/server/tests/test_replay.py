@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from main.chat.replay import ReplayBuffer, ReplayStore, ReplayOffsetUnavailable
+
+
+def token(text):
+    return {"type": "assistantStream", "token": text, "done": False}
+
+
+async def collect(buffer, offset=0):
+    return [event async for event in buffer.subscribe(offset)]
+
+
+def test_tokens_are_annotated_with_offsets():
+    buffer = ReplayBuffer("m", "c", max_chars=100)
+    buffer.append(token("ab"))
+    buffer.append(token("cde"))
+    buffer.close()
+    events = asyncio.run(collect(buffer))
+    assert [(e["token"], e["offset"]) for e in events] == [("ab", 0), ("cde", 2)]
+
+
+def test_resume_from_offset_inside_a_token():
+    buffer = ReplayBuffer("m", "c", max_chars=100)
+    buffer.append(token("abc"))
+    buffer.append(token("def"))
+    buffer.append({"type": "assistantStream", "token": "", "done": True})
+    buffer.close()
+    events = asyncio.run(collect(buffer, offset=4))
+    assert events[0] == {**token("ef"), "offset": 4}
+    assert events[-1]["done"] is True
+
+
+def test_subscriber_waits_for_new_events():
+    async def run():
+        buffer = ReplayBuffer("m", "c", max_chars=100)
+        reader = asyncio.create_task(collect(buffer))
+        await asyncio.sleep(0)
+        buffer.append(token("x"))
+        await asyncio.sleep(0)
+        buffer.append(token("y"))
+        buffer.close()
+        return await asyncio.wait_for(reader, timeout=1)
+
+    assert "".join(e["token"] for e in asyncio.run(run())) == "xy"
+
+
+def test_trimmed_offset_is_unavailable():
+    buffer = ReplayBuffer("m", "c", max_chars=4)
+    for text in ("ab", "cd", "ef"):
+        buffer.append(token(text))
+    assert buffer.base_offset == 2
+    with pytest.raises(ReplayOffsetUnavailable):
+        asyncio.run(collect(buffer, offset=0))
+
+
+def test_store_evicts_oldest_finished_buffers():
+    store = ReplayStore(ttl_seconds=60, max_chars=100, max_buffers=2)
+    first = store.create("m1", "c")
+    first.close()
+    store.create("m2", "c")
+    store.create("m3", "c")
+    assert store.get("m1") is None
+    assert store.get("m2") is not None
+    assert [b.message_id for b in store.active()] == ["m2", "m3"]
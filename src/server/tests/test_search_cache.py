@@ -0,0 +1,52 @@
+import time
+
+from main.memory.search_cache import MemorySearchCache, normalize_query
+
+
+def test_normalize_query():
+    assert normalize_query("  What's my  NAME?? ") == "what's my name"
+    assert normalize_query("我叫什么？") == "我叫什么"
+
+
+def test_hit_after_put_with_equivalent_query():
+    cache = MemorySearchCache()
+    version = cache.version("p")
+    cache.put("p", "favorite tea?", 5, [{"memory": "green tea"}], version)
+    assert cache.get("p", "Favorite  tea", 5) == [{"memory": "green tea"}]
+    assert cache.get("p", "favorite tea", 3) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_put_is_dropped_when_partition_was_written_during_search():
+    cache = MemorySearchCache()
+    version = cache.version("p")
+    cache.invalidate("p")
+    cache.put("p", "tea", 5, [{"memory": "stale"}], version)
+    assert cache.get("p", "tea", 5) is None
+
+
+def test_invalidate_clears_only_its_partition():
+    cache = MemorySearchCache()
+    for partition in ("p1", "p2"):
+        cache.put(partition, "tea", 5, [{"memory": partition}], cache.version(partition))
+    cache.invalidate("p1")
+    assert cache.get("p1", "tea", 5) is None
+    assert cache.get("p2", "tea", 5) == [{"memory": "p2"}]
+
+
+def test_returned_results_are_copies():
+    cache = MemorySearchCache()
+    cache.put("p", "tea", 5, [{"memory": "green tea"}], cache.version("p"))
+    cache.get("p", "tea", 5)[0]["memory"] = "mutated"
+    assert cache.get("p", "tea", 5) == [{"memory": "green tea"}]
+
+
+def test_entries_expire_and_are_bounded():
+    cache = MemorySearchCache(max_entries_per_partition=2, ttl_seconds=0.05)
+    version = cache.version("p")
+    for query in ("a", "b", "c"):
+        cache.put("p", query, 5, [], version)
+    assert cache.get("p", "a", 5) is None
+    assert cache.get("p", "c", 5) == []
+    time.sleep(0.06)
+    assert cache.get("p", "c", 5) is None
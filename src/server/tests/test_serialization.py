@@ -0,0 +1,59 @@
+import datetime
+import gzip
+import json
+
+from bson import ObjectId
+from starlette.requests import Request
+
+from main.config import HTTP_GZIP_MIN_BYTES
+from main.serialization import dumps, etag_matches, not_modified, conditional_json_response
+
+
+def make_request(**headers):
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "path": "/",
+        "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()],
+    })
+
+
+def test_dumps_handles_mongo_types():
+    oid = ObjectId()
+    payload = json.loads(dumps({"_id": oid, "at": datetime.datetime(2026, 1, 1)}))
+    assert payload["_id"] == str(oid)
+    assert payload["at"].startswith("2026-01-01T00:00:00")
+
+
+def test_etag_weak_comparison():
+    etag = 'W/"c-1-2-3-50"'
+    assert not etag_matches(make_request(), etag)
+    assert etag_matches(make_request(if_none_match=etag), etag)
+    assert etag_matches(make_request(if_none_match='"c-1-2-3-50"'), etag)
+    assert etag_matches(make_request(if_none_match='W/"other", W/"c-1-2-3-50"'), etag)
+    assert etag_matches(make_request(if_none_match="*"), etag)
+    assert not etag_matches(make_request(if_none_match='W/"c-1-2-4-50"'), etag)
+
+
+def test_not_modified_keeps_etag():
+    response = not_modified('W/"x"')
+    assert response.status_code == 304
+    assert response.headers["etag"] == 'W/"x"'
+
+
+def test_large_responses_are_gzipped_when_accepted():
+    content = {"messages": ["x" * HTTP_GZIP_MIN_BYTES]}
+    response = conditional_json_response(make_request(accept_encoding="gzip, br"), content, 'W/"x"')
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["etag"] == 'W/"x"'
+    assert json.loads(gzip.decompress(response.body)) == content
+
+    plain = conditional_json_response(make_request(), content)
+    assert "content-encoding" not in plain.headers
+    assert "etag" not in plain.headers
+
+
+def test_small_responses_are_not_compressed():
+    response = conditional_json_response(make_request(accept_encoding="gzip"), {"ok": True})
+    assert "content-encoding" not in response.headers
+    assert json.loads(response.body) == {"ok": True}
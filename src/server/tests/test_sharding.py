@@ -0,0 +1,29 @@
+from main.memory.sharding import shard_collection_name, shard_for_user, is_shard_collection
+
+
+def test_single_shard_uses_legacy_collection():
+    assert shard_for_user("u", 1) == 0
+    assert shard_collection_name(0, 1) == "memories"
+
+
+def test_partitions_of_one_user_share_a_shard():
+    shard = shard_for_user("alice", 8)
+    assert 0 <= shard < 8
+    assert shard_for_user("alice:conv-1", 8) == shard
+    assert shard_for_user("alice:conv-2", 8) == shard
+
+
+def test_hash_is_stable_across_processes():
+    # sha1 based, not Python's randomized hash(); a changed value means existing shards are misrouted
+    assert shard_for_user("default-user", 4) == shard_for_user("default-user", 4)
+    assert [shard_for_user(f"user-{i}", 4) for i in range(5)] == [
+        shard_for_user(f"user-{i}:x", 4) for i in range(5)
+    ]
+    assert len({shard_for_user(f"user-{i}", 4) for i in range(100)}) == 4
+
+
+def test_is_shard_collection():
+    assert is_shard_collection("memories")
+    assert is_shard_collection(shard_collection_name(3, 4))
+    assert not is_shard_collection("memories_old")
+    assert not is_shard_collection("mem0migrations")
@@ -0,0 +1,158 @@
+import asyncio
+import datetime
+
+import pytest
+
+import main.db as db
+from main.db import MongoManager
+
+LAG = 15
+
+
+def _matches(doc, query):
+    for key, condition in query.items():
+        if key == "$nor":
+            if any(_matches(doc, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = doc.get(key)
+            for op, operand in condition.items():
+                if op == "$gte" and not value >= operand:
+                    return False
+                if op == "$lte" and not value <= operand:
+                    return False
+                if op == "$eq" and value != operand:
+                    return False
+        elif doc.get(key) != condition:
+            return False
+    return True
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, key, direction=None):
+        keys = [(key, direction)] if isinstance(key, str) else key
+        for field, order in reversed(keys):
+            self.docs.sort(key=lambda d: d[field], reverse=order == -1)
+        return self
+
+    def limit(self, count):
+        self.docs = self.docs[:count]
+        return self
+
+    async def to_list(self, length=None):
+        return [dict(d) for d in self.docs[:length]]
+
+
+class FakeCollection:
+    def __init__(self):
+        self.docs = []
+
+    def find(self, query, projection=None):
+        return FakeCursor([d for d in self.docs if _matches(d, query)])
+
+    async def find_one(self, query, projection=None):
+        return next((dict(d) for d in self.docs if _matches(d, query)), None)
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    monkeypatch.setattr(db, "SYNC_SAFETY_LAG_SECONDS", LAG)
+    manager = MongoManager.__new__(MongoManager)
+    manager.messages_collection = FakeCollection()
+    manager.tombstones_collection = FakeCollection()
+    manager.conversations_collection = FakeCollection()
+    return manager
+
+
+def now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def add_message(manager, message_id, seconds_ago):
+    manager.messages_collection.docs.append({
+        "message_id": message_id, "user_id": "u", "conversation_id": "c", "role": "user",
+        "content": message_id, "timestamp": now() - datetime.timedelta(seconds=seconds_ago),
+    })
+
+
+def add_tombstone(manager, tombstone_id, kind, message_id=None, seconds_ago=0):
+    manager.tombstones_collection.docs.append({
+        "tombstone_id": tombstone_id, "user_id": "u", "conversation_id": "c", "kind": kind,
+        "message_id": message_id, "deleted_at": now() - datetime.timedelta(seconds=seconds_ago),
+    })
+
+
+def sync(manager, cursor, limit=200):
+    return asyncio.run(manager.get_changes_since("u", "c", cursor=cursor, limit=limit))
+
+
+def test_without_cursor_resets_and_holds_the_cursor_behind_the_lag(manager):
+    add_message(manager, "m1", seconds_ago=60)
+    changes = sync(manager, None)
+    assert changes["reset"] is True
+    assert [m["message_id"] for m in changes["messages"]] == ["m1"]
+    assert changes["cursor"][0] <= now() - datetime.timedelta(seconds=LAG)
+
+
+def test_changes_inside_the_lag_window_are_returned_again(manager):
+    cursor = (now() - datetime.timedelta(seconds=120), "")
+    add_message(manager, "old", seconds_ago=60)
+    add_message(manager, "recent", seconds_ago=1)
+    first = sync(manager, cursor)
+    assert [m["message_id"] for m in first["messages"]] == ["old", "recent"]
+    assert first["cursor"][0] <= now() - datetime.timedelta(seconds=LAG)
+
+    second = sync(manager, first["cursor"])
+    assert [m["message_id"] for m in second["messages"]] == ["recent"]
+
+
+def test_write_committed_out_of_timestamp_order_is_not_skipped(manager):
+    add_message(manager, "newer", seconds_ago=1)
+    first = sync(manager, (now() - datetime.timedelta(seconds=120), ""))
+    # A message stamped before "newer" becomes visible only after the first sync
+    add_message(manager, "late", seconds_ago=3)
+    second = sync(manager, first["cursor"])
+    assert "late" in [m["message_id"] for m in second["messages"]]
+
+
+def test_tombstones_and_clear(manager):
+    cursor = (now() - datetime.timedelta(seconds=120), "")
+    add_message(manager, "m1", seconds_ago=90)
+    add_tombstone(manager, "t1", "message", message_id="m0", seconds_ago=80)
+    assert sync(manager, cursor)["deleted"] == ["m0"]
+
+    add_tombstone(manager, "t2", "clear", seconds_ago=70)
+    add_message(manager, "m2", seconds_ago=60)
+    changes = sync(manager, cursor)
+    assert changes["cleared"] is True
+    assert changes["deleted"] == []
+    assert [m["message_id"] for m in changes["messages"]] == ["m2"]
+
+
+def test_truncated_page_advances_to_its_last_event(manager):
+    cursor = (now() - datetime.timedelta(seconds=120), "")
+    for i in range(3):
+        add_message(manager, f"m{i}", seconds_ago=90 - i)
+    page = sync(manager, cursor, limit=2)
+    assert [m["message_id"] for m in page["messages"]] == ["m0", "m1"]
+    assert page["has_more"] is True
+    assert page["cursor"][1] == "m1"
+    assert [m["message_id"] for m in sync(manager, page["cursor"], limit=2)["messages"]] == ["m2"]
+
+
+def test_truncated_page_inside_the_window_does_not_ask_for_more(manager):
+    cursor = (now() - datetime.timedelta(seconds=5), "")
+    for i in range(3):
+        add_message(manager, f"m{i}", seconds_ago=3 - i)
+    page = sync(manager, cursor, limit=2)
+    assert page["has_more"] is False
+    assert page["cursor"] == cursor
+
+
+def test_cursor_older_than_tombstone_retention_resets(manager):
+    add_message(manager, "m1", seconds_ago=60)
+    expired = (now() - datetime.timedelta(days=db.MESSAGE_TOMBSTONE_TTL_DAYS + 1), "")
+    assert sync(manager, expired)["reset"] is True
@@ -0,0 +1,33 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from main.chat.ws import router
+
+
+def make_client():
+    app = FastAPI()
+    app.include_router(router)
+    return TestClient(app)
+
+
+def test_malformed_frame_keeps_the_connection_open():
+    with make_client().websocket_connect("/api/chat/ws") as ws:
+        ws.send_text("{not json")
+        assert ws.receive_json() == {"type": "error", "message": "Frames must be JSON objects"}
+        ws.send_text("[1, 2]")
+        assert ws.receive_json() == {"type": "error", "message": "Frames must be JSON objects"}
+        # The connection still serves frames after the bad ones
+        ws.send_json({"type": "cancel", "stream_id": "s1"})
+        assert ws.receive_json() == {"type": "error", "message": "Unknown stream", "stream_id": "s1"}
+
+
+def test_frames_require_a_stream_id():
+    with make_client().websocket_connect("/api/chat/ws") as ws:
+        ws.send_json({"type": "ack", "offset": 3})
+        assert ws.receive_json() == {"type": "error", "message": "stream_id is required"}
+
+
+def test_resume_of_unknown_message_is_reported_on_its_stream():
+    with make_client().websocket_connect("/api/chat/ws") as ws:
+        ws.send_json({"type": "resume", "stream_id": "s1", "messageId": "missing", "offset": 0})
+        assert ws.receive_json() == {"type": "error", "message": "Stream not found or expired", "stream_id": "s1"}